@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+'''
+Memory and throughput benchmark of decoding register words into field
+values with XmlDb.convert_field() (lazy FieldValue objects) compared to
+eagerly building the nested dicts with all representations (as
+convert_field() did before, FieldValue.to_dict()).
+
+For each variant, N random register words of the field ENTITY NAME of the
+XmlDb found via $XMLDB are decoded and kept in a list. Reported are the
+decoding time, the time to additionally access a single representation
+(as done by the IOC) and the memory held by the list of results.
+
+Example:
+    XMLDB=/path/to/daqtools/xml-db python benchmarks/field_values.py TrbNet CompileTime -n 100000
+'''
+
+import random, time, tracemalloc
+
+import click
+
+from trbnet.xmldb import XmlDb
+
+def _lazy(db, entity, field_name, words):
+    return [db.convert_field(entity, field_name, word, trb_address=0x8000 + i % 64) for i, word in enumerate(words)]
+
+def _eager(db, entity, field_name, words):
+    return [db.convert_field(entity, field_name, word, trb_address=0x8000 + i % 64).to_dict() for i, word in enumerate(words)]
+
+def _measure(decode, db, entity, field_name, words, representation):
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = decode(db, entity, field_name, words)
+    decoded = time.perf_counter()
+    for data in results:
+        data['context']['identifier'], data['value'][representation]
+    accessed = time.perf_counter()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return decoded - start, accessed - start, memory
+
+@click.command()
+@click.argument('entity')
+@click.argument('name')
+@click.option('-n', 'count', type=int, default=100000, help='number of register words to decode')
+@click.option('--representation', type=click.Choice(['raw', 'python', 'string', 'unicode']), default='python',
+              help='representation accessed after decoding')
+def main(entity, name, count, representation):
+    db = XmlDb()
+    words = [random.getrandbits(32) for _ in range(count)]
+    db.convert_field(entity, name, 0)  # warm up the XmlDb caches
+    click.echo('%d values of %s %s' % (count, entity, name))
+    click.echo('%-8s %12s %12s %12s %14s' % ('variant', 'decode [s]', '+access [s]', 'values/s', 'memory [MiB]'))
+    for variant, decode in (('eager', _eager), ('lazy', _lazy)):
+        decode_time, total_time, memory = _measure(decode, db, entity, name, words, representation)
+        click.echo('%-8s %12.3f %12.3f %12.0f %14.1f' % (variant, decode_time, total_time,
+                                                          count / total_time, memory / 2**20))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+/*
+ * Minimal stand-in for libtrbnet.so answering instantly from memory, used by
+ * benchmarks/lowlevel.py to measure the Python side overhead of the calls.
+ * The boards 0x8000 and 0x8001 answer to themselves and to 0xffff.
+ *
+ * Build:
+ *     gcc -O2 -shared -fPIC -o libtrbnet_stub.so benchmarks/libtrbnet_stub.c
+ */
+#include <stdint.h>
+#include <stdio.h>
+
+typedef struct {
+  uint16_t status_common;
+  uint16_t status_channel;
+  uint16_t sequence;
+  uint8_t channel;
+} TRB_TERM;
+
+int trb_errno = 0;
+TRB_TERM trb_term = {0, 0, 0, 0};
+static uint32_t registers[0x10000];
+static const uint16_t boards[] = {0x8000, 0x8001};
+
+static int responders(uint16_t trb_address) {
+  if (trb_address == 0xffff) return 2;
+  if (trb_address == 0x8000 || trb_address == 0x8001) return 1;
+  trb_errno = 18; /* TRB_ENDPOINT_NOT_REACHED */
+  return 0;
+}
+
+static uint16_t responder(uint16_t trb_address, int i) {
+  return trb_address == 0xffff ? boards[i] : trb_address;
+}
+
+int init_ports(void) { return 0; }
+int close_ports(void) { return 0; }
+
+int trb_register_read(uint16_t trb_address, uint16_t reg_address, uint32_t *data, unsigned int dsize) {
+  int n = responders(trb_address), o = 0;
+  if (!n || dsize < 2 * n) return -1;
+  for (int i = 0; i < n; i++) {
+    data[o++] = responder(trb_address, i);
+    data[o++] = registers[reg_address];
+  }
+  return o;
+}
+
+int trb_register_read_mem(uint16_t trb_address, uint16_t reg_address, uint8_t option, uint16_t size,
+                          uint32_t *data, unsigned int dsize) {
+  int n = responders(trb_address), o = 0;
+  if (!n || dsize < n * (size + 1)) return -1;
+  for (int i = 0; i < n; i++) {
+    data[o++] = ((uint32_t)size << 16) | responder(trb_address, i);
+    for (int k = 0; k < size; k++)
+      data[o++] = registers[(uint16_t)(option ? reg_address : reg_address + k)];
+  }
+  return o;
+}
+
+int trb_registertime_read_mem(uint16_t trb_address, uint16_t reg_address, uint8_t option, uint16_t size,
+                              uint32_t *data, unsigned int dsize) {
+  return trb_register_read_mem(trb_address, reg_address, option, size, data, dsize);
+}
+
+int trb_register_write(uint16_t trb_address, uint16_t reg_address, uint32_t value) {
+  if (!responders(trb_address)) return -1;
+  registers[reg_address] = value;
+  return 0;
+}
+
+int trb_register_write_mem(uint16_t trb_address, uint16_t reg_address, uint8_t option, const uint32_t *data, uint16_t size) {
+  if (!responders(trb_address)) return -1;
+  for (int k = 0; k < size; k++)
+    registers[(uint16_t)(option ? reg_address : reg_address + k)] = data[k];
+  return 0;
+}
+
+int trb_read_uid(uint16_t trb_address, uint32_t *data, unsigned int dsize) {
+  int n = responders(trb_address), o = 0;
+  if (!n || dsize < 4 * n) return -1;
+  for (int i = 0; i < n; i++) {
+    data[o++] = 0x12345678;
+    data[o++] = i;
+    data[o++] = 0;
+    data[o++] = responder(trb_address, i);
+  }
+  return o;
+}
+
+int trb_set_address(uint64_t uid, uint8_t endpoint, uint16_t trb_address) { return 0; }
+int network_reset(void) { return 0; }
+int com_reset(void) { return 0; }
+int trb_fifo_flush(uint8_t channel) { return 0; }
+int trb_send_trigger(uint8_t trigtype, uint32_t info, uint8_t random, uint16_t number) { return 0; }
+int trb_register_setbit(uint16_t trb_address, uint16_t reg_address, uint32_t bitmask) { registers[reg_address] |= bitmask; return 0; }
+int trb_register_clearbit(uint16_t trb_address, uint16_t reg_address, uint32_t bitmask) { registers[reg_address] &= ~bitmask; return 0; }
+int trb_register_loadbit(uint16_t trb_address, uint16_t reg_address, uint32_t bitmask, uint32_t bitvalue) {
+  registers[reg_address] = (registers[reg_address] & ~bitmask) | (bitvalue & bitmask);
+  return 0;
+}
+int trb_ipu_data_read(uint8_t type, uint8_t info, uint8_t random, uint16_t number, uint32_t *data, unsigned int dsize) { return 0; }
+int trb_nettrace(uint16_t trb_address, uint32_t *data, unsigned int dsize) { return 0; }
+
+const char *trb_errorstr(int errno_) {
+  static char buffer[64];
+  snprintf(buffer, sizeof(buffer), "stub error %d", errno_);
+  return buffer;
+}
+
+const char *trb_termstr(TRB_TERM term) { return "stub term"; }
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+Benchmark of the Python side overhead of the low level calls: calls per
+second of every method of _TrbNet compared to _FastTrbNet (with the ctypes
+and, if installed, the cffi binding), using a stub libtrbnet.so which
+answers instantly from memory.
+
+Build the stub and run the benchmark with:
+    gcc -O2 -shared -fPIC -o /tmp/libtrbnet_stub.so benchmarks/libtrbnet_stub.c
+    LIBTRBNET=/tmp/libtrbnet_stub.so python benchmarks/lowlevel.py --duration 1
+'''
+
+import time
+
+import click
+
+from trbnet.core.lowlevel import _TrbNet
+from trbnet.core.fast import _FastTrbNet
+
+CALLS = {
+    'trb_register_read': lambda t, size: t.trb_register_read(0xffff, 0x40),
+    'trb_register_read_mem': lambda t, size: t.trb_register_read_mem(0xffff, 0x40, 0, size),
+    '_trb_register_read_mem': lambda t, size: t._trb_register_read_mem(0xffff, 0x40, 0, size),
+    'trb_register_write': lambda t, size: t.trb_register_write(0x8000, 0x40, 0x1),
+    'trb_register_write_mem': lambda t, size: t.trb_register_write_mem(0x8000, 0x40, 0, [0x1] * size),
+    'trb_read_uid': lambda t, size: t.trb_read_uid(0xffff),
+    'trb_register_setbit': lambda t, size: t.trb_register_setbit(0x8000, 0x40, 0x1),
+    'trb_set_address': lambda t, size: t.trb_set_address(0x12345678, 0, 0x8000),
+}
+
+def _backends(buffersize):
+    yield '_TrbNet', _TrbNet(buffersize=buffersize)
+    yield 'fast ctypes', _FastTrbNet(buffersize=buffersize)
+    try:
+        yield 'fast cffi', _FastTrbNet(binding='cffi', buffersize=buffersize)
+    except ImportError as e:
+        click.echo('skipping the cffi binding: %s' % e, err=True)
+
+def _calls_per_second(call, trbnet, size, duration):
+    count, start = 0, time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            call(trbnet, size)
+        count += 100
+    return count / (time.perf_counter() - start)
+
+@click.command()
+@click.option('--duration', type=float, default=1.0, help='seconds per method and backend')
+@click.option('--size', type=int, default=16, help='number of registers of the *_mem calls')
+@click.option('--buffersize', type=int, default=4194304, help='size of the response buffer in 32-bit words')
+def main(duration, size, buffersize):
+    backends = list(_backends(buffersize))
+    click.echo('%-24s' % 'calls/s' + ''.join('%14s' % name for name, _ in backends))
+    for method, call in CALLS.items():
+        rates = [_calls_per_second(call, trbnet, size, duration) for _, trbnet in backends]
+        click.echo('%-24s' % method + ''.join('%14.0f' % rate for rate in rates))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''
+Benchmark of the TrbNet proxy (trbnet.core.proxy) using FakeTrbNet
+as the backend of the proxy, so no hardware is needed.
+
+For an increasing number of client processes, every client reads
+registers through the proxy for a fixed time. In the 'same' mode all
+clients read the same register (the proxy coalesces concurrent reads),
+in the 'distinct' mode every client reads its own register. With
+--pipeline N the clients send N requests before waiting for the responses.
+
+Example:
+    python benchmarks/proxy.py --latency 0.0002 --clients 1,2,4,8,16
+'''
+
+import multiprocessing, os, tempfile, time
+
+import click
+
+from trbnet.core import FakeTrbNet, ProxyTrbNet, TrbNetProxyServer
+
+def _serve(address, latency):
+    TrbNetProxyServer(FakeTrbNet(latency=latency), address=address).run()
+
+def _client(args):
+    address, client, mode, pipeline, duration = args
+    proxy = ProxyTrbNet(address)
+    if mode == 'same':
+        requests = [(0xffff, 0x40)] * pipeline
+    else:
+        requests = [(0xffff, 0x1000 + client * pipeline + i) for i in range(pipeline)]
+    start, count = time.monotonic(), 0
+    while time.monotonic() - start < duration:
+        if pipeline > 1:
+            proxy.register_read_many(requests)
+        else:
+            proxy.register_read(*requests[0])
+        count += pipeline
+    return count / (time.monotonic() - start)
+
+@click.command()
+@click.option('--latency', type=float, default=0.0002, help='simulated time per TrbNet transaction in seconds')
+@click.option('--clients', default='1,2,4,8,16', help='comma separated numbers of client processes')
+@click.option('--mode', type=click.Choice(['same', 'distinct']), multiple=True, default=['same', 'distinct'],
+              help='read the same register from all clients or a distinct register per client')
+@click.option('--pipeline', type=int, default=1, help='requests sent by a client before waiting for the responses')
+@click.option('--duration', type=float, default=2.0, help='measurement time per configuration in seconds')
+def main(latency, clients, mode, pipeline, duration):
+    ctx = multiprocessing.get_context('spawn')
+    address = 'unix:' + os.path.join(tempfile.mkdtemp(), 'trbnet-proxy.sock')
+    server = ctx.Process(target=_serve, args=(address, latency), daemon=True)
+    server.start()
+    while not os.path.exists(address[len('unix:'):]):
+        time.sleep(0.01)
+    try:
+        statistics = ProxyTrbNet(address)
+        click.echo('%.2f ms per transaction, pipeline depth %d' % (latency * 1000, pipeline))
+        click.echo('%-10s %8s %14s %14s %12s' % ('mode', 'clients', 'requests/s', 'per client', 'coalesced'))
+        for read_mode in mode:
+            for n in [int(n) for n in clients.split(',')]:
+                before = statistics.proxy_statistics()
+                with ctx.Pool(n) as pool:
+                    rates = pool.map(_client, [(address, client, read_mode, pipeline, duration) for client in range(n)])
+                after = statistics.proxy_statistics()
+                requests = after['requests'] - before['requests']
+                coalesced = after['coalesced'] - before['coalesced']
+                click.echo('%-10s %8d %14.0f %14.0f %11.0f%%' % (read_mode, n, sum(rates), sum(rates) / n,
+                                                                  100.0 * coalesced / requests if requests else 0))
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    main()
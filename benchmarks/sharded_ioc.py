@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+'''
+Scaling benchmark of the sharded IOC scanning (trbnet.epics.sharded)
+using FakeTrbNet instead of libtrbnet.so, so no hardware is needed.
+
+Every simulated board is subscribed to individually (ENTITY NAME of the
+XmlDb found via $XMLDB) and the subscriptions are scanned continuously by
+1, 2, 4, ... worker processes. Reported are the full scans of all boards
+per second and the PV updates per second written to the shared table.
+
+Example:
+    XMLDB=/path/to/daqtools/xml-db python benchmarks/sharded_ioc.py TrbNet StatusRegisters --boards 64 --latency 0.0005
+'''
+
+import functools, time
+
+import click
+
+from trbnet.core import FakeTrbNet
+from trbnet.epics import TrbNetIOC
+from trbnet.epics.pcaspy_ioc import SubscriptionScanner, connect_trbnet
+from trbnet.epics.sharded import ShardedScanner
+
+def build_ioc(entity, name, boards):
+    ioc = TrbNetIOC()
+    addresses = [0x8000 + board for board in range(boards)]
+    for trb_address in addresses:
+        ioc.add_subscription(trb_address, entity, name)
+        ioc.add_expected_trb_addresses(trb_address, [trb_address])
+    ioc.initialize(live=False)
+    return ioc, {trb_address: [trb_address] for trb_address in addresses}
+
+def run_in_process(ioc, factory, duration):
+    connect_trbnet(factory)
+    updates = [0]
+    def publish(reason, value):
+        updates[0] += 1
+    scanner = SubscriptionScanner(ioc._subscriptions, ioc._pvdb_manager, publish, lambda reasons: None)
+    start, scans = time.monotonic(), 0
+    while time.monotonic() - start < duration:
+        scanner.scan_all()
+        scans += 1
+    elapsed = time.monotonic() - start
+    return scans / elapsed, updates[0] / elapsed
+
+def run_sharded(ioc, factory, workers, duration):
+    sharded = ShardedScanner(ioc._subscriptions, ioc._pvdb_manager, ioc._pvdb, workers=workers,
+                             scan_period=0, trbnet_factory=factory)
+    last_sequence = sharded.table.sequence.copy()
+    sharded.start()
+    try:
+        # wait until all workers have completed a first scan (process start up, XmlDb parsing)
+        while not all(shard['scans'] for shard in sharded.statistics()):
+            time.sleep(0.01)
+        sharded.table.read_changes(last_sequence)
+        before = [shard['scans'] for shard in sharded.statistics()]
+        writes_before = int(sharded.table.sequence.sum())
+        start = time.monotonic()
+        while time.monotonic() - start < duration:
+            # poll the table like the IOC process does
+            time.sleep(0.05)
+            sharded.table.read_changes(last_sequence)
+        elapsed = time.monotonic() - start
+        # every update of a PV increments its sequence number by two
+        updates = (int(sharded.table.sequence.sum()) - writes_before) // 2
+        scans = [shard['scans'] - scans_before for shard, scans_before in zip(sharded.statistics(), before)]
+    finally:
+        sharded.stop()
+    # every shard scans its part of the subscriptions, the slowest one limits full scans
+    full_scans = min(shard_scans for shard_scans in scans)
+    return full_scans / elapsed, updates / elapsed
+
+@click.command()
+@click.argument('entity')
+@click.argument('name')
+@click.option('--boards', type=int, default=32, help='number of simulated boards')
+@click.option('--latency', type=float, default=0.0005, help='simulated time per TrbNet transaction in seconds')
+@click.option('--word-latency', type=float, default=0.0, help='simulated time per response word in seconds')
+@click.option('--workers', default='1,2,4,8', help='comma separated numbers of worker processes')
+@click.option('--duration', type=float, default=3.0, help='measurement time per configuration in seconds')
+def main(entity, name, boards, latency, word_latency, workers, duration):
+    ioc, endpoints = build_ioc(entity, name, boards)
+    factory = functools.partial(FakeTrbNet, endpoints=endpoints, latency=latency, word_latency=word_latency)
+    click.echo('%d boards, %d PVs, %.2f ms per transaction' % (boards, len(ioc.all_pvs), latency * 1000))
+    click.echo('%-12s %14s %16s %8s' % ('workers', 'full scans/s', 'PV updates/s', 'speedup'))
+    baseline, updates = run_in_process(ioc, factory, duration)
+    click.echo('%-12s %14.1f %16.0f %8s' % ('in-process', baseline, updates, '1.00'))
+    for n in [int(n) for n in workers.split(',')]:
+        scans, updates = run_sharded(ioc, factory, n, duration)
+        click.echo('%-12d %14.1f %16.0f %8.2f' % (n, scans, updates, scans / baseline))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+# trbnet.util.trbcmd creates its XmlDb from $XMLDB when it is imported
+XMLDB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xmldb')
+os.environ['XMLDB'] = XMLDB
+
+from trbnet.xmldb import XmlDb
+
+
+@pytest.fixture
+def db():
+    return XmlDb(XMLDB)
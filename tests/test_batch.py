@@ -0,0 +1,59 @@
+import pytest
+
+from trbnet.core.error import TrbException, TrbError
+from trbnet.core.fake import FakeTrbNet
+from trbnet.util import trbcmd
+
+
+class UnmappedFakeTrbNet(FakeTrbNet):
+    '''
+    FakeTrbNet failing every read that includes one of the unmapped registers.
+    '''
+
+    def __init__(self, unmapped, **kwargs):
+        super().__init__(**kwargs)
+        self.unmapped = set(unmapped)
+
+    def _read(self, trb_address, reg_addresses):
+        if self.unmapped.intersection(reg_addresses.tolist()):
+            self._errno = TrbError.TRB_INVALID_ADDRESS
+            raise TrbException('Error while reading trb register.', self._errno, self.trb_errorstr(self._errno))
+        return super()._read(trb_address, reg_addresses)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeTrbNet(rate=0)
+    monkeypatch.setattr(trbcmd, 't', fake)
+    return fake
+
+def test_parse_batch_line_expands_addresses():
+    assert trbcmd._parse_batch_line('r 0x8000,0x8001 0x0-0x1') == [
+        ('r', 0x8000, 0x0), ('r', 0x8000, 0x1), ('r', 0x8001, 0x0), ('r', 0x8001, 0x1)]
+    assert trbcmd._parse_batch_line('  # comment') == []
+    with pytest.raises(ValueError):
+        trbcmd._parse_batch_line('w 0x8000 0x20')
+
+def test_coalesce_reads():
+    commands = [('r', 0x8000, 0x40), ('r', 0x8000, 0x41), ('r', 0x8001, 0x42), ('w', 0x8000, 0x0, 1), ('r', 0x8000, 0x43)]
+    assert list(trbcmd._coalesce_reads(commands)) == [
+        ('r*', 0x8000, 0x40, 2), ('r*', 0x8001, 0x42, 1), ('w', 0x8000, 0x0, 1), ('r*', 0x8000, 0x43, 1)]
+
+def test_batch_coalesces_adjacent_reads(fake, capsys):
+    executed, failed = trbcmd._batch(['r 0x8000 0x40', 'r 0x8000 0x41', 'r 0x8000 0x42'], logger=None)
+    assert (executed, failed) == (3, 0)
+    assert fake.transactions == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ['endpoint 0x%08X responded with: %08X' % (0x8000, reg_address << 16) for reg_address in (0x40, 0x41, 0x42)]
+
+def test_batch_counts_failures(fake):
+    executed, failed = trbcmd._batch(['w 0x8000 0x20 0x1', 'bogus line "', 'r 0x9999 0x0', 'r 0x8000 0x20'], logger=None)
+    assert (executed, failed) == (4, 2)
+    assert fake.registers[(0x8000, 0x20)] == 0x1
+
+def test_batch_failing_register_only_fails_its_own_read(monkeypatch, capsys):
+    monkeypatch.setattr(trbcmd, 't', UnmappedFakeTrbNet([0x41], rate=0))
+    executed, failed = trbcmd._batch(['r 0x8000 0x40', 'r 0x8000 0x41', 'r 0x8000 0x42'], logger=None)
+    assert (executed, failed) == (3, 1)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ['endpoint 0x%08X responded with: %08X' % (0x8000, reg_address << 16) for reg_address in (0x40, 0x42)]
@@ -0,0 +1,59 @@
+from trbnet.core.cache import RegisterCache
+from trbnet.core.fake import FakeTrbNet
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_expiry():
+    clock = Clock()
+    cache = RegisterCache(ttls={0x40: 10.0}, clock=clock)
+    cache.put(0xffff, 0x40, {0x8000: [1], 0x8001: [2]})
+    assert cache.get(0xffff, 0x40) == {0x8000: [1], 0x8001: [2]}
+    # filled by the broadcast
+    assert cache.get(0x8001, 0x40) == {0x8001: [2]}
+    clock.now = 10.0
+    assert cache.get(0xffff, 0x40) is None
+
+def test_registers_without_ttl_are_not_cached():
+    cache = RegisterCache(ttls={0x40: 10.0})
+    cache.put(0x8000, 0x40, {0x8000: [1, 2]})
+    assert cache.get(0x8000, 0x40) == {0x8000: [1]}
+    assert cache.get(0x8000, 0x40, 2) is None
+
+def test_scoped_ttls():
+    cache = RegisterCache()
+    cache.set_ttl([0x40], 10.0, trb_addresses=[0xffff, 0x8000])
+    cache.put(0xffff, 0x40, {0x8000: [1], 0x9000: [2]})
+    assert cache.get(0x8000, 0x40) == {0x8000: [1]}
+    # same register address of a board of another entity
+    assert cache.get(0x9000, 0x40) is None
+
+def test_writes_invalidate():
+    trbnet = FakeTrbNet(rate=0)
+    cache = trbnet.enable_cache(ttls={address: 10.0 for address in range(0x40, 0x48)})
+    assert trbnet.register_read_mem(0x8000, 0x40, 0, 8)[0x8000][0] == 0x40 << 16
+    transactions = trbnet.transactions
+    assert trbnet.register_read(0x8000, 0x41) == {0x8000: 0x41 << 16}
+    assert trbnet.transactions == transactions
+    trbnet.register_write(0x8000, 0x41, 0x1234)
+    assert trbnet.register_read(0x8000, 0x41) == {0x8000: 0x1234}
+    assert cache.statistics()['invalidations'] == 1
+
+def test_fifo_write_only_invalidates_its_register():
+    trbnet = FakeTrbNet(rate=0)
+    cache = trbnet.enable_cache(ttls={address: 10.0 for address in range(0x40, 0x48)})
+    trbnet.register_read_mem(0x8000, 0x40, 0, 8)
+    trbnet.trb_register_write_mem(0x8000, 0x40, 1, [1, 2, 3, 4])
+    assert cache.get(0x8000, 0x40) is None
+    assert cache.get(0x8000, 0x41, 7) is not None
+    assert trbnet.register_read(0x8000, 0x40) == {0x8000: 4}
+    trbnet.trb_register_write_mem(0x8000, 0x40, 0, [5, 6])
+    assert cache.get(0x8000, 0x41) is None
+    assert cache.get(0x8000, 0x42, 6) is not None
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+pytest.importorskip('pcaspy')
+
+from trbnet.epics.pcaspy_ioc import TrbNetIOC
+
+
+def compiled_ioc():
+    ioc = TrbNetIOC()
+    ioc.add_subscription(0xffff, 'TrbNet', 'StatusRegisters')
+    ioc.add_subscription(0xffff, 'TrbNet', 'HitCounter', rates=True)
+    ioc.add_subscription(0x8000, 'TrbNet', 'CompileTime')
+    ioc.add_expected_trb_addresses(0xffff, [0x8000, 0x8001])
+    ioc.add_expected_trb_addresses(0x8000, [0x8000])
+    ioc.add_history('TrbNet-0x8000-TempSensor', 10)
+    ioc.initialize(live=False)
+    return ioc
+
+def test_initialize_without_trbnet():
+    ioc = compiled_ioc()
+    assert 'TrbNet-0x8001-Hits.1' in ioc.all_pvs
+    assert 'TrbNet-0x8001-Hits.1:rate' in ioc.all_pvs
+    assert 'TrbNet-0x8000-TempSensor:history' in ioc.all_pvs
+
+def test_compiled_round_trip(tmp_path):
+    ioc = compiled_ioc()
+    path = str(tmp_path / 'ioc.json')
+    ioc.save_compiled(path)
+    loaded = TrbNetIOC()
+    loaded.load_compiled(path)
+    assert sorted(loaded.all_pvs) == sorted(ioc.all_pvs)
+    assert loaded._pvdb == ioc._pvdb
+    manager, loaded_manager = ioc._pvdb_manager, loaded._pvdb_manager
+    assert loaded_manager.subscription_pvs == manager.subscription_pvs
+    # the plans consist of tuples, which become lists in the file
+    plans = lambda manager: json.dumps([manager.scan_plans[subscription] for subscription in ioc._subscriptions])
+    assert plans(loaded_manager) == plans(manager)
+    assert loaded_manager.histories == manager.histories
+    assert loaded_manager.responders((0xffff, 'TrbNet', 'StatusRegisters')) == [0x8000, 0x8001]
+
+def test_history_patterns_on_top_of_compiled(tmp_path):
+    path = str(tmp_path / 'ioc.json')
+    compiled_ioc().save_compiled(path)
+    loaded = TrbNetIOC()
+    loaded.add_history('TrbNet-0x8001-*', 5)
+    loaded.load_compiled(path)
+    assert 'TrbNet-0x8000-TempSensor:history' in loaded.all_pvs
+    assert 'TrbNet-0x8001-TempSensor:history' in loaded.all_pvs
+    assert not any(pv.endswith(':min:min') for pv in loaded.all_pvs)
@@ -0,0 +1,29 @@
+from trbnet.core.fake import FakeTrbNet
+from trbnet.util.dump import read_plan, execute_plan, write_dump, read_dump, dump_registers, _merge_blocks
+
+
+def test_merge_blocks():
+    assert _merge_blocks([(0x10, 2), (0x0, 3), (0x3, 2), (0x11, 4)]) == [(0x0, 5), (0x10, 5)]
+    assert _merge_blocks([(0x0, 5)], max_size=2) == [(0x0, 2), (0x2, 2), (0x4, 1)]
+
+def test_dump_round_trip(db, tmp_path):
+    trbnet = FakeTrbNet(rate=0)
+    trbnet.register_write(0x8001, 0x40, 0x5a000000)
+    targets = [(0xffff, 'TrbNet'), (0x9999, 'TrbNet')]
+    plan = read_plan(db, targets)
+    assert (0xffff, 0x0, 3) in plan
+    results = execute_plan(plan, trbnet=trbnet)
+    path = str(tmp_path / 'registers.dump')
+    write_dump(path, targets, results, duration=0.1)
+    header, data = read_dump(path)
+    assert header['targets'] == [list(target) for target in targets]
+    # 0x9999 doesn't respond
+    assert header['errors'] and all(error[0] == 0x9999 for error in header['errors'])
+    registers = dump_registers(path)
+    assert sorted(registers) == [0x8000, 0x8001]
+    for block in plan:
+        if block[0] == 0xffff:
+            trb_address, start, size = block
+            for reg_address in range(start, start + size):
+                assert registers[0x8000][reg_address] == reg_address << 16
+    assert registers[0x8001][0x40] == 0x5a000000
@@ -0,0 +1,42 @@
+import csv, io, json
+
+from trbnet.util.output import WRITERS, BinaryWriter
+
+
+def values(db):
+    return [db.convert_field('TrbNet', 'CompileTime', 0x5a000000, trb_address=0x8000),
+            db.convert_field('TrbNet', 'Hits', 42, trb_address=0x8001, slice=1)]
+
+def write(db, format):
+    stream = io.BytesIO() if WRITERS[format].binary else io.StringIO()
+    writer = WRITERS[format](stream)
+    for data in values(db):
+        writer.write(data, 1.5)
+    writer.close()
+    return stream.getvalue()
+
+def test_text(db):
+    lines = write(db, 'text').splitlines()
+    assert len(lines) == 2
+    assert lines[1].startswith('TrbNet-0x8001-Hits.1 42')
+
+def test_json(db):
+    records = json.loads(write(db, 'json'))
+    assert [record['identifier'] for record in records] == ['TrbNet-0x8000-CompileTime', 'TrbNet-0x8001-Hits.1']
+    assert records[1]['raw'] == 42 and records[1]['slice'] == 1 and records[1]['timestamp'] == 1.5
+
+def test_ndjson(db):
+    records = [json.loads(line) for line in write(db, 'ndjson').splitlines()]
+    assert records == json.loads(write(db, 'json'))
+
+def test_csv(db):
+    rows = list(csv.DictReader(io.StringIO(write(db, 'csv'))))
+    assert [row['identifier'] for row in rows] == ['TrbNet-0x8000-CompileTime', 'TrbNet-0x8001-Hits.1']
+    assert rows[0]['raw'] == str(0x5a000000)
+
+def test_binary(db):
+    data = write(db, 'binary')
+    assert len(data) == 2 * BinaryWriter.RECORD.size
+    timestamp, trb_address, address, slice, start, bits, raw = BinaryWriter.RECORD.unpack_from(data, BinaryWriter.RECORD.size)
+    assert (timestamp, trb_address, slice, start, bits, raw) == (1.5, 0x8001, 1, 0, 16, 42)
+    assert BinaryWriter.RECORD.unpack_from(data)[3] == 0xffff
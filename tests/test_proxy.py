@@ -0,0 +1,58 @@
+import os, threading, time
+
+import pytest
+
+from trbnet.core.error import TrbException, TrbError
+from trbnet.core.fake import FakeTrbNet
+from trbnet.core.proxy import TrbNetProxyServer, ProxyTrbNet
+
+
+class WarningFakeTrbNet(FakeTrbNet):
+    '''
+    FakeTrbNet whose reads of register 0x20 succeed with status bits set.
+    '''
+
+    def _read(self, trb_address, reg_addresses):
+        lin_data = super()._read(trb_address, reg_addresses)
+        if 0x20 in reg_addresses.tolist():
+            self._errno = TrbError.TRB_STATUS_WARNING
+        return lin_data
+
+    def trb_term(self):
+        return (0x0001, 0x0002, 3, 4) if self._errno == TrbError.TRB_STATUS_WARNING else (0, 0, 0, 0)
+
+    def trb_termstr(self, term):
+        return 'status bits %04x %04x' % term[:2]
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    path = str(tmp_path / 'proxy.sock')
+    server = TrbNetProxyServer(trbnet=WarningFakeTrbNet(rate=0), address='unix:' + path)
+    threading.Thread(target=server.run, daemon=True).start()
+    for attempt in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    return ProxyTrbNet(address='unix:' + path, timeout=5.0)
+
+def test_proxy_reads_and_writes(proxy):
+    proxy.register_write(0x8000, 0x30, 0xcafe)
+    assert proxy.register_read(0x8000, 0x30) == {0x8000: 0xcafe}
+    assert proxy.register_read_mem(0xffff, 0x40, 0, 2) == {0x8000: [0x40 << 16, 0x41 << 16], 0x8001: [0x40 << 16, 0x41 << 16]}
+    assert proxy.trb_errno() == 0
+
+def test_proxy_forwards_status_warnings(proxy):
+    proxy.register_read(0x8000, 0x20)
+    assert proxy.trb_errno() == TrbError.TRB_STATUS_WARNING
+    assert proxy.trb_term() == (0x0001, 0x0002, 3, 4)
+    assert proxy.trb_termstr(proxy.trb_term()) == 'status bits 0001 0002'
+    proxy.register_read(0x8000, 0x21)
+    assert proxy.trb_errno() == 0
+    assert proxy.trb_term() == (0, 0, 0, 0)
+
+def test_proxy_forwards_errors(proxy):
+    with pytest.raises(TrbException) as excinfo:
+        proxy.register_read(0x9999, 0x0)
+    assert excinfo.value.errno == TrbError.TRB_ENDPOINT_NOT_REACHED
+    assert proxy.trb_errno() == TrbError.TRB_ENDPOINT_NOT_REACHED
@@ -0,0 +1,34 @@
+import math
+
+from trbnet.xmldb import RateEngine
+
+
+def hits(db, raw, slice=0, trb_address=0x8000):
+    return db.convert_field('TrbNet', 'Hits', raw, trb_address=trb_address, slice=slice)
+
+def test_first_reading_has_no_rate(db):
+    engine = RateEngine(db)
+    assert engine.update([hits(db, 100)], timestamp=0.0) == {}
+    assert len(engine) == 1
+
+def test_rate(db):
+    engine = RateEngine(db)
+    engine.update([hits(db, 100), hits(db, 0, slice=1)], timestamp=0.0)
+    rates = engine.update([hits(db, 300), hits(db, 50, slice=1)], timestamp=2.0)
+    assert rates == {'TrbNet-0x8000-Hits.0': 100.0, 'TrbNet-0x8000-Hits.1': 25.0}
+
+def test_wraparound(db):
+    # Hits is a 16 bit counter
+    engine = RateEngine(db)
+    engine.update([hits(db, 0xfff0)], timestamp=0.0)
+    rates = engine.update([hits(db, 0x0010)], timestamp=1.0)
+    assert rates == {'TrbNet-0x8000-Hits.0': 0x20}
+
+def test_update_raw_grows(db):
+    engine = RateEngine(db, capacity=1)
+    engine.update([hits(db, 0, trb_address=trb_address) for trb_address in range(0x8000, 0x8004)], timestamp=0.0)
+    assert len(engine) == 4
+    rates = engine.update_raw([0, 3], [10, 20], timestamp=1.0)
+    assert rates.tolist() == [10.0, 20.0]
+    # no time passed
+    assert math.isnan(engine.update_raw([0], [30], timestamp=1.0)[0])
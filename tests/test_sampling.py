@@ -0,0 +1,28 @@
+import numpy as np
+
+from trbnet.core.fake import FakeTrbNet
+
+
+def test_sample_register_reads_the_same_register():
+    trbnet = FakeTrbNet(rate=0)
+    trb_addresses, samples = trbnet.sample_register(0xffff, 0x40, 5)
+    assert trb_addresses == [0x8000, 0x8001]
+    assert samples.shape == (2, 5)
+    # the counter registers of FakeTrbNet hold reg_address << 16 with rate 0
+    assert (samples == 0x40 << 16).all()
+
+def test_sample_register_chunks():
+    trbnet = FakeTrbNet(rate=0)
+    trbnet.register_write(0x8001, 0x40, 0x1234)
+    transactions = trbnet.transactions
+    trb_addresses, samples = trbnet.sample_register(0xffff, 0x40, 7, chunk_size=3)
+    assert trbnet.transactions - transactions == 3
+    assert samples.shape == (2, 7)
+    assert (samples[trb_addresses.index(0x8000)] == 0x40 << 16).all()
+    assert (samples[trb_addresses.index(0x8001)] == 0x1234).all()
+
+def test_iter_register_samples_yields_every_transaction():
+    trbnet = FakeTrbNet(rate=0)
+    chunks = list(trbnet.iter_register_samples(0x8000, 0x41, 5, chunk_size=2))
+    assert [chunk.shape[1] for trb_addresses, chunk in chunks] == [2, 2, 1]
+    assert all(np.all(chunk == 0x41 << 16) for trb_addresses, chunk in chunks)
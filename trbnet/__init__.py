@@ -1,3 +1,9 @@
 from .core.lowlevel import _TrbNet
 from .core.highlevel import TrbNet
 from .core.error import TrbException, TrbError
+from .core.health import EndpointHealth
+from .core.fake import FakeTrbNet
+from .core.snapshot import SnapshotTrbNet, SnapshotPoller
+from .core.proxy import ProxyTrbNet, TrbNetProxyServer
+from .core.cache import RegisterCache
+from .core.fast import FastTrbNet
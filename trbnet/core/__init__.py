@@ -1,3 +1,9 @@
 from .highlevel import TrbNet
 from .lowlevel import _TrbNet
 from .error import TrbException, TrbError
+from .health import EndpointHealth
+from .fake import FakeTrbNet
+from .snapshot import SnapshotTrbNet, SnapshotPoller
+from .proxy import ProxyTrbNet, TrbNetProxyServer
+from .cache import RegisterCache
+from .fast import FastTrbNet
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Dict, Iterable, List, Optional
+
+INFINITE = float('inf')
+
+
+class RegisterCache(object):
+    '''
+    Read-through cache for registers that don't change at runtime
+    (compile time, hardware info, ...), used by TrbNet.enable_cache().
+
+    Only registers with a TTL > 0 are cached (ttls per reg_address or per
+    (trb_address, reg_address), see .set_ttl(), default_ttl for all others,
+    INFINITE for registers that never change). The TTL of a read is the one
+    of the trb address it was sent to, while the values of each responder
+    are kept as long as the longer of that TTL and the responder's own.
+    A response to a broadcast address (e.g. 0xffff) fills the entries of all
+    responders, so later reads of a single board are served from the cache
+    as well. A write to a register (by any trb address) invalidates the
+    cached values of that register for all boards, as broadcast and
+    multicast addresses can't be resolved to the boards they reach.
+
+    Arguments:
+    ttls -- dict {reg_address: ttl in seconds}
+    default_ttl -- ttl for all other registers (default: 0, not cached)
+    uid_ttl -- ttl for the results of read_uid() (default: 0, not cached)
+    '''
+
+    def __init__(self, ttls: Dict[int, float] = None, default_ttl: float = 0.0, uid_ttl: float = 0.0, clock=time.monotonic):
+        self.ttls = dict(ttls or {})
+        self.scoped_ttls = {}  # {(trb_address, reg_address): ttl}
+        self.default_ttl = default_ttl
+        self.uid_ttl = uid_ttl
+        self.clock = clock
+        self._values = {}    # {reg_address: {responder: (word, expires)}}
+        self._requests = {}  # {reg_address: {trb_address: (responders, expires)}}
+        self._uids = {}      # {trb_address: (result, expires)}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def ttl(self, reg_address: int, trb_address: int = None) -> float:
+        ttl = self.scoped_ttls.get((trb_address, reg_address)) if self.scoped_ttls else None
+        return self.ttls.get(reg_address, self.default_ttl) if ttl is None else ttl
+
+    def set_ttl(self, reg_addresses: Iterable[int], ttl: float = INFINITE, trb_addresses: Iterable[int] = None):
+        '''
+        Set the TTL of the registers at reg_addresses, of all boards or only
+        of the (broadcast, multicast or board) trb_addresses. The TTLs of
+        (trb_address, reg_address) take precedence over those of reg_address.
+        '''
+        reg_addresses = list(reg_addresses)
+        if trb_addresses is None:
+            for reg_address in reg_addresses:
+                self.ttls[reg_address] = ttl
+            return
+        for trb_address in trb_addresses:
+            for reg_address in reg_addresses:
+                self.scoped_ttls[(trb_address, reg_address)] = ttl
+
+    def _responders(self, trb_address: int, reg_address: int, now: float) -> Optional[tuple]:
+        request = self._requests.get(reg_address, {}).get(trb_address)
+        if request is not None and request[1] > now:
+            return request[0]
+        value = self._values.get(reg_address, {}).get(trb_address)
+        if value is not None and value[1] > now:
+            # trb_address is a single board, filled by a broadcast
+            return (trb_address,)
+        return None
+
+    def _lookup(self, trb_address: int, reg_addresses: range, now: float) -> Optional[Dict[int, List[int]]]:
+        responders = self._responders(trb_address, reg_addresses[0], now)
+        if responders is None:
+            return None
+        result = {responder: [] for responder in responders}
+        for address in reg_addresses:
+            if self._responders(trb_address, address, now) != responders:
+                return None
+            values = self._values.get(address, {})
+            for responder in responders:
+                value = values.get(responder)
+                if value is None or value[1] <= now:
+                    return None
+                result[responder].append(value[0])
+        return result
+
+    def get(self, trb_address: int, reg_address: int, size: int = 1) -> Optional[Dict[int, List[int]]]:
+        '''
+        Returns:
+        dict -- {responder: [words]} for the registers reg_address ... reg_address + size - 1
+                or None if they are not (all) cached
+        '''
+        reg_addresses = range(reg_address, reg_address + size)
+        if not all(self.ttl(address, trb_address) > 0 for address in reg_addresses):
+            return None
+        result = self._lookup(trb_address, reg_addresses, self.clock())
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, trb_address: int, reg_address: int, response: Dict[int, List[int]]):
+        '''
+        Store the response {responder: [words]} of a read of trb_address
+        starting at reg_address (registers with ttl 0 are skipped).
+        '''
+        now = self.clock()
+        responders = tuple(sorted(response))
+        size = max((len(words) for words in response.values()), default=1)
+        for offset in range(size):
+            address = reg_address + offset
+            ttl = self.ttl(address, trb_address)
+            for responder, words in response.items():
+                responder_ttl = max(ttl, self.ttl(address, responder)) if self.scoped_ttls else ttl
+                if responder_ttl > 0 and offset < len(words):
+                    self._values.setdefault(address, {})[responder] = (words[offset], now + responder_ttl)
+            if ttl > 0:
+                self._requests.setdefault(address, {})[trb_address] = (responders, now + ttl)
+
+    def get_uid(self, trb_address: int):
+        uid = self._uids.get(trb_address)
+        if uid is not None and uid[1] > self.clock():
+            self.hits += 1
+            return uid[0]
+        if self.uid_ttl > 0:
+            self.misses += 1
+        return None
+
+    def put_uid(self, trb_address: int, result):
+        if self.uid_ttl > 0:
+            self._uids[trb_address] = (result, self.clock() + self.uid_ttl)
+
+    def invalidate(self, trb_address: int, reg_address: int, size: int = 1):
+        '''
+        Invalidate the registers reg_address ... reg_address + size - 1 of all boards
+        (a write to trb_address might have reached any of them).
+        '''
+        for address in range(reg_address, reg_address + size):
+            if self._values.pop(address, None):
+                self.invalidations += 1
+            self._requests.pop(address, None)
+
+    def clear(self):
+        self._values.clear()
+        self._requests.clear()
+        self._uids.clear()
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+          'hits': self.hits,
+          'misses': self.misses,
+          'invalidations': self.invalidations,
+          'entries': sum(len(values) for values in self._values.values()) + len(self._uids),
+        }
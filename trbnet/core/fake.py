@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .lowlevel import _TrbNet
+from .highlevel import TrbNet
+from .error import TrbException, TrbError
+
+
+class _FakeTrbNet(_TrbNet):
+    '''
+    Stand-in for _TrbNet simulating a set of boards without libtrbnet.so
+    or any hardware. Useful for benchmarks and for developing against the
+    Python API.
+
+    Registers that were never written hold a free running counter:
+    (reg_address << 16) + rate * (seconds since the creation of the instance),
+    truncated to 32 bits. Like with trbnetd, option 0 of the *_mem
+    transactions accesses adjacent registers, any other option the same
+    register repeatedly. Every transaction takes latency seconds plus
+    word_latency seconds per 32-bit word sent back (spent sleeping, so other
+    threads can run just like while waiting for libtrbnet).
+
+    Keyword arguments:
+    endpoints -- dict, key: (broadcast) trb_address, value: list of the trb addresses
+                 answering to it (default: 0xffff answered by 0x8000 and 0x8001)
+    latency -- time per transaction in seconds (default: 0.0)
+    word_latency -- additional time per response word in seconds (default: 0.0)
+    rate -- increment of the counter registers per second (default: 1000)
+    '''
+
+    def __init__(self, endpoints: Dict[int, List[int]] = None, latency: float = 0.0, word_latency: float = 0.0,
+                 rate: float = 1000.0, buffersize: int = 4194304, **kwargs):
+        self.libtrbnet = None
+        self.buffersize = buffersize
+        self.endpoints = endpoints if endpoints is not None else {0xffff: [0x8000, 0x8001]}
+        self.latency = latency
+        self.word_latency = word_latency
+        self.rate = rate
+        self.registers = {}
+        self.transactions = 0
+        self._start = time.monotonic()
+        self._errno = 0
+
+    def __del__(self):
+        pass
+
+    def _responders(self, trb_address: int) -> List[int]:
+        if trb_address in self.endpoints:
+            return list(self.endpoints[trb_address])
+        if any(trb_address in responders for responders in self.endpoints.values()):
+            return [trb_address]
+        self._errno = TrbError.TRB_ENDPOINT_NOT_REACHED
+        raise TrbException('Error while reading trb register.', self._errno, self.trb_errorstr(self._errno))
+
+    def _words(self, trb_address: int, reg_addresses: np.ndarray) -> np.ndarray:
+        counter = int(self.rate * (time.monotonic() - self._start))
+        words = ((reg_addresses.astype(np.uint64) << 16) + counter) & 0xffffffff
+        for index, reg_address in enumerate(reg_addresses.tolist()):
+            if (trb_address, reg_address) in self.registers:
+                words[index] = self.registers[(trb_address, reg_address)]
+        return words.astype(np.uint32)
+
+    def _transaction(self, words: int):
+        self.transactions += 1
+        delay = self.latency + self.word_latency * words
+        if delay > 0:
+            time.sleep(delay)
+
+    def _read(self, trb_address: int, reg_addresses: np.ndarray) -> np.ndarray:
+        responders = self._responders(trb_address)
+        size = len(reg_addresses)
+        lin_data = np.empty(len(responders) * (size + 1), dtype=np.uint32)
+        for row, responder in enumerate(responders):
+            offset = row * (size + 1)
+            lin_data[offset] = (size << 16) | responder
+            lin_data[offset+1:offset+1+size] = self._words(responder, reg_addresses)
+        self._transaction(len(lin_data))
+        self._errno = 0
+        return lin_data
+
+    def trb_errno(self) -> int:
+        return self._errno
+
+    def trb_term(self) -> Tuple[int, int, int, int]:
+        return (0, 0, 0, 0)
+
+    def trb_errorstr(self, errno: int) -> str:
+        try:
+            return TrbError(errno).name
+        except ValueError:
+            return 'unknown error %d' % errno
+
+    def trb_termstr(self, term) -> str:
+        return ''
+
+    def trb_register_read(self, trb_address: int, reg_address: int) -> List[int]:
+        return self._read(trb_address, np.array([reg_address], dtype=np.uint32)).tolist()
+
+    def trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> List[int]:
+        data_array, status = self._trb_register_read_mem(trb_address, reg_address, option, size)
+        return data_array[:status].tolist()
+
+    def _trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> Tuple[np.ndarray, int]:
+        if option:
+            reg_addresses = np.full(size, reg_address, dtype=np.uint32)
+        else:
+            reg_addresses = np.arange(reg_address, reg_address + size, dtype=np.uint32)
+        lin_data = self._read(trb_address, reg_addresses)
+        return lin_data, len(lin_data)
+
+    def trb_read_uid(self, trb_address: int) -> List[int]:
+        lin_data = []
+        for responder in self._responders(trb_address):
+            # a made-up 1-wire id unique to the responder
+            lin_data += [0x28000000 | responder, 0x00c0ffee, 0, responder]
+        self._transaction(len(lin_data))
+        return lin_data
+
+    def trb_register_write(self, trb_address: int, reg_address: int, value: int):
+        for responder in self._responders(trb_address):
+            self.registers[(responder, reg_address)] = value & 0xffffffff
+        self._transaction(0)
+
+    def trb_register_write_mem(self, trb_address: int, reg_address: int, option: int, values: List[int], size: int = None):
+        values = [int(value) for value in (values[:size] if size else values)]
+        for responder in self._responders(trb_address):
+            for offset, value in enumerate(values):
+                self.registers[(responder, reg_address + (0 if option else offset))] = value & 0xffffffff
+        self._transaction(0)
+
+
+class FakeTrbNet(TrbNet, _FakeTrbNet):
+    '''
+    The high level TrbNet API on top of the simulated boards of _FakeTrbNet
+    (see there for the keyword arguments).
+    '''
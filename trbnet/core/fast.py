@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import threading
+from typing import List, Tuple
+
+from .lowlevel import _TrbNet, _word_buffer, MAX_WRITE_MEM_WORDS
+from .highlevel import TrbNet
+from .error import TrbException
+
+CFFI_CDEF = '''
+extern int trb_errno;
+int trb_register_read(uint16_t trb_address, uint16_t reg_address, uint32_t *data, unsigned int dsize);
+int trb_register_read_mem(uint16_t trb_address, uint16_t reg_address, uint8_t option, uint16_t size,
+                          uint32_t *data, unsigned int dsize);
+int trb_register_write(uint16_t trb_address, uint16_t reg_address, uint32_t value);
+int trb_register_write_mem(uint16_t trb_address, uint16_t reg_address, uint8_t option,
+                           const uint32_t *data, uint16_t size);
+int trb_read_uid(uint16_t trb_address, uint32_t *data, unsigned int dsize);
+int trb_set_address(uint64_t uid, uint8_t endpoint, uint16_t trb_address);
+int trb_register_setbit(uint16_t trb_address, uint16_t reg_address, uint32_t bitmask);
+int trb_register_clearbit(uint16_t trb_address, uint16_t reg_address, uint32_t bitmask);
+int trb_register_loadbit(uint16_t trb_address, uint16_t reg_address, uint32_t bitmask, uint32_t bitvalue);
+'''
+
+class _CtypesBinding(object):
+    '''
+    The functions of libtrbnet (with the argtypes declared by _TrbNet.declare_types())
+    and the trb_errno handle looked up once, plus the buffer handling for ctypes.
+    '''
+
+    def __init__(self, trblib):
+        for name in ('trb_register_read', 'trb_register_read_mem', 'trb_register_write', 'trb_register_write_mem',
+                     'trb_read_uid', 'trb_set_address', 'trb_register_setbit', 'trb_register_clearbit',
+                     'trb_register_loadbit'):
+            setattr(self, name, getattr(trblib, name))
+        self._errno = ctypes.c_int.in_dll(trblib, 'trb_errno')
+
+    def errno(self) -> int:
+        return self._errno.value
+
+    def new_buffer(self, size: int):
+        return (ctypes.c_uint32 * size)()
+
+    def words(self, buffer, status: int) -> List[int]:
+        return buffer[:status]
+
+    def copy(self, buffer, status: int):
+        return (ctypes.c_uint32 * status).from_buffer_copy(buffer)
+
+    def values(self, values):
+        view = _word_buffer(values)
+        if view is not None:
+            return (ctypes.c_uint32 * (len(view) // 4)).from_buffer_copy(view)
+        return (ctypes.c_uint32 * len(values))(*values)
+
+class _CffiBinding(object):
+    '''
+    The functions of libtrbnet loaded with cffi in ABI mode
+    (declared by CFFI_CDEF), plus the buffer handling for cffi.
+    '''
+
+    def __init__(self, libtrbnet):
+        try:
+            import cffi
+        except ImportError:
+            raise ImportError("binding='cffi' requires the cffi package (pip install cffi)")
+        self.ffi = cffi.FFI()
+        self.ffi.cdef(CFFI_CDEF)
+        self.lib = self.ffi.dlopen(libtrbnet)
+        for name in ('trb_register_read', 'trb_register_read_mem', 'trb_register_write', 'trb_register_write_mem',
+                     'trb_read_uid', 'trb_set_address', 'trb_register_setbit', 'trb_register_clearbit',
+                     'trb_register_loadbit'):
+            setattr(self, name, getattr(self.lib, name))
+
+    def errno(self) -> int:
+        return self.lib.trb_errno
+
+    def new_buffer(self, size: int):
+        return self.ffi.new('uint32_t[]', size)
+
+    def words(self, buffer, status: int) -> List[int]:
+        return self.ffi.unpack(buffer, status)
+
+    def copy(self, buffer, status: int):
+        return self.ffi.buffer(buffer, 4 * status)[:]
+
+    def values(self, values):
+        view = _word_buffer(values)
+        if view is not None:
+            # no copy at all, the array refers to the memory of values
+            return self.ffi.from_buffer('uint32_t[]', view)
+        return self.ffi.new('uint32_t[]', list(values))
+
+BINDINGS = ('ctypes', 'cffi')
+
+class _FastTrbNet(_TrbNet):
+    '''
+    Variant of _TrbNet with less work per call for tight polling loops:
+
+    * the functions of libtrbnet and the trb_errno variable are looked up once,
+    * the arguments are passed as Python ints (converted according to the
+      declared argument types instead of wrapping them in ctypes objects first),
+    * responses are read into a response buffer of buffersize words allocated
+      once per thread (instead of allocating a new one for every call).
+
+    With binding='cffi', the library is called through a cffi ABI binding
+    (requires the cffi package), otherwise through ctypes.
+
+    _trb_register_read_mem() returns a copy of the valid part of the response
+    buffer (ctypes array or bytes), as the buffer is reused by the next call.
+
+    Keyword arguments:
+    binding -- 'ctypes' (default) or 'cffi'
+    all others -- see _TrbNet
+    '''
+
+    def __init__(self, binding: str = 'ctypes', **kwargs):
+        if binding not in BINDINGS:
+            raise ValueError('binding must be one of %s' % ', '.join(BINDINGS))
+        super().__init__(**kwargs)
+        self.binding = binding
+        self._lib = _CffiBinding(self.libtrbnet) if binding == 'cffi' else _CtypesBinding(self.trblib)
+        self._local = threading.local()
+
+    def _buffer(self):
+        try:
+            return self._local.buffer
+        except AttributeError:
+            buffer = self._local.buffer = self._lib.new_buffer(self.buffersize)
+            return buffer
+
+    def _raise(self, message: str):
+        errno = self._lib.errno()
+        raise TrbException(message, errno, self.trb_errorstr(errno))
+
+    def trb_errno(self) -> int:
+        return self._lib.errno()
+
+    def trb_register_read(self, trb_address: int, reg_address: int) -> List[int]:
+        buffer = self._buffer()
+        status = self._lib.trb_register_read(trb_address, reg_address, buffer, self.buffersize)
+        if status == -1:
+            self._raise('Error while reading trb register.')
+        return self._lib.words(buffer, status)
+
+    def trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> List[int]:
+        buffer = self._buffer()
+        status = self._lib.trb_register_read_mem(trb_address, reg_address, option, size, buffer, self.buffersize)
+        if status == -1:
+            self._raise('Error while reading trb register memory.')
+        return self._lib.words(buffer, status)
+
+    def _trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> Tuple[object, int]:
+        buffer = self._buffer()
+        status = self._lib.trb_register_read_mem(trb_address, reg_address, option, size, buffer, self.buffersize)
+        if status == -1:
+            self._raise('Error while reading trb register memory.')
+        return self._lib.copy(buffer, status), status
+
+    def trb_register_write(self, trb_address: int, reg_address: int, value: int):
+        if self._lib.trb_register_write(trb_address, reg_address, value) == -1:
+            self._raise('Error while writing trb register.')
+
+    def trb_register_write_mem(self, trb_address: int, reg_address: int, option: int, values: List[int], size: int = None):
+        data = self._lib.values(values)
+        size = size or len(data)
+        if size > MAX_WRITE_MEM_WORDS:
+            raise ValueError('At most 0x%x words can be written at once (see TrbNet.upload_memory())' % MAX_WRITE_MEM_WORDS)
+        if self._lib.trb_register_write_mem(trb_address, reg_address, option, data, size) == -1:
+            self._raise('Error while writing trb register memory.')
+
+    def trb_read_uid(self, trb_address: int) -> List[int]:
+        buffer = self._buffer()
+        status = self._lib.trb_read_uid(trb_address, buffer, self.buffersize)
+        if status == -1:
+            self._raise('Error reading trb uid.')
+        return self._lib.words(buffer, status)
+
+    def trb_set_address(self, uid: int, endpoint: int, trb_address: int):
+        if self._lib.trb_set_address(uid, endpoint, trb_address) == -1:
+            self._raise('Error setting trb address.')
+
+    def trb_register_setbit(self, trb_address: int, reg_address: int, bitmask: int) -> int:
+        return self._lib.trb_register_setbit(trb_address, reg_address, bitmask)
+
+    def trb_register_clearbit(self, trb_address: int, reg_address: int, bitmask: int) -> int:
+        return self._lib.trb_register_clearbit(trb_address, reg_address, bitmask)
+
+    def trb_register_loadbit(self, trb_address: int, reg_address: int, bitmask: int, bitvalue: int) -> int:
+        return self._lib.trb_register_loadbit(trb_address, reg_address, bitmask, bitvalue)
+
+
+class FastTrbNet(TrbNet, _FastTrbNet):
+    '''
+    The high level TrbNet API on top of the low overhead calls of
+    _FastTrbNet (see there for the keyword arguments, e.g. binding='cffi').
+    '''
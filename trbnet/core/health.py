@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Dict
+
+from .error import TrbException, TrbError
+
+
+class EndpointHealth(object):
+    '''
+    Tracks the health of TrbNet addresses to avoid waiting for timeouts of
+    boards known to be unreachable over and over again.
+
+    An address is considered dead after an access failed with one of the
+    DEAD_ERRORS. Dead addresses should be skipped by scans; they become due
+    for a probe (a single cheap register read) after a backoff time which
+    doubles with every failed probe (between min_backoff and max_backoff).
+    A successful access marks the address alive again.
+    '''
+
+    DEAD_ERRORS = (TrbError.TRB_ENDPOINT_NOT_REACHED, TrbError.TRB_TRB3_SOCKET_TIMEOUT)
+    PROBE_REGISTER = 0x0
+
+    def __init__(self, min_backoff: float = 1.0, max_backoff: float = 60.0, clock=time.monotonic):
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._states = {}
+
+    def _state(self, trb_address: int) -> Dict:
+        if trb_address not in self._states:
+            self._states[trb_address] = {'alive': True, 'failures': 0, 'last_error': None, 'next_probe': 0.0}
+        return self._states[trb_address]
+
+    def is_dead(self, trb_address: int) -> bool:
+        state = self._states.get(trb_address)
+        return state is not None and not state['alive']
+
+    def probe_due(self, trb_address: int) -> bool:
+        '''
+        True if the address is dead and its backoff time has passed.
+        '''
+        return self.is_dead(trb_address) and self.clock() >= self._states[trb_address]['next_probe']
+
+    def record_success(self, trb_address: int):
+        state = self._states.get(trb_address)
+        if state is not None:
+            state.update(alive=True, failures=0, next_probe=0.0)
+
+    def record_failure(self, trb_address: int, exception: TrbException) -> bool:
+        '''
+        Record a failed access to trb_address.
+
+        Returns:
+        bool -- True if the error marks the address dead
+        '''
+        if exception.errno not in self.DEAD_ERRORS:
+            return False
+        state = self._state(trb_address)
+        state['failures'] += 1
+        state['alive'] = False
+        state['last_error'] = exception.errno
+        backoff = min(self.max_backoff, self.min_backoff * 2 ** (state['failures'] - 1))
+        state['next_probe'] = self.clock() + backoff
+        return True
+
+    def probe(self, trbnet, trb_address: int) -> bool:
+        '''
+        Probe a dead address with a single register read.
+
+        Returns:
+        bool -- True if the address responded (and is alive again)
+        '''
+        try:
+            trbnet.register_read(trb_address, self.PROBE_REGISTER)
+        except TrbException as e:
+            self.record_failure(trb_address, e)
+            return False
+        self.record_success(trb_address)
+        return True
+
+    def check(self, trbnet, trb_address: int) -> bool:
+        '''
+        To be called before accessing trb_address in a scan:
+        Probes the address if it is dead and due for a probe.
+
+        Returns:
+        bool -- True if the address should be accessed, False if it should be skipped
+        '''
+        if not self.is_dead(trb_address):
+            return True
+        if not self.probe_due(trb_address):
+            return False
+        return self.probe(trbnet, trb_address)
+
+    def state(self) -> Dict[int, Dict]:
+        '''
+        Returns:
+        dict -- key: trb_address, value: dict with the keys alive, failures,
+                last_error and next_probe (seconds until the next probe)
+        '''
+        now = self.clock()
+        return {trb_address: dict(state, next_probe=max(0.0, state['next_probe'] - now) if not state['alive'] else None)
+                for trb_address, state in self._states.items()}
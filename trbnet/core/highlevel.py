@@ -1,7 +1,39 @@
 # -*- coding: utf-8 -*-
-from typing import List, Tuple, Dict
+import os
+import queue
+import threading
+import time
+from typing import List, Tuple, Dict, Iterator, Callable
 
-from .lowlevel import _TrbNet
+import numpy as np
+
+from .lowlevel import _TrbNet, MAX_WRITE_MEM_WORDS
+from .cache import RegisterCache
+
+# number of verification mismatches listed in detail by TrbNet.upload_memory()
+MAX_LISTED_MISMATCHES = 100
+
+def _memory_words(data, byteorder: str = '<') -> np.ndarray:
+    '''
+    Returns the data to upload as flat numpy array of 32-bit words without
+    copying it where possible (buffers are wrapped, files are memory-mapped).
+    '''
+    if isinstance(data, (str, os.PathLike)):
+        if os.path.getsize(data) == 0:
+            return np.empty(0, dtype=np.uint32)
+        if os.path.getsize(data) % 4:
+            raise ValueError('The size of %s is not a multiple of 4 bytes' % os.fspath(data))
+        return np.memmap(data, dtype=byteorder + 'u4', mode='r')
+    if hasattr(data, 'read'):
+        data = data.read()
+    words = data if isinstance(data, np.ndarray) else np.asarray(memoryview(data))
+    if words.dtype.itemsize == 1:
+        if words.size % 4:
+            raise ValueError('The data size (%d bytes) is not a multiple of 4 bytes' % words.size)
+        return np.ascontiguousarray(words).reshape(-1).view(byteorder + 'u4')
+    if words.dtype.kind not in 'ui':
+        raise ValueError('Cannot upload data of type %s (expected integers or bytes)' % words.dtype)
+    return words.reshape(-1)
 
 
 class TrbNet(_TrbNet):
@@ -9,16 +41,123 @@ class TrbNet(_TrbNet):
     High level wrapper providing utility functions for the TrbNet class
     '''
 
+    cache = None
+
+    def enable_cache(self, ttls: Dict[int, float] = None, default_ttl: float = 0.0, uid_ttl: float = 0.0) -> RegisterCache:
+        '''
+        Serve register_read(), register_read_mem() (reading adjacent registers)
+        and read_uid() from a RegisterCache for the registers with a TTL > 0.
+        Writes through this instance invalidate the cached values.
+
+        Arguments:
+        ttls -- dict {reg_address: ttl in seconds}, see RegisterCache.set_ttl()
+        default_ttl -- ttl of all other registers (default: 0, not cached)
+        uid_ttl -- ttl of the read_uid() results (default: 0, not cached)
+
+        Returns:
+        RegisterCache -- the cache (to adjust TTLs, get statistics, ...)
+        '''
+        self.cache = RegisterCache(ttls=ttls, default_ttl=default_ttl, uid_ttl=uid_ttl)
+        return self.cache
+
+    def disable_cache(self):
+        self.cache = None
+
     def register_read(self, trb_address: int, reg_address: int) -> Dict[int, int]:
+        if self.cache is not None:
+            cached = self.cache.get(trb_address, reg_address)
+            if cached is not None:
+                return {key: value[0] for key, value in cached.items()}
         lin_data = super().trb_register_read(trb_address, reg_address)
         if (len(lin_data) % 2) != 0:
             raise ValueError("len(lin_data) == %d -  expected a multiple of %d" % (len(lin_data), 2))
         result = self._get_dynamic_trb_address_dict(lin_data, force_length=1)
+        if self.cache is not None:
+            self.cache.put(trb_address, reg_address, result)
         return {key: value[0] for key, value in result.items()}
 
     def register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> Dict[int, List[int]]:
+        cache = self.cache if option == 0 else None
+        if cache is not None:
+            cached = cache.get(trb_address, reg_address, size)
+            if cached is not None:
+                return cached
         lin_data = super().trb_register_read_mem(trb_address, reg_address, option, size)
-        return self._get_dynamic_trb_address_dict(lin_data)
+        result = self._get_dynamic_trb_address_dict(lin_data)
+        if cache is not None:
+            cache.put(trb_address, reg_address, result)
+        return result
+
+    def sample_register(self, trb_address: int, reg_address: int, n: int, option: int = 1, chunk_size: int = 0xffff) -> Tuple[List[int], np.ndarray]:
+        '''
+        Read the same register n times from all nodes addressed by trb_address
+        using as few register_read_mem transactions as possible.
+
+        Arguments:
+        trb_address -- node(s) to read from
+        reg_address -- register address
+        n -- number of samples per node
+        option -- register_read_mem option reading the same register several times
+                  (default: 1, option 0 would read adjacent registers)
+        chunk_size -- maximum number of samples per transaction (at most 0xffff)
+
+        Returns:
+        tuple -- (list of responding trb addresses, numpy matrix of shape (len(addresses), n))
+        '''
+        trb_addresses, chunks = None, []
+        for chunk_addresses, chunk in self.iter_register_samples(trb_address, reg_address, n, option=option, chunk_size=chunk_size):
+            if trb_addresses is None:
+                trb_addresses = chunk_addresses
+            elif chunk_addresses != trb_addresses:
+                order = [chunk_addresses.index(address) for address in trb_addresses]
+                chunk = chunk[order]
+            chunks.append(chunk)
+        if not chunks:
+            return [], np.empty((0, 0), dtype=np.uint32)
+        return trb_addresses, np.hstack(chunks)
+
+    def iter_register_samples(self, trb_address: int, reg_address: int, n: int, option: int = 1, chunk_size: int = 0xffff) -> Iterator[Tuple[List[int], np.ndarray]]:
+        '''
+        Generator version of sample_register() yielding the samples of each
+        transaction as soon as they have been received. This allows computing
+        statistics over a large number of samples with bounded memory.
+
+        Yields:
+        tuple -- (list of responding trb addresses, numpy matrix of shape (len(addresses), samples in chunk))
+        '''
+        chunk_size = min(chunk_size, 0xffff)
+        remaining = n
+        while remaining > 0:
+            size = min(remaining, chunk_size)
+            data_array, status = super()._trb_register_read_mem(trb_address, reg_address, option, size)
+            lin_data = np.frombuffer(data_array, dtype=np.uint32, count=status)
+            yield self._demultiplex_samples(lin_data, size)
+            remaining -= size
+
+    def _demultiplex_samples(self, lin_data: np.ndarray, size: int) -> Tuple[List[int], np.ndarray]:
+        """
+        Split the linear response of a register_read_mem() transaction with
+        the same amount of data words from every node into a matrix with one
+        row per node. If all nodes responded with the full size, this is done
+        by reshaping the response without looking at the individual words.
+        """
+        if size and len(lin_data) % (size + 1) == 0:
+            blocks = lin_data.reshape(-1, size + 1)
+            if np.all((blocks[:, 0] >> 16) == size):
+                return (blocks[:, 0] & 0xffff).tolist(), blocks[:, 1:].copy()
+        trb_addresses, rows = [], []
+        offset = 0
+        while len(lin_data) > offset:
+            header = int(lin_data[offset])
+            length, trb_address = (header >> 16), (header & 0xffff)
+            if length != size:
+                raise ValueError("trb_address 0x%04x responded with %d words - expected %d" % (trb_address, length, size))
+            trb_addresses.append(trb_address)
+            rows.append(lin_data[offset+1:offset+1+length])
+            offset += 1 + length
+        if not rows:
+            return [], np.empty((0, size), dtype=np.uint32)
+        return trb_addresses, np.vstack(rows)
 
     def read_uid(self, trb_address: int) -> Dict[Tuple[int, int], int]:
         '''
@@ -30,11 +169,17 @@ class TrbNet(_TrbNet):
         Returns:
         dict -- the keys being (uid, endpoint) and the associated value the currently assigned trb address
         '''
+        if self.cache is not None:
+            cached = self.cache.get_uid(trb_address)
+            if cached is not None:
+                return dict(cached)
         lin_data = super().trb_read_uid(trb_address)
         if (len(lin_data) % 4) != 0:
             raise ValueError("len(lin_data) == %d -  expected a multiple of %d" % (len(lin_data), 4))
         responses = [lin_data[pos:pos+4] for pos in range(0, len(lin_data), 4)]
         uid_dict = {((r[0] << 32) + r[1], r[2]): r[3] for r in responses}
+        if self.cache is not None:
+            self.cache.put_uid(trb_address, dict(uid_dict))
         return uid_dict
 
     def _get_dynamic_trb_address_dict(self, lin_data: List[int], force_length: int = 0) -> Dict[int, List[int]]:
@@ -64,4 +209,154 @@ class TrbNet(_TrbNet):
         """
         Convenience wrapper for trb_register_write()
         """
-        super().trb_register_write(trb_address, reg_address, value)
+        self.trb_register_write(trb_address, reg_address, value)
+
+    def upload_memory(self, trb_address: int, reg_address: int, data, option: int = 0,
+                      chunk_size: int = MAX_WRITE_MEM_WORDS, verify: bool = False, verifier: 'TrbNet' = None,
+                      byteorder: str = '<', progress: Callable[[int, int, float], None] = None) -> Dict[str, object]:
+        '''
+        Write a large memory image (lookup tables, calibration tables, flash pages, ...)
+        with as few trb_register_write_mem() transactions as possible. The data is
+        split into chunks of chunk_size words, which are passed to libtrbnet straight
+        from the memory of data (without converting it to a list of ints).
+
+        With verify=True, every chunk is read back with trb_register_read_mem() and
+        compared to the words written. By default, this happens right after writing the
+        chunk. If verifier is another TrbNet instance (a separate connection, e.g. a
+        ProxyTrbNet, as libtrbnet itself is not thread-safe), the chunks are verified
+        by a background thread in parallel to writing the following chunks.
+
+        Arguments:
+        trb_address -- node(s) to write to
+        reg_address -- (first) register address
+        data -- the words to write: a buffer protocol object (numpy array, array.array('I'), bytes,
+                bytearray, memoryview, ...), a binary file object or the path of a file;
+                raw bytes are interpreted as 32-bit words in the given byteorder
+        option -- 0: write adjacent registers (default), 1: write the same register (e.g. a FIFO) repeatedly
+        chunk_size -- maximum number of words per transaction (at most MAX_WRITE_MEM_WORDS)
+        verify -- read back and compare every chunk (option 0 only)
+        verifier -- TrbNet instance to verify with in parallel (default: verify in sequence)
+        byteorder -- '<' (little endian, default) or '>' (big endian) for raw bytes and files
+        progress -- callable(words written, total words, elapsed seconds) called after every chunk
+
+        Returns:
+        dict -- statistics: words, chunks, seconds, words_per_second, bytes_per_second,
+                verified (words read back from all responders), mismatches (number of differing
+                words), first_mismatches (up to MAX_LISTED_MISMATCHES tuples of
+                (responder, register address, written, read)) and unanswered (chunks
+                no node responded to when reading them back)
+        '''
+        words = _memory_words(data, byteorder)
+        chunk_size = min(chunk_size, MAX_WRITE_MEM_WORDS)
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive')
+        if verify and option != 0:
+            raise ValueError('Only adjacent registers (option 0) can be verified')
+        if option == 0 and reg_address + len(words) > 0x10000:
+            raise ValueError('%d words starting at register 0x%04x exceed the register address space' % (len(words), reg_address))
+        statistics = {'words': len(words), 'chunks': 0, 'verified': 0, 'mismatches': 0,
+                      'first_mismatches': [], 'unanswered': 0}
+
+        def check(address, chunk):
+            data_array, status = (verifier or self)._trb_register_read_mem(trb_address, address, 0, len(chunk))
+            responders, rows = self._demultiplex_samples(np.frombuffer(data_array, dtype=np.uint32, count=status), len(chunk))
+            if not responders:
+                statistics['unanswered'] += 1
+                return
+            statistics['verified'] += rows.size
+            differing = rows != chunk
+            statistics['mismatches'] += int(np.count_nonzero(differing))
+            for row, offset in zip(*np.nonzero(differing)):
+                if len(statistics['first_mismatches']) >= MAX_LISTED_MISMATCHES:
+                    break
+                statistics['first_mismatches'].append((responders[row], address + int(offset), int(chunk[offset]), int(rows[row, offset])))
+
+        pending, errors, worker = None, [], None
+        if verify and verifier is not None:
+            pending = queue.Queue(maxsize=4)
+            def verify_pending():
+                while True:
+                    item = pending.get()
+                    if item is None:
+                        break
+                    if not errors:
+                        try:
+                            check(*item)
+                        except Exception as e:
+                            errors.append(e)
+            worker = threading.Thread(target=verify_pending, name='upload-verifier', daemon=True)
+            worker.start()
+
+        start = time.perf_counter()
+        try:
+            for offset in range(0, len(words), chunk_size):
+                if errors:
+                    break
+                chunk = words[offset:offset + chunk_size]
+                if not chunk.dtype.isnative or chunk.dtype != np.uint32:
+                    chunk = chunk.astype(np.uint32)
+                address = reg_address + offset if option == 0 else reg_address
+                self.trb_register_write_mem(trb_address, address, option, chunk)
+                statistics['chunks'] += 1
+                if pending is not None:
+                    pending.put((address, chunk))
+                elif verify:
+                    check(address, chunk)
+                if progress is not None:
+                    progress(offset + len(chunk), len(words), time.perf_counter() - start)
+        finally:
+            if worker is not None:
+                pending.put(None)
+                worker.join()
+        if errors:
+            raise errors[0]
+        seconds = time.perf_counter() - start
+        statistics['seconds'] = seconds
+        statistics['words_per_second'] = len(words) / seconds if seconds else float('inf')
+        statistics['bytes_per_second'] = 4 * statistics['words_per_second']
+        return statistics
+
+    # All writes invalidate the cached values of the registers written to:
+
+    def trb_register_write(self, trb_address: int, reg_address: int, value: int):
+        try:
+            super().trb_register_write(trb_address, reg_address, value)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(trb_address, reg_address)
+
+    def trb_register_write_mem(self, trb_address: int, reg_address: int, option: int, values: List[int], size: int = None):
+        try:
+            super().trb_register_write_mem(trb_address, reg_address, option, values, size=size)
+        finally:
+            if self.cache is not None:
+                # option 0 writes adjacent registers, any other option reg_address repeatedly
+                self.cache.invalidate(trb_address, reg_address, (size or len(values)) if option == 0 else 1)
+
+    def trb_register_setbit(self, trb_address: int, reg_address: int, bitmask: int) -> int:
+        try:
+            return super().trb_register_setbit(trb_address, reg_address, bitmask)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(trb_address, reg_address)
+
+    def trb_register_clearbit(self, trb_address: int, reg_address: int, bitmask: int) -> int:
+        try:
+            return super().trb_register_clearbit(trb_address, reg_address, bitmask)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(trb_address, reg_address)
+
+    def trb_register_loadbit(self, trb_address: int, reg_address: int, bitmask: int, bitvalue: int) -> int:
+        try:
+            return super().trb_register_loadbit(trb_address, reg_address, bitmask, bitvalue)
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(trb_address, reg_address)
+
+    def trb_set_address(self, uid: int, endpoint: int, trb_address: int):
+        try:
+            return super().trb_set_address(uid, endpoint, trb_address)
+        finally:
+            if self.cache is not None:
+                self.cache.clear()
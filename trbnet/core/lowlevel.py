@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import ctypes
 import os
+import sys
 
 from typing import List, Tuple, Union
 
@@ -8,6 +9,27 @@ from .error import TrbException
 
 # TODO: use warnings to indicate access to wrong register or no data
 
+# maximum number of words of a single trb_register_write_mem() call (size is a uint16_t)
+MAX_WRITE_MEM_WORDS = 0xffff
+
+_NATIVE_BYTEORDER = '<' if sys.byteorder == 'little' else '>'
+
+def _word_buffer(values):
+    '''
+    Returns a flat byte view of values if it is a C-contiguous buffer protocol
+    object of native 32-bit integers (numpy uint32 array, array.array('I'), ...),
+    so it can be passed to libtrbnet in one go instead of word by word, else None.
+    '''
+    if isinstance(values, (list, tuple)):
+        return None
+    try:
+        view = memoryview(values)
+    except TypeError:
+        return None
+    if view.itemsize != 4 or view.format.lstrip('@=' + _NATIVE_BYTEORDER) not in ('I', 'i', 'L', 'l') or not view.c_contiguous:
+        return None
+    return view.cast('B')
+
 
 class TrbTerm(ctypes.Structure):
     """
@@ -194,13 +216,23 @@ class _TrbNet(object):
         Arguments:
         trb_address -- node(s) to read from
         reg_address -- register address
-        option -- read option, 0 = read same register several times 1 = read adjacent registers
+        option -- read option, 0 = read adjacent registers 1 = read same register several times
         size -- number of reads
 
         Returns:
         python list [0] TRB-Address of the sender, [1:] register values
         '''
+        data_array, status = self._trb_register_read_mem(trb_address, reg_address, option, size)
+        return [data_array[i] for i in range(status)]
 
+    def _trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> Tuple[ctypes.Array, int]:
+        '''
+        Same as trb_register_read_mem() but returns the ctypes data array
+        itself (supporting the buffer protocol) instead of a python list.
+
+        Returns:
+        tuple -- (data array, number of valid 32-bit words in the array)
+        '''
         data_array = (ctypes.c_uint32 * self.buffersize)()
         trb_address = ctypes.c_uint16(trb_address)
         reg_address = ctypes.c_uint16(reg_address)
@@ -212,7 +244,7 @@ class _TrbNet(object):
             errno = self.trb_errno()
             raise TrbException('Error while reading trb register memory.',
                                errno, self.trb_errorstr(errno))
-        return [data_array[i] for i in range(status)]
+        return data_array, status
 
     def trb_register_write_mem(self, trb_address: int, reg_address: int, option: int, values: List[int], size: int = None):
         '''
@@ -221,15 +253,23 @@ class _TrbNet(object):
         Arguments:
         trb_address -- node(s) to write to
         reg_address -- register address
-        option -- write option, 0 = write same register several times 1 = write adjacent registers
-        values -- list of values to write to register(s)
+        option -- write option, 0 = write adjacent registers 1 = write same register several times
+        values -- list of values to write to register(s) or a buffer protocol object
+                  of 32-bit integers (e.g. numpy uint32 array, copied in one go)
+        size -- number of words to write (default: all values, at most MAX_WRITE_MEM_WORDS)
         '''
 
-        data_array = (ctypes.c_uint32 * len(values))(*values)
+        view = _word_buffer(values)
+        if view is not None:
+            data_array = (ctypes.c_uint32 * (len(view) // 4)).from_buffer_copy(view)
+        else:
+            data_array = (ctypes.c_uint32 * len(values))(*values)
+        size = size or len(data_array)
+        if size > MAX_WRITE_MEM_WORDS:
+            raise ValueError('At most 0x%x words can be written at once (see TrbNet.upload_memory())' % MAX_WRITE_MEM_WORDS)
         trb_address = ctypes.c_uint16(trb_address)
         reg_address = ctypes.c_uint16(reg_address)
         option = ctypes.c_uint8(option)
-        size = size or ctypes.c_uint16(len(values))
         status = self.trblib.trb_register_write_mem(trb_address, reg_address, option, data_array, size)
         if status == -1:
             errno = self.trb_errno()
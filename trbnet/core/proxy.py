@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+'''
+A local proxy multiplexing the TrbNet requests of many client processes
+over a single TrbNet connection.
+
+TrbNetProxyServer owns one TrbNet instance and serves requests on a Unix
+or TCP socket (asyncio). libtrbnet is not thread-safe, so all transactions
+are executed one after another by a single worker thread, while the event
+loop keeps accepting requests. Identical reads arriving while such a read is
+queued or running are coalesced into a single transaction. A write ends
+the coalescing of all reads issued before it. Clients can pipeline requests:
+every request carries an id, and responses are sent as soon as they are
+available.
+
+ProxyTrbNet is a client with the API of TrbNet.
+
+Framing (little endian):
+
+* request: uint32 id, uint8 opcode, uint8 option, uint16 trb_address,
+  uint16 reg_address, uint16 size, uint32 payload length in bytes, payload
+  (uint32 words to write)
+* response: uint32 id, int32 status (0: ok, > 0: TrbNet errno, -1: other error),
+  int32 trb_errno and uint16 status_common, status_channel, sequence, channel
+  (trb_term) after the transaction, uint32 payload length in bytes, payload
+  (uint32 words of the response as returned by libtrbnet or a UTF-8 error message)
+
+The trb_errno and trb_term of every transaction are sent back with its
+response, so that status warnings (TRB_STATUS_WARNING) of successful
+transactions reach the clients as with a direct connection. The
+TERMSTR request (trb_term in the trb_address, reg_address, option and size
+fields) returns the server's trb_termstr() as UTF-8.
+'''
+import asyncio, json, os, socket, struct, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .lowlevel import _TrbNet
+from .highlevel import TrbNet
+from .error import TrbException, TrbError
+
+REQUEST = struct.Struct('<IBBHHHI')
+RESPONSE = struct.Struct('<IiiHHHHI')
+
+READ, READ_MEM, WRITE, WRITE_MEM, READ_UID, STATISTICS, TERMSTR = range(1, 8)
+
+DEFAULT_ADDRESS = 'unix:/tmp/trbnet-proxy.sock'
+
+
+def _parse_address(address):
+    '''
+    Returns:
+    tuple -- ('unix', path) or ('tcp', (host, port))
+    '''
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return 'tcp', (host or 'localhost', int(port))
+
+
+class TrbNetProxyServer(object):
+    '''
+    Arguments:
+    trbnet -- the TrbNet instance to use for all requests (default: a new TrbNet())
+    address -- 'unix:/path/to/socket' or 'host:port' to listen on (default: $TRBNET_PROXY or DEFAULT_ADDRESS)
+    '''
+
+    def __init__(self, trbnet=None, address=None):
+        self.trbnet = trbnet if trbnet is not None else TrbNet()
+        self.address = address or os.environ.get('TRBNET_PROXY', DEFAULT_ADDRESS)
+        self.statistics = {'connections': 0, 'requests': 0, 'coalesced': 0, 'transactions': 0, 'errors': 0}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._inflight = {}
+
+    def _read(self, trb_address, reg_address):
+        return np.asarray(self.trbnet.trb_register_read(trb_address, reg_address), dtype='<u4').tobytes()
+
+    def _read_mem(self, trb_address, reg_address, option, size):
+        data_array, status = self.trbnet._trb_register_read_mem(trb_address, reg_address, option, size)
+        return np.frombuffer(data_array, dtype=np.uint32, count=status).astype('<u4').tobytes()
+
+    def _write(self, trb_address, reg_address, value):
+        self.trbnet.trb_register_write(trb_address, reg_address, value)
+        return b''
+
+    def _write_mem(self, trb_address, reg_address, option, values):
+        self.trbnet.trb_register_write_mem(trb_address, reg_address, option, values)
+        return b''
+
+    def _read_uid(self, trb_address):
+        return np.asarray(self.trbnet.trb_read_uid(trb_address), dtype='<u4').tobytes()
+
+    def _termstr(self, term):
+        return self.trbnet.trb_termstr(term).encode('utf-8')
+
+    def _transaction(self, func, *args):
+        '''
+        Run func(*args) in the TrbNet thread and capture the trb_errno and
+        trb_term it left behind, before the next transaction overwrites them.
+
+        Returns:
+        tuple -- (status, result bytes or error message, trb_errno, trb_term)
+        '''
+        try:
+            status, result = 0, func(*args)
+        except TrbException as e:
+            status, result = int(e.errno), str(e.msg).encode('utf-8')
+        return status, result, self.trbnet.trb_errno(), tuple(self.trbnet.trb_term())
+
+    async def _execute(self, key, func, *args):
+        '''
+        Run func(*args) in the TrbNet thread. Reads (key not None) join
+        an identical read already queued or running.
+        '''
+        if key is None:
+            # reads issued after a write must not return data read before it
+            self._inflight.clear()
+        else:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.statistics['coalesced'] += 1
+                return await asyncio.shield(future)
+        self.statistics['transactions'] += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._transaction, func, *args)
+        if key is not None:
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key) if self._inflight.get(key) is f else None)
+        return await asyncio.shield(future)
+
+    def _dispatch(self, opcode, option, trb_address, reg_address, size, payload):
+        if opcode == READ:
+            return ('r', trb_address, reg_address), self._read, (trb_address, reg_address)
+        if opcode == READ_MEM:
+            return ('rm', trb_address, reg_address, option, size), self._read_mem, (trb_address, reg_address, option, size)
+        if opcode == WRITE:
+            value, = struct.unpack('<I', payload)
+            return None, self._write, (trb_address, reg_address, value)
+        if opcode == WRITE_MEM:
+            values = np.frombuffer(payload, dtype='<u4').astype(np.uint32)
+            return None, self._write_mem, (trb_address, reg_address, option, values)
+        if opcode == READ_UID:
+            return ('uid', trb_address), self._read_uid, (trb_address,)
+        if opcode == TERMSTR:
+            term = (trb_address, reg_address, size, option)
+            return ('termstr',) + term, self._termstr, (term,)
+        raise ValueError('Unknown opcode %d' % opcode)
+
+    async def _respond(self, writer, lock, request_id, opcode, option, trb_address, reg_address, size, payload):
+        self.statistics['requests'] += 1
+        errno, term = 0, (0, 0, 0, 0)
+        try:
+            if opcode == STATISTICS:
+                status, result = 0, json.dumps(self.statistics).encode('utf-8')
+            else:
+                key, func, args = self._dispatch(opcode, option, trb_address, reg_address, size, payload)
+                status, result, errno, term = await self._execute(key, func, *args)
+                if status:
+                    self.statistics['errors'] += 1
+        except Exception as e:
+            self.statistics['errors'] += 1
+            status, result = -1, repr(e).encode('utf-8')
+        async with lock:
+            writer.write(RESPONSE.pack(request_id, status, errno, *term, len(result)) + result)
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.statistics['connections'] += 1
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST.size)
+                request_id, opcode, option, trb_address, reg_address, size, length = REQUEST.unpack(header)
+                payload = await reader.readexactly(length) if length else b''
+                task = asyncio.ensure_future(self._respond(writer, lock, request_id, opcode, option,
+                                                           trb_address, reg_address, size, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve_forever(self):
+        kind, address = _parse_address(self.address)
+        if kind == 'unix':
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await asyncio.start_unix_server(self._handle, path=address)
+        else:
+            server = await asyncio.start_server(self._handle, host=address[0], port=address[1])
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        finally:
+            self._executor.shutdown(wait=False)
+
+
+class _ProxyTrbNet(_TrbNet):
+    '''
+    Stand-in for _TrbNet sending all requests to a TrbNetProxyServer.
+    Instances can be shared between threads (requests are serialized).
+
+    Keyword arguments:
+    address -- address of the proxy (default: $TRBNET_PROXY or DEFAULT_ADDRESS)
+    timeout -- socket timeout in seconds (default: None, no timeout)
+    '''
+
+    def __init__(self, address: str = None, timeout: float = None, buffersize: int = 4194304, **kwargs):
+        self.libtrbnet = None
+        self.buffersize = buffersize
+        self.address = address or os.environ.get('TRBNET_PROXY', DEFAULT_ADDRESS)
+        kind, target = _parse_address(self.address)
+        if kind == 'unix':
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(timeout)
+        self._socket.connect(target)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._responses = {}
+        self._errno = 0
+        self._term = (0, 0, 0, 0)
+
+    def __del__(self):
+        try:
+            self._socket.close()
+        except AttributeError:
+            pass
+
+    def _recv_exactly(self, size: int) -> bytes:
+        buf = bytearray(size)
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            n = self._socket.recv_into(view[received:])
+            if not n:
+                raise ConnectionError('Connection to the TrbNet proxy closed')
+            received += n
+        return bytes(buf)
+
+    def _send(self, opcode: int, trb_address: int = 0, reg_address: int = 0, option: int = 0, size: int = 0,
+              payload: bytes = b'') -> int:
+        request_id = self._next_id
+        self._next_id = (self._next_id + 1) & 0xffffffff
+        self._socket.sendall(REQUEST.pack(request_id, opcode, option, trb_address, reg_address, size, len(payload)) + payload)
+        return request_id
+
+    def _receive(self, request_id: int) -> Tuple[int, int, Tuple[int, int, int, int], bytes]:
+        while request_id not in self._responses:
+            response_id, status, errno, *term, length = RESPONSE.unpack(self._recv_exactly(RESPONSE.size))
+            self._responses[response_id] = (status, errno, tuple(term), self._recv_exactly(length) if length else b'')
+        return self._responses.pop(request_id)
+
+    def _result(self, response: Tuple, message: str) -> np.ndarray:
+        status, self._errno, self._term, payload = response
+        if status > 0:
+            raise TrbException(payload.decode('utf-8') or message, status, self.trb_errorstr(status))
+        if status < 0:
+            raise TrbException('TrbNet proxy error: %s' % payload.decode('utf-8'), status, self.trb_errorstr(status))
+        return np.frombuffer(payload, dtype='<u4')
+
+    def _request(self, message: str, *args, **kwargs) -> np.ndarray:
+        with self._lock:
+            response = self._receive(self._send(*args, **kwargs))
+        return self._result(response, message)
+
+    def _pipeline(self, requests: List[Tuple]) -> List:
+        '''
+        Send all requests (tuples of arguments to ._send()) before waiting
+        for the responses.
+
+        Returns:
+        list -- of (status, trb_errno, trb_term, payload) tuples
+        '''
+        with self._lock:
+            request_ids = [self._send(*request) for request in requests]
+            return [self._receive(request_id) for request_id in request_ids]
+
+    def proxy_statistics(self) -> Dict[str, int]:
+        with self._lock:
+            status, errno, term, payload = self._receive(self._send(STATISTICS))
+        return json.loads(payload.decode('utf-8'))
+
+    def trb_errno(self) -> int:
+        return self._errno
+
+    def trb_term(self) -> Tuple[int, int, int, int]:
+        return self._term
+
+    def trb_errorstr(self, errno: int) -> str:
+        try:
+            return TrbError(errno).name
+        except ValueError:
+            return 'unknown error %d' % errno
+
+    def trb_termstr(self, term) -> str:
+        if not isinstance(term, tuple):
+            term = (term.status_common, term.status_channel, term.sequence, term.channel)
+        status_common, status_channel, sequence, channel = term
+        with self._lock:
+            # not passed through ._result(), which would replace the trb_errno and trb_term
+            status, errno, term, payload = self._receive(self._send(TERMSTR, status_common, status_channel, channel, sequence))
+        return payload.decode('utf-8') if status == 0 else ''
+
+    def trb_register_read(self, trb_address: int, reg_address: int) -> List[int]:
+        return self._request('Error while reading trb register.', READ, trb_address, reg_address).tolist()
+
+    def trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> List[int]:
+        data_array, status = self._trb_register_read_mem(trb_address, reg_address, option, size)
+        return data_array.tolist()
+
+    def _trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> Tuple[np.ndarray, int]:
+        lin_data = self._request('Error while reading trb register memory.', READ_MEM, trb_address, reg_address, option, size)
+        return lin_data, len(lin_data)
+
+    def trb_register_write(self, trb_address: int, reg_address: int, value: int):
+        self._request('Error while writing trb register.', WRITE, trb_address, reg_address,
+                      payload=struct.pack('<I', value & 0xffffffff))
+
+    def trb_register_write_mem(self, trb_address: int, reg_address: int, option: int, values: List[int], size: int = None):
+        values = np.asarray(values[:size] if size else values, dtype='<u4')
+        self._request('Error while writing trb register memory.', WRITE_MEM, trb_address, reg_address, option,
+                      payload=values.tobytes())
+
+    def trb_read_uid(self, trb_address: int) -> List[int]:
+        return self._request('Error while reading trb uid.', READ_UID, trb_address).tolist()
+
+
+class ProxyTrbNet(TrbNet, _ProxyTrbNet):
+    '''
+    The high level TrbNet API on top of a TrbNetProxyServer
+    (see _ProxyTrbNet for the keyword arguments).
+    '''
+
+    def register_read_many(self, requests: List[Tuple[int, int]]) -> List[Dict[int, int]]:
+        '''
+        Pipelined version of register_read() for a list of
+        (trb_address, reg_address) tuples.
+
+        Returns:
+        list -- of dicts as returned by register_read()
+        '''
+        responses = self._pipeline([(READ, trb_address, reg_address) for trb_address, reg_address in requests])
+        results = []
+        for response in responses:
+            lin_data = self._result(response, 'Error while reading trb register.').tolist()
+            result = self._get_dynamic_trb_address_dict(lin_data, force_length=1)
+            results.append({key: value[0] for key, value in result.items()})
+        return results
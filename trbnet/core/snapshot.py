@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+'''
+Register snapshots shared via a memory-mapped file.
+
+A single SnapshotPoller reads a set of register blocks from TrbNet
+periodically and stores the latest raw words of every responding board
+together with the time of the read in a snapshot file. Any number of local
+consumers can use SnapshotTrbNet, a read-only TrbNet backend serving
+register_read() and register_read_mem() (and thus the xmlget functions)
+from the snapshot instead of sending requests to TrbNet.
+
+File layout:
+
+* 8 bytes magic: b'TRBSNAP1'
+* 4 bytes little endian uint32: length of the JSON index in bytes
+* 4 bytes reserved
+* the JSON index {'created': ..., 'slots': [[trb_address, start, size, responder, offset], ...]}
+* one slot per polled block and responder at offset (8 byte aligned):
+  uint64 sequence number, float64 timestamp, int32 status (0: valid,
+  -1: responder missing in the last response, > 0: TrbNet errno),
+  uint32 size, size * uint32 register words
+
+The sequence number of a slot is odd while the poller updates it (seqlock),
+so readers can detect and retry torn reads without any locking.
+'''
+import json, mmap, os, struct, time
+from typing import List, Tuple
+
+import numpy as np
+
+from .lowlevel import _TrbNet
+from .highlevel import TrbNet
+from .error import TrbException, TrbError
+from .health import EndpointHealth
+
+MAGIC = b'TRBSNAP1'
+HEADER = struct.Struct('<8sII')
+SLOT_HEADER = 24
+MISSING = -1
+
+
+class _Slot(object):
+    '''
+    View of a slot of the snapshot file (see module docstring).
+    '''
+
+    def __init__(self, buf, trb_address, start, size, responder, offset):
+        self.trb_address, self.start, self.size, self.responder = trb_address, start, size, responder
+        self.sequence = np.ndarray(1, dtype='<u8', buffer=buf, offset=offset)
+        self.timestamp = np.ndarray(1, dtype='<f8', buffer=buf, offset=offset + 8)
+        self.status = np.ndarray(1, dtype='<i4', buffer=buf, offset=offset + 16)
+        self.words = np.ndarray(size, dtype='<u4', buffer=buf, offset=offset + SLOT_HEADER)
+
+    def write(self, timestamp, status, words=None):
+        self.sequence[0] += 1
+        if words is not None:
+            self.words[:] = words
+        self.timestamp[0] = timestamp
+        self.status[0] = status
+        self.sequence[0] += 1
+
+    def read(self, first=0, count=None, retries=1000):
+        '''
+        Returns:
+        tuple -- (timestamp, status, copy of the words [first:first+count])
+        '''
+        count = self.size - first if count is None else count
+        for attempt in range(retries):
+            sequence = int(self.sequence[0])
+            if sequence % 2:
+                continue
+            timestamp, status = float(self.timestamp[0]), int(self.status[0])
+            words = self.words[first:first+count].copy()
+            if int(self.sequence[0]) == sequence:
+                return timestamp, status, words
+        raise TrbException('Snapshot slot permanently busy.', TrbError.TRB_SEMAPHORE, TrbError.TRB_SEMAPHORE.name)
+
+
+def _open_slots(buf):
+    magic, length, reserved = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a TrbNet register snapshot file')
+    index = json.loads(bytes(buf[HEADER.size:HEADER.size+length]).decode('utf-8'))
+    return index, [_Slot(buf, *slot) for slot in index['slots']]
+
+
+def create_snapshot_file(path, layout):
+    '''
+    Create a snapshot file for the (trb_address, start, size, responder)
+    slots in layout. The file is created next to path and then moved there,
+    so that clients never see an incomplete file.
+    '''
+    relative, size_total = [], 0
+    for trb_address, start, size, responder in layout:
+        relative.append(size_total)
+        size_total += SLOT_HEADER + 8 * ((size + 1) // 2)
+    # the offsets in the index depend on its own length
+    created, data_start = time.time(), HEADER.size
+    while True:
+        index = {'created': created, 'slots': [[trb_address, start, size, responder, data_start + offset] for
+                                               (trb_address, start, size, responder), offset in zip(layout, relative)]}
+        encoded = json.dumps(index).encode('utf-8')
+        needed = HEADER.size + len(encoded)
+        needed += (-needed) % 8
+        if needed <= data_start:
+            break
+        data_start = needed
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(encoded), 0))
+        f.write(encoded)
+        f.truncate(data_start + size_total)
+    os.replace(tmp_path, path)
+
+
+class SnapshotPoller(object):
+    '''
+    Polls register blocks from TrbNet into a snapshot file.
+
+    Arguments:
+    path -- the snapshot file
+    blocks -- list of (trb_address, start, size) blocks read with register_read_mem()
+    trbnet -- TrbNet instance to use (default: a new TrbNet())
+    interval -- time between polls in seconds
+    responders -- optional dict {trb_address: [expected responders]}; blocks of other
+                  trb addresses are read once on .open() to find the responders
+    '''
+
+    def __init__(self, path, blocks, trbnet=None, interval=1.0, responders=None):
+        self.path = path
+        self.blocks = [tuple(block) for block in blocks]
+        self.trbnet = trbnet if trbnet is not None else TrbNet()
+        self.interval = interval
+        self.responders = dict(responders or {})
+        self.health = EndpointHealth()
+        self._slots = None
+
+    def _read(self, trb_address, start, size):
+        data_array, status = self.trbnet._trb_register_read_mem(trb_address, start, 0, size)
+        lin_data = np.frombuffer(data_array, dtype=np.uint32, count=status)
+        responses, offset = {}, 0
+        while len(lin_data) > offset:
+            header = int(lin_data[offset])
+            length, responder = (header >> 16), (header & 0xffff)
+            responses[responder] = lin_data[offset+1:offset+1+length]
+            offset += 1 + length
+        return responses
+
+    def open(self):
+        '''
+        Discover the responders (if not given), create the snapshot file and map it.
+        '''
+        layout = []
+        for trb_address, start, size in self.blocks:
+            responders = self.responders.get(trb_address)
+            if responders is None:
+                try:
+                    responders = sorted(self._read(trb_address, start, size))
+                except TrbException:
+                    responders = []
+                self.responders[trb_address] = responders
+            layout += [(trb_address, start, size, responder) for responder in (responders or [trb_address])]
+        create_snapshot_file(self.path, layout)
+        self._file = open(self.path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        index, slots = _open_slots(self._mmap)
+        self._slots = {}
+        for slot in slots:
+            self._slots.setdefault((slot.trb_address, slot.start, slot.size), []).append(slot)
+
+    def poll(self):
+        '''
+        Read all blocks once and update the snapshot.
+
+        Returns:
+        int -- number of failed reads
+        '''
+        if self._slots is None:
+            self.open()
+        failed = 0
+        for trb_address, start, size in self.blocks:
+            slots = self._slots[(trb_address, start, size)]
+            if not self.health.check(self.trbnet, trb_address):
+                for slot in slots:
+                    slot.write(time.time(), TrbError.TRB_ENDPOINT_NOT_REACHED)
+                failed += 1
+                continue
+            try:
+                responses = self._read(trb_address, start, size)
+            except TrbException as e:
+                self.health.record_failure(trb_address, e)
+                for slot in slots:
+                    slot.write(time.time(), int(e.errno))
+                failed += 1
+                continue
+            self.health.record_success(trb_address)
+            timestamp = time.time()
+            for slot in slots:
+                words = responses.get(slot.responder)
+                if words is None or len(words) != size:
+                    slot.write(timestamp, MISSING)
+                else:
+                    slot.write(timestamp, 0, words)
+        return failed
+
+    def run(self, count=0):
+        '''
+        Poll every .interval seconds (on a fixed grid), count times (0: forever).
+        '''
+        start = time.monotonic()
+        polls = 0
+        while True:
+            self.poll()
+            polls += 1
+            if count and polls >= count:
+                break
+            slot = int((time.monotonic() - start) / self.interval) + 1
+            time.sleep(max(0.0, start + slot * self.interval - time.monotonic()))
+
+    def close(self):
+        if self._slots is not None:
+            self._slots = None
+            self._mmap.close()
+            self._file.close()
+
+
+class _SnapshotTrbNet(_TrbNet):
+    '''
+    Read-only stand-in for _TrbNet answering register reads from a snapshot
+    file written by a SnapshotPoller.
+
+    A read of trb_address is served from the slots polled from trb_address
+    (all of its responders) or, if there are none, from the slots in which
+    trb_address was a responder. Data older than max_age seconds is not used.
+    Reads not covered by the snapshot are forwarded to fallback (a TrbNet
+    instance) if given, otherwise they fail with a TrbException.
+
+    If the poller replaces the file (e.g. after a restart with other blocks),
+    the new file is mapped: its inode is checked at most every check_interval
+    seconds and whenever a read can't be answered from the snapshot.
+
+    Keyword arguments:
+    path -- the snapshot file
+    max_age -- maximum age of the data in seconds (default: None, any age)
+    fallback -- TrbNet instance for reads not covered by the snapshot (default: None)
+    check_interval -- seconds between two checks for a replaced file (default: 1.0, 0: every read)
+    '''
+
+    def __init__(self, path: str, max_age: float = None, fallback=None, check_interval: float = 1.0,
+                 buffersize: int = 4194304, **kwargs):
+        self.libtrbnet = None
+        self.buffersize = buffersize
+        self.path = path
+        self.max_age = max_age
+        self.fallback = fallback
+        self.check_interval = check_interval
+        self._mmap = None
+        self._open()
+
+    def __del__(self):
+        pass
+
+    def _open(self):
+        self._checked = time.monotonic()
+        with open(self.path, 'rb') as f:
+            self._inode = os.fstat(f.fileno()).st_ino
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index, slots = _open_slots(buf)
+        self._mmap = buf
+        self._by_address = {}
+        self._by_responder = {}
+        for slot in slots:
+            self._by_address.setdefault(slot.trb_address, []).append(slot)
+            self._by_responder.setdefault(slot.responder, []).append(slot)
+
+    def _reopen_if_replaced(self, force: bool = False) -> bool:
+        '''
+        Map the file at .path again if it was replaced (checked at most every
+        .check_interval seconds unless force is set).
+
+        Returns:
+        bool -- True if the new file was mapped
+        '''
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        try:
+            replaced = os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return False
+        if replaced:
+            self._open()
+        return replaced
+
+    def _lookup(self, trb_address: int, reg_address: int, size: int) -> List[Tuple[int, np.ndarray]]:
+        '''
+        Returns:
+        list -- of (responder, words) covering [reg_address, reg_address + size)
+
+        Raises a TrbException if the snapshot doesn't cover the request.
+        '''
+        self._reopen_if_replaced()
+        for attempt in range(2):
+            slots = self._by_address.get(trb_address) or self._by_responder.get(trb_address, [])
+            results, errors, stale = {}, [], False
+            now = time.time()
+            for slot in slots:
+                if slot.responder in results or not slot.start <= reg_address <= slot.start + slot.size - size:
+                    continue
+                timestamp, status, words = slot.read(reg_address - slot.start, size)
+                if self.max_age is not None and now - timestamp > self.max_age:
+                    stale = True
+                elif status == 0:
+                    results[slot.responder] = words
+                elif status > 0:
+                    errors.append(status)
+            if results:
+                return sorted(results.items())
+            # the data of a replaced file is stale or missing
+            if attempt or not self._reopen_if_replaced(force=True):
+                break
+        if errors:
+            errno = errors[0]
+            raise TrbException('Error while reading trb register (snapshot).', errno, self.trb_errorstr(errno))
+        if stale:
+            raise TrbException('Snapshot data older than %s s.' % self.max_age,
+                               TrbError.TRB_FIFO_TIMEOUT, TrbError.TRB_FIFO_TIMEOUT.name)
+        raise TrbException('Register not covered by the snapshot.',
+                           TrbError.TRB_INVALID_ADDRESS, TrbError.TRB_INVALID_ADDRESS.name)
+
+    def _response(self, trb_address: int, reg_address: int, size: int) -> np.ndarray:
+        responses = self._lookup(trb_address, reg_address, size)
+        lin_data = np.empty(len(responses) * (size + 1), dtype=np.uint32)
+        for row, (responder, words) in enumerate(responses):
+            offset = row * (size + 1)
+            lin_data[offset] = (size << 16) | responder
+            lin_data[offset+1:offset+1+size] = words
+        return lin_data
+
+    def _covered(self, trb_address: int, reg_address: int, size: int) -> bool:
+        self._reopen_if_replaced()
+        for attempt in range(2):
+            slots = self._by_address.get(trb_address) or self._by_responder.get(trb_address, [])
+            if any(slot.start <= reg_address <= slot.start + slot.size - size for slot in slots):
+                return True
+            if attempt or not self._reopen_if_replaced(force=True):
+                return False
+
+    def trb_errno(self) -> int:
+        return self.fallback.trb_errno() if self.fallback is not None else 0
+
+    def trb_term(self) -> Tuple[int, int, int, int]:
+        return self.fallback.trb_term() if self.fallback is not None else (0, 0, 0, 0)
+
+    def trb_errorstr(self, errno: int) -> str:
+        try:
+            return TrbError(errno).name
+        except ValueError:
+            return 'unknown error %d' % errno
+
+    def trb_termstr(self, term) -> str:
+        return self.fallback.trb_termstr(term) if self.fallback is not None else ''
+
+    def trb_register_read(self, trb_address: int, reg_address: int) -> List[int]:
+        if self.fallback is not None and not self._covered(trb_address, reg_address, 1):
+            return self.fallback.trb_register_read(trb_address, reg_address)
+        return self._response(trb_address, reg_address, 1).tolist()
+
+    def trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> List[int]:
+        data_array, status = self._trb_register_read_mem(trb_address, reg_address, option, size)
+        return data_array[:status].tolist()
+
+    def _trb_register_read_mem(self, trb_address: int, reg_address: int, option: int, size: int) -> Tuple[np.ndarray, int]:
+        if option or not self._covered(trb_address, reg_address, size):
+            # reading the same register repeatedly can't be served from a snapshot
+            if self.fallback is not None:
+                return self.fallback._trb_register_read_mem(trb_address, reg_address, option, size)
+            if option:
+                raise TrbException('Repeated reads are not supported by the snapshot backend.',
+                                   TrbError.TRB_TRB3_CMD_NOT_SUPPORTED, TrbError.TRB_TRB3_CMD_NOT_SUPPORTED.name)
+        lin_data = self._response(trb_address, reg_address, size)
+        return lin_data, len(lin_data)
+
+    def trb_register_write(self, trb_address: int, reg_address: int, value: int):
+        raise TrbException('The snapshot backend is read-only.',
+                           TrbError.TRB_TRB3_CMD_NOT_SUPPORTED, TrbError.TRB_TRB3_CMD_NOT_SUPPORTED.name)
+
+    def trb_register_write_mem(self, trb_address: int, reg_address: int, option: int, values: List[int], size: int = None):
+        self.trb_register_write(trb_address, reg_address, 0)
+
+
+class SnapshotTrbNet(TrbNet, _SnapshotTrbNet):
+    '''
+    The high level TrbNet API served from a snapshot file
+    (see _SnapshotTrbNet for the keyword arguments).
+    '''
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import click, json, time
+
+from trbnet.util.trbcmd import _based_int
+
+from trbnet.epics.pcaspy_ioc import TrbNetIOC
+
+### Helpers
+
+def _int(value):
+    return value if isinstance(value, int) else _based_int(value)
+
+def _history(value):
+    '''
+    Parses a history option of the form PATTERN[:SIZE].
+    '''
+    pattern, _, size = value.rpartition(':')
+    if not pattern or not size.isdigit():
+        return value, 60
+    return pattern, int(size)
+
+def _configure(ioc, subscriptions, topology=None, histories=()):
+    '''
+    Configure the IOC from a subscriptions file (JSON list of objects with the
+    keys trb_address, entity, name and optionally rates, waveforms and
+    merge_responders; or with a search query instead of entity and name,
+    optionally restricted to a list of entities) and a topology file
+    (JSON object mapping trb addresses to the list of answering trb addresses).
+    '''
+    for subscription in json.load(subscriptions):
+        options = dict(rates=subscription.get('rates', False),
+                       waveforms=subscription.get('waveforms', False),
+                       merge_responders=subscription.get('merge_responders', False))
+        if 'search' in subscription:
+            ioc.add_search_subscription(_int(subscription['trb_address']), subscription['search'],
+                                        entities=subscription.get('entities'), **options)
+        else:
+            ioc.add_subscription(_int(subscription['trb_address']), subscription['entity'], subscription['name'],
+                                 **options)
+    if topology:
+        for send_to_trb_address, answer_from_trb_addresses in json.load(topology).items():
+            ioc.add_expected_trb_addresses(_int(send_to_trb_address),
+                                           [_int(trb_address) for trb_address in answer_from_trb_addresses])
+    for history in histories:
+        ioc.add_history(*_history(history))
+
+### Definition of the CLI with the help of the click package:
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.argument('subscriptions', type=click.File('r'))
+@click.argument('topology', type=click.File('r'))
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--history', 'histories', multiple=True, metavar='PATTERN[:SIZE]',
+              help='keep a history of SIZE values (default: 60) for the PVs matching PATTERN')
+def compile(subscriptions, topology, output, histories):
+    """
+    Compile SUBSCRIPTIONS, the XmlDb and TOPOLOGY into the
+    PV database / scan plan file OUTPUT (without accessing TrbNet).
+    """
+    start = time.time()
+    ioc = TrbNetIOC()
+    _configure(ioc, subscriptions, topology, histories)
+    ioc.initialize(live=False)
+    ioc.save_compiled(output)
+    click.echo('%d PVs compiled in %.3f s' % (len(ioc.all_pvs), time.time() - start), err=True)
+
+@cli.command()
+@click.option('--compiled', type=click.Path(exists=True, dir_okay=False), help='compiled PV database to load')
+@click.option('--subscriptions', type=click.File('r'), help='subscriptions file (if not using --compiled)')
+@click.option('--topology', type=click.File('r'), help='topology file (if not using --compiled)')
+@click.option('--prefix', default='', help='prefix for all PV names')
+@click.option('--scan-period', type=float, default=1.0, help='scan period in seconds')
+@click.option('--history', 'histories', multiple=True, metavar='PATTERN[:SIZE]',
+              help='keep a history of SIZE values (default: 60) for the PVs matching PATTERN')
+@click.option('--workers', '-j', type=int, default=1, help='number of scan worker processes')
+@click.option('--daqopserver', 'daqopservers', multiple=True,
+              help='trbnetd daemon(s) to connect the workers to (round robin, default: $DAQOPSERVER)')
+@click.option('--static-ttl', type=float, default=0.0,
+              help='read registers which never change (CompileTime, ...) only every STATIC_TTL seconds')
+@click.option('--reload-xmldb', 'reload_period', type=float, default=0.0, metavar='SECONDS',
+              help='check the XmlDb files for changes every SECONDS and reload changed entities')
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='record the phase timings (plan, read, decode, publish) of the scans to PROFILE (speedscope JSON)')
+@click.option('--profile-capture', type=int, default=0, metavar='N',
+              help='with --profile: capture cProfile statistics of the first N scan cycles (PROFILE-1.pstats), '
+                   'later captures are triggered by writing N to the PV profile:capture')
+@click.option('--error-summary', type=float, default=60.0, metavar='SECONDS',
+              help='log scan errors once when first seen and summarize them every SECONDS (0: never)')
+def run(compiled, subscriptions, topology, prefix, scan_period, histories, workers, daqopservers, static_ttl, reload_period,
+        profile, profile_capture, error_summary):
+    """
+    Run the TrbNet EPICS IOC.
+    """
+    ioc = TrbNetIOC()
+    ioc.prefix = prefix
+    ioc.scan_period = scan_period
+    ioc.workers = workers
+    ioc.daqopservers = list(daqopservers)
+    ioc.static_ttl = static_ttl
+    ioc.reload_period = reload_period
+    ioc.profile = profile
+    ioc.profile_capture = profile_capture
+    ioc.error_summary_period = error_summary
+    if compiled:
+        start = time.time()
+        for history in histories:
+            ioc.add_history(*_history(history))
+        ioc.load_compiled(compiled)
+        click.echo('%d PVs loaded in %.3f s' % (len(ioc.all_pvs), time.time() - start), err=True)
+    elif subscriptions:
+        _configure(ioc, subscriptions, topology, histories)
+    else:
+        raise click.UsageError('Either --compiled or --subscriptions is required.')
+    ioc.run()
+
+if __name__ == '__main__':
+    cli()
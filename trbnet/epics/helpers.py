@@ -8,10 +8,14 @@ class SeenBeforeFilter(logging.Filter):
     the filtering to a subset of messages.
     If present, it will be called with the tuple (module, levelno, msg, args).
     If it evaluates to true, the filtering is done, otherwise not.
+    At most max_entries log entries are remembered (the oldest are
+    forgotten first), the lookup is a hash set lookup.
     """
-    def __init__(self, restriction_func=None):
+    def __init__(self, restriction_func=None, max_entries=10000):
         self.restriction_func = restriction_func
-        self.seen_before = []
+        self.max_entries = max_entries
+        # insertion ordered dict used as a bounded set
+        self.seen_before = {}
         super().__init__()
     def filter(self, record):
         # add other fields if you need more granular comparison, depends on your app
@@ -21,8 +25,14 @@ class SeenBeforeFilter(logging.Filter):
                 # we do not restrict the filtering to this log entry, 
                 # so just log it as usual...
                 return True
-        if current_log not in self.seen_before:
-            self.seen_before.append(current_log)
-            return True
-        return False
+        try:
+            hash(current_log)
+        except TypeError:
+            current_log = repr(current_log)
+        if current_log in self.seen_before:
+            return False
+        self.seen_before[current_log] = None
+        if len(self.seen_before) > self.max_entries:
+            del self.seen_before[next(iter(self.seen_before))]
+        return True
 
@@ -0,0 +1,90 @@
+import numpy as np
+
+class History(object):
+    '''
+    Fixed-size ring buffer of (timestamp, value) samples of a single PV
+    with rolling aggregates (min, max, mean and slope over the window).
+
+    All memory is allocated once (3 * size * 8 bytes); appending a
+    sample updates the aggregates incrementally: the sum is updated with
+    the incoming and outgoing values (and recomputed once per turn of the
+    ring to avoid accumulating rounding errors), min and max are only
+    recomputed when the outgoing value was the current extreme.
+    '''
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('History size must be at least 1.')
+        self.size = size
+        self._values = np.zeros(size, dtype=np.float64)
+        self._times = np.zeros(size, dtype=np.float64)
+        self._ordered = np.zeros(size, dtype=np.float64)
+        self._next = 0
+        self.count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+
+    def append(self, value, timestamp):
+        value = float(value)
+        pos = self._next
+        full = self.count == self.size
+        outgoing = self._values[pos] if full else None
+        self._values[pos] = value
+        self._times[pos] = timestamp
+        self._next = (pos + 1) % self.size
+        if not full:
+            self.count += 1
+        if self._next == 0:
+            self._sum = float(self._values[:self.count].sum())
+        else:
+            self._sum += value - (outgoing or 0.0)
+        if outgoing is not None and (outgoing == self._min or outgoing == self._max):
+            window = self._values[:self.count]
+            self._min, self._max = float(window.min()), float(window.max())
+        else:
+            self._min = value if self._min is None else min(self._min, value)
+            self._max = value if self._max is None else max(self._max, value)
+
+    @property
+    def _oldest(self):
+        return self._next if self.count == self.size else 0
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return self._sum / self.count if self.count else None
+
+    @property
+    def slope(self):
+        '''
+        Change of the value per second over the window.
+        '''
+        if self.count < 2:
+            return None
+        oldest, newest = self._oldest, (self._next - 1) % self.size
+        dt = self._times[newest] - self._times[oldest]
+        if dt <= 0:
+            return None
+        return float((self._values[newest] - self._values[oldest]) / dt)
+
+    def values(self):
+        '''
+        Returns the samples in chronological order (a view of a
+        preallocated array, valid until the next call).
+        '''
+        oldest = self._oldest
+        head = self.count - oldest
+        self._ordered[:head] = self._values[oldest:self.count]
+        self._ordered[head:self.count] = self._values[:oldest]
+        return self._ordered[:self.count]
+
+    def aggregates(self):
+        return {'min': self.min, 'max': self.max, 'mean': self.mean, 'slope': self.slope}
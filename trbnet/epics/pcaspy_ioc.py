@@ -1,18 +1,23 @@
 #!/usr/bin/env python
 
-import time, threading, logging
+import time, threading, logging, json, fnmatch
 
-from trbnet.core import TrbNet, TrbException
-from trbnet.xmldb import XmlDb
-from trbnet.util.trbcmd import _xmlget as xmlget, _xmlentry as xmlentry
+from trbnet.core import TrbNet, TrbException, EndpointHealth
+from trbnet.xmldb import RateEngine
+from trbnet.util.trbcmd import _xmlget as xmlget, _xmlentry as xmlentry, _xmlplan as xmlplan
+from trbnet.util.trbcmd import _xmlread as xmlread, _xmldecode as xmldecode, _xmlarrays as xmlarrays
+from trbnet.util.trbcmd import t as trbnet_connection
+# share the XmlDb (and its caches) with the functions imported from trbcmd
+from trbnet.util.trbcmd import db
 
 from pcaspy import Driver, SimpleServer, Alarm, Severity
 from pcaspy.driver import manager
 
-from .helpers import SeenBeforeFilter
+from trbnet.util.profiling import ScanProfiler
+from trbnet.util.errors import ErrorAggregator, KINDS as ERROR_KINDS
 
-t = TrbNet()
-db = XmlDb()
+from .helpers import SeenBeforeFilter
+from .history import History
 
 logger = logging.getLogger('trbnet.epics.pcaspy_ioc')
 logging.basicConfig(
@@ -27,11 +32,28 @@ class TrbNetIOC(object):
 
     def __init__(self):
         self.prefix = ''
+        self.scan_period = 1.0
+        self.workers = 1
+        self.daqopservers = []
+        self.trbnet_factory = TrbNet
+        self.static_ttl = 0.0
+        self.reload_period = 0.0
+        # record the phase timings of the scans to this file (speedscope JSON, None: off)
+        # and capture cProfile statistics of the first profile_capture cycles
+        self.profile = None
+        self.profile_capture = 0
+        # log errors (missing registers, TRB errors, ...) once when first seen
+        # and summarize them every error_summary_period seconds
+        self.error_summary_period = 60.0
         self._initialized = False
         self._subscriptions = []
+        self._rate_subscriptions = set()
+        self._waveform_subscriptions = {}
+        self._history_patterns = []
         self._pvdb = {}
         self._pvdb_manager = None
         self._expected_trb_addresses = {}
+        self.health = EndpointHealth()
 
     def before_initialization(func):
        def func_wrapper(self, *args, **kwargs):
@@ -41,16 +63,117 @@ class TrbNetIOC(object):
        return func_wrapper
 
     @before_initialization
-    def add_subscription(self, trb_address, entity, name):
+    def add_subscription(self, trb_address, entity, name, rates=False, waveforms=False, merge_responders=False):
+        '''
+        Subscribe to the fields of an XmlDb element. With rates=True, the
+        fields are treated as free-running counters and an additional PV
+        (suffix RATE_SUFFIX) publishes their rate per second.
+
+        With waveforms=True, repeated fields are published as a single
+        waveform PV per responding board instead of one PV per slice.
+        merge_responders=True additionally merges the values of all
+        expected responders of trb_address into a single waveform PV per
+        field (named after trb_address, ordered by responder, then slice).
+        '''
+        if rates and (waveforms or merge_responders):
+            raise ValueError('Rates are not supported for waveform subscriptions.')
         self._subscriptions.append((trb_address, entity, name))
+        if rates:
+            self._rate_subscriptions.add((trb_address, entity, name))
+        if waveforms or merge_responders:
+            self._waveform_subscriptions[(trb_address, entity, name)] = merge_responders
+
+    @before_initialization
+    def add_search_subscription(self, trb_address, query, entities=None, **options):
+        '''
+        Subscribe to all fields of the given entities (default: all entities)
+        matching query, e.g. 'name:*Temp* unit:°C' (see XmlDb.search()).
+        The options are passed on to .add_subscription().
+
+        Returns:
+        int -- number of subscribed fields
+        '''
+        results = db.search(query, entities=entities)
+        for result in results:
+            self.add_subscription(trb_address, result.entity, result.field_name, **options)
+        return len(results)
+
+    @before_initialization
+    def add_history(self, pattern, size=60):
+        '''
+        Keep a history of the last size values of all scalar PVs matching
+        the (fnmatch style) pattern, e.g. 'TrbNet-0x8000-*'. Each of them
+        gets the additional PVs <name>:min, <name>:max, <name>:mean,
+        <name>:slope (change per second) computed over this window and
+        the waveform PV <name>:history. The window covers size times the
+        scan period. Memory per PV: 3 * size * 8 bytes.
+        '''
+        self._history_patterns.append((pattern, size))
 
     @before_initialization
     def add_expected_trb_addresses(self, send_to_trb_address, answer_from_trb_addresses):
         self._expected_trb_addresses[send_to_trb_address] = answer_from_trb_addresses
 
-    def initialize(self):
-        self._pvdb_manager = PvdbManager(self._pvdb, self._expected_trb_addresses)
-        self._pvdb_manager.initialize(self._subscriptions)
+    def initialize(self, live=True):
+        '''
+        Set up the PV database for all subscriptions. Subscriptions without
+        expected trb addresses are queried from TrbNet to discover the
+        responding boards; with live=False this raises a ValueError instead.
+        '''
+        self._pvdb_manager = PvdbManager(self._pvdb, self._expected_trb_addresses, self._rate_subscriptions,
+                                         self._waveform_subscriptions)
+        self._pvdb_manager.initialize(self._subscriptions, live=live)
+        self._pvdb_manager.add_histories(self._history_patterns)
+        self._initialized = True
+
+    def save_compiled(self, path):
+        '''
+        Save the PV database and the scan plan to a file which can be loaded
+        with .load_compiled() to start up the IOC without any XmlDb or TrbNet
+        access.
+        '''
+        if not self._initialized:
+            raise NameError("Please run .initialize() first")
+        compiled = {
+          'version': COMPILED_VERSION,
+          'subscriptions': [list(subscription) for subscription in self._subscriptions],
+          'rate_subscriptions': [list(subscription) for subscription in self._rate_subscriptions],
+          'waveform_subscriptions': [list(subscription) + [merge] for subscription, merge in self._waveform_subscriptions.items()],
+          'waveform_responders': [self._pvdb_manager.waveform_responders.get(subscription) for subscription in self._subscriptions],
+          'expected_trb_addresses': [[send_to, list(answer_from)] for send_to, answer_from in self._expected_trb_addresses.items()],
+          'pvdb': self._pvdb,
+          'subscription_pvs': [self._pvdb_manager.subscription_pvs[subscription] for subscription in self._subscriptions],
+          'scan_plans': [self._pvdb_manager.scan_plans[subscription] for subscription in self._subscriptions],
+          'histories': self._pvdb_manager.histories,
+        }
+        with open(path, 'w') as f:
+            json.dump(compiled, f)
+
+    @before_initialization
+    def load_compiled(self, path):
+        '''
+        Initialize the IOC from a file written by .save_compiled()
+        (replaces .add_subscription() / .add_expected_trb_addresses() and .initialize()).
+        The patterns of .add_history() are applied on top of the compiled histories.
+        '''
+        with open(path) as f:
+            compiled = json.load(f)
+        if compiled.get('version') != COMPILED_VERSION:
+            raise ValueError('Unsupported compiled PV database version: %s' % compiled.get('version'))
+        self._subscriptions = [tuple(subscription) for subscription in compiled['subscriptions']]
+        self._rate_subscriptions = set(tuple(subscription) for subscription in compiled['rate_subscriptions'])
+        self._waveform_subscriptions = {tuple(subscription[:3]): subscription[3] for subscription in compiled['waveform_subscriptions']}
+        self._expected_trb_addresses = {send_to: answer_from for send_to, answer_from in compiled['expected_trb_addresses']}
+        self._pvdb.update(compiled['pvdb'])
+        self._pvdb_manager = PvdbManager(self._pvdb, self._expected_trb_addresses, self._rate_subscriptions,
+                                         self._waveform_subscriptions)
+        self._pvdb_manager.subscription_pvs = dict(zip(self._subscriptions, compiled['subscription_pvs']))
+        self._pvdb_manager.scan_plans = dict(zip(self._subscriptions, compiled['scan_plans']))
+        self._pvdb_manager.waveform_responders = {subscription: responders for subscription, responders
+                                                  in zip(self._subscriptions, compiled['waveform_responders'])
+                                                  if responders is not None}
+        self._pvdb_manager.histories = compiled['histories']
+        self._pvdb_manager.add_histories(self._history_patterns)
         self._initialized = True
 
     @property
@@ -63,20 +186,118 @@ class TrbNetIOC(object):
         if not self._initialized:
             self.initialize()
 
+        profiler = None
+        if self.profile and self.workers <= 1:
+            profiler = ScanProfiler(self.profile)
+            profiler.capture(self.profile_capture)
+            # writing N to this PV captures cProfile statistics of the next N cycles
+            self._pvdb[PROFILE_CAPTURE_PV] = {'type': 'int', 'value': 0}
+
+        errors = None
+        sharded_scanner = None
+        if self.workers > 1:
+            # scan in worker processes exchanging the values via shared memory
+            # (which also adds the error counter PVs of every worker to the PV database)
+            from .sharded import ShardedScanner, SharedTableDriver
+            sharded_scanner = ShardedScanner(self._subscriptions, self._pvdb_manager, self._pvdb, workers=self.workers,
+                                             daqopservers=self.daqopservers, scan_period=self.scan_period,
+                                             trbnet_factory=self.trbnet_factory, static_ttl=self.static_ttl,
+                                             reload_period=self.reload_period, profile=self.profile,
+                                             profile_capture=self.profile_capture,
+                                             error_summary_period=self.error_summary_period)
+        else:
+            errors = ErrorAggregator(logger=logger, summary_period=self.error_summary_period)
+            self._pvdb.update(error_pvdb())
+
         server = SimpleServer()
         server.createPV(self.prefix, self._pvdb)
-        driver = TrbNetIocDriver(self._subscriptions, self._pvdb_manager)
+        if sharded_scanner is not None:
+            sharded_scanner.start()
+            if self.reload_period > 0:
+                # parse the XmlDb to be able to detect changes of its files
+                compile_xmldb(self._subscriptions)
+            driver = SharedTableDriver(sharded_scanner, self._pvdb_manager, reload_period=self.reload_period)
+        else:
+            if self.trbnet_factory is not TrbNet or self.daqopservers:
+                connect_trbnet(self.trbnet_factory, self.daqopservers[0] if self.daqopservers else None)
+            if self.static_ttl > 0:
+                cache_static_registers(self._subscriptions, self.static_ttl, self._pvdb_manager)
+            compile_xmldb(self._subscriptions)
+            driver = TrbNetIocDriver(self._subscriptions, self._pvdb_manager, scan_period=self.scan_period, health=self.health,
+                                     reload_period=self.reload_period, profiler=profiler, errors=errors)
 
-        while True:
-            # process CA transactions
-            server.process(0.1)
+        try:
+            while True:
+                # process CA transactions
+                server.process(0.1)
+        finally:
+            if sharded_scanner is not None:
+                sharded_scanner.stop()
+            if profiler is not None:
+                profiler.save()
 
 
 class PvdbManager(object):
 
-    def __init__(self, pvdb, expected_trb_addresses):
+    def __init__(self, pvdb, expected_trb_addresses, rate_subscriptions=(), waveform_subscriptions=None):
         self._pvdb = pvdb
         self._expected_trb_addresses = expected_trb_addresses
+        self.rate_subscriptions = rate_subscriptions
+        self.waveform_subscriptions = waveform_subscriptions or {}
+        self.waveform_responders = {}
+        self.subscription_pvs = {}
+        self.scan_plans = {}
+        self.histories = {}
+
+    def responders(self, subscription):
+        '''
+        Returns:
+        list -- the trb addresses known to answer the subscription (expected
+                or discovered waveform responders, empty if unknown)
+        '''
+        responders = self.waveform_responders.get(subscription)
+        if responders is None:
+            responders = self._expected_trb_addresses.get(subscription[0], ())
+        return list(responders)
+
+    def _add_rate(self, identifier, definition):
+        self._pvdb[identifier + RATE_SUFFIX] = {
+          'type': 'float',
+          'unit': (definition['unit'] or 'counts') + '/s',
+          'prec': 2,
+        }
+
+    def add_histories(self, patterns):
+        '''
+        Add the history PVs for all scalar PVs matching one of the (pattern, size) tuples.
+        '''
+        derived = set(identifier + suffix for identifier in self.histories for suffix in HISTORY_SUFFIXES)
+        for identifier, definition in list(self._pvdb.items()):
+            if definition.get('count', 1) != 1 or definition['type'] not in ('int', 'float', 'enum'):
+                continue
+            if identifier in derived:
+                continue
+            for pattern, size in patterns:
+                if fnmatch.fnmatchcase(identifier, pattern):
+                    self.histories[identifier] = size
+                    for suffix in HISTORY_SUFFIXES:
+                        self._pvdb[identifier + suffix] = {'type': 'float', 'unit': definition.get('unit', ''), 'prec': 3}
+                    self._pvdb[identifier + HISTORY_WAVEFORM_SUFFIX] = {'type': 'float', 'count': size, 'unit': definition.get('unit', '')}
+                    break
+
+    def _add_health(self, trb_address):
+        self._pvdb[health_identifier(trb_address)] = {
+          'type': 'enum',
+          'enums': ['dead', 'alive'],
+          'value': 1,
+        }
+
+    def _add_waveform(self, identifier, definition, count):
+        self._pvdb[identifier] = {
+          'type': 'float' if definition['format'] == 'float' else 'int',
+          'count': count,
+          'unit': definition['unit'],
+        }
 
     def _add(self, identifier, definition):
         self._pvdb[identifier] = {
@@ -94,9 +315,15 @@ class PvdbManager(object):
         if definition['format'] == 'boolean' and TYPE_MAPPING[definition['format']][0] == 'enum':
             self._pvdb[identifier]['enums'] = ['false', 'true']
 
-    def initialize(self, subscriptions):
+    def initialize(self, subscriptions, live=True):
         for trb_address, entity, name in subscriptions:
-            if trb_address in self._expected_trb_addresses:
+            rates = (trb_address, entity, name) in self.rate_subscriptions
+            pvs = self.subscription_pvs.setdefault((trb_address, entity, name), [])
+            self.scan_plans[(trb_address, entity, name)] = xmlplan(entity, name)
+            self._add_health(trb_address)
+            if (trb_address, entity, name) in self.waveform_subscriptions:
+                self._initialize_waveforms(trb_address, entity, name, live=live)
+            elif trb_address in self._expected_trb_addresses:
                 answer_from_trb_addresses = self._expected_trb_addresses[trb_address]
                 for info in xmlentry(entity, name):
                     slices = len(info['reg_addresses'])
@@ -106,16 +333,235 @@ class PvdbManager(object):
                             identifier = db._get_field_identifier(entity, info['field_name'], answer_from_trb_address, slice=slice)
                             definition = db._get_field_info(entity, info['field_name'])
                             self._add(identifier, definition)
+                            pvs.append(identifier)
+                            if rates:
+                                self._add_rate(identifier, definition)
+                                pvs.append(identifier + RATE_SUFFIX)
+            elif not live:
+                raise ValueError("No expected trb addresses known for subscription 0x%04x %s %s" % (trb_address, entity, name))
             else:
                 for data in xmlget(trb_address, entity, name, logger=logger):
-                    self._add(data['context']['identifier'], data)
+                    identifier = data['context']['identifier']
+                    self._add(identifier, data)
+                    pvs.append(identifier)
+                    if rates:
+                        self._add_rate(identifier, data)
+                        pvs.append(identifier + RATE_SUFFIX)
+
+    def reload_entity(self, entity):
+        '''
+        Rebuild the scan plans and the PV definitions of all subscriptions of
+        an entity after its XML file changed (see XmlDb.check_for_changes()).
+        PVs can't be added to or removed from a running server, so the PVs of
+        fields which don't exist anymore are returned as removed and new
+        fields are only reported.
+
+        Returns:
+        tuple -- (dict {identifier: definition} of the PVs whose definition changed,
+                  list of PVs of removed fields, list of (subscription, field_name) of new fields)
+        '''
+        changed, removed, added = {}, [], []
+        for subscription, pvs in self.subscription_pvs.items():
+            trb_address, subscription_entity, name = subscription
+            if subscription_entity != entity:
+                continue
+            plan = xmlplan(entity, name)
+            field_names = set(field_name for field_name, reg_addresses in plan[1])
+            known = set()
+            for identifier in pvs:
+                if identifier.endswith(RATE_SUFFIX):
+                    continue
+                field_name = _field_name(entity, identifier, field_names)
+                rate = identifier + RATE_SUFFIX if identifier + RATE_SUFFIX in self._pvdb else None
+                if field_name is None:
+                    removed += [identifier] + ([rate] if rate else [])
+                    continue
+                known.add(field_name)
+                before = {reason: self._pvdb[reason] for reason in (identifier, rate) if reason}
+                definition = db._get_field_info(entity, field_name)
+                if 'count' in before[identifier]:
+                    self._add_waveform(identifier, definition, before[identifier]['count'])
+                else:
+                    self._add(identifier, definition)
+                if rate:
+                    self._add_rate(identifier, definition)
+                if self._pvdb[identifier]['type'] != before[identifier]['type']:
+                    logger.warning('Type of PV %s changed, restart the IOC to apply it', identifier)
+                changed.update({reason: self._pvdb[reason] for reason in before if self._pvdb[reason] != before[reason]})
+            added += [(subscription, field_name) for field_name in sorted(field_names - known)]
+            # new fields have no PVs to publish to
+            register_blocks, fields = plan
+            self.scan_plans[subscription] = (register_blocks, [field for field in fields if field[0] in known])
+        return changed, removed, added
+
+    def _initialize_waveforms(self, trb_address, entity, name, live=True):
+        subscription = (trb_address, entity, name)
+        merge = self.waveform_subscriptions[subscription]
+        pvs = self.subscription_pvs[subscription]
+        responders = self._expected_trb_addresses.get(trb_address)
+        if responders is None:
+            if merge or not live:
+                raise ValueError("No expected trb addresses known for subscription 0x%04x %s %s" % subscription)
+            responders = sorted(set(data['context']['trb_address'] for data in xmlget(trb_address, entity, name, logger=logger)))
+        responders = list(responders)
+        self.waveform_responders[subscription] = responders
+        for info in xmlentry(entity, name):
+            field_name = info['field_name']
+            slices = len(info['reg_addresses'])
+            definition = db._get_field_info(entity, field_name)
+            if merge:
+                identifier = db._get_field_identifier(entity, field_name, trb_address)
+                self._add_waveform(identifier, definition, len(responders) * slices)
+                pvs.append(identifier)
+                continue
+            for responder in responders:
+                identifier = db._get_field_identifier(entity, field_name, responder)
+                if slices > 1:
+                    self._add_waveform(identifier, definition, slices)
+                else:
+                    self._add(identifier, definition)
+                pvs.append(identifier)
+
+class SubscriptionScanner(object):
+    '''
+    Reads and decodes the subscriptions and hands the resulting PV values
+    to the callbacks publish(reason, value) and invalidate(reasons).
+    Independent of pcaspy's Driver, so that the scanning can also happen
+    in other processes (see trbnet.epics.sharded).
+    '''
+
+    def __init__(self, subscriptions, pvdb_manager, publish, invalidate, health=None, reload_period=0.0, reconfigure=None,
+                 profiler=None, errors=None, error_pvs=None):
+        self.subscriptions = subscriptions
+        self.pvdb_manager = pvdb_manager
+        self.publish = publish
+        self.invalidate = invalidate
+        self.rate_engine = RateEngine(db)
+        self.health = health or EndpointHealth()
+        # ScanProfiler recording the phase timings of every scan (None: off)
+        self.profiler = profiler
+        # ErrorAggregator counting the errors of the scans (None: log every error)
+        # and the PVs to publish its counters to after every cycle ({kind: identifier})
+        self.errors = errors
+        self.error_pvs = error_pvs if error_pvs is not None else (error_identifiers() if errors is not None else {})
+        # check the XmlDb for changed files every reload_period seconds (0: never)
+        # and pass the changed PV definitions to reconfigure(changed)
+        self.reload_period = reload_period
+        self.reconfigure = reconfigure
+        self._last_reload_check = time.monotonic()
+        if reload_period > 0:
+            db.subscribe(self._xmldb_changed)
+
+    def check_xmldb(self):
+        if self.reload_period <= 0 or time.monotonic() - self._last_reload_check < self.reload_period:
+            return
+        self._last_reload_check = time.monotonic()
+        try:
+            db.check_for_changes()
+        except Exception as e:
+            logger.error('Checking the XmlDb for changes failed: %s', e)
+
+    def _xmldb_changed(self, entity):
+        try:
+            changed, removed, added = self.pvdb_manager.reload_entity(entity)
+            db.compile(entity)
+        except Exception as e:
+            logger.error('Reloading XmlDb entity %s failed: %s', entity, e)
+            return
+        logger.warning('Reloaded XmlDb entity %s: %d PVs changed, %d removed', entity, len(changed), len(removed))
+        for subscription, field_name in added:
+            logger.warning('New field %s of subscription 0x%04x %s %s is not published until the IOC is restarted',
+                           field_name, *subscription)
+        self.invalidate(removed)
+        if self.reconfigure is not None:
+            self.reconfigure(changed)
+
+    def _publish_arrays(self, subscription, results):
+        trb_address, entity, element = subscription
+        merge = self.pvdb_manager.waveform_subscriptions[subscription]
+        for field_name, responders, words in results:
+            values = db.convert_field_array(entity, field_name, words)
+            if merge:
+                self.publish(db._get_field_identifier(entity, field_name, trb_address), values.ravel())
+            elif words.shape[1] > 1:
+                for row, responder in enumerate(responders):
+                    self.publish(db._get_field_identifier(entity, field_name, responder), values[row])
+            else:
+                for row, responder in enumerate(responders):
+                    data = db.convert_field(entity, field_name, int(words[row, 0]), trb_address=responder)
+                    self.publish(data.identifier, getattr(data, TYPE_MAPPING[data.spec.format][1]))
+
+    def scan(self, subscription):
+        trb_address, entity, element = subscription
+        clock = time.perf_counter
+        start = clock()
+        register_blocks, fields = self.pvdb_manager.scan_plans.get(subscription) or xmlplan(entity, element)
+        responders = self.pvdb_manager.waveform_responders.get(subscription)
+        planned = clock()
+        # skipped dead addresses don't count as missing registers
+        all_data, dead = {}, True
+        if self.health.check(trbnet_connection, trb_address):
+            all_data, dead = xmlread(trb_address, register_blocks, logger=logger, health=self.health, errors=self.errors,
+                                     entity=entity, name=element)
+        read = clock()
+        if responders is not None:
+            results = [] if dead else list(xmlarrays(fields, all_data, responders=responders, logger=logger,
+                                                     errors=self.errors, trb_address=trb_address, entity=entity))
+        else:
+            results = list(xmldecode(entity, fields, all_data, dead, logger=logger, errors=self.errors,
+                                     trb_address=trb_address))
+        decoded = clock()
+        self._publish_results(subscription, responders, results)
+        if self.profiler is not None:
+            self.profiler.record('0x%04x %s %s' % subscription, start, planned, read, decoded, clock())
+
+    def _publish_results(self, subscription, responders, results):
+        trb_address = subscription[0]
+        dead = self.health.is_dead(trb_address)
+        self.publish(health_identifier(trb_address), 0 if dead else 1)
+        if dead:
+            self.invalidate(self.pvdb_manager.subscription_pvs[subscription])
+            return
+        if responders is not None:
+            self._publish_arrays(subscription, results)
+            return
+        for data in results:
+            self.publish(data.identifier, getattr(data, TYPE_MAPPING[data.spec.format][1]))
+        if subscription in self.pvdb_manager.rate_subscriptions:
+            for identifier, rate in self.rate_engine.update(results).items():
+                self.publish(identifier + RATE_SUFFIX, rate)
+
+    def scan_all(self):
+        if self.profiler is not None:
+            self.profiler.begin_cycle()
+        self.check_xmldb()
+        for subscription in self.subscriptions:
+            self.scan(subscription)
+        if self.errors is not None:
+            self._publish_errors()
+        if self.profiler is not None:
+            self.profiler.end_cycle()
+
+    def _publish_errors(self):
+        self.errors.maybe_summarize()
+        counters = self.errors.totals()
+        counters['keys'] = len(self.errors)
+        for kind, identifier in self.error_pvs.items():
+            self.publish(identifier, counters[kind])
 
 class TrbNetIocDriver(Driver):
 
-    def __init__(self, subscriptions, scan_period=1.0):
+    def __init__(self, subscriptions, pvdb_manager, scan_period=1.0, health=None, reload_period=0.0, profiler=None,
+                 errors=None):
         Driver.__init__(self)
-        self.scan_period = 1.0
+        self.scan_period = scan_period
         self.subscriptions = subscriptions
+        self.pvdb_manager = pvdb_manager
+        self.scanner = SubscriptionScanner(subscriptions, pvdb_manager, self._publish, self._invalidate, health=health,
+                                           reload_period=reload_period, reconfigure=self._reconfigure,
+                                           profiler=profiler, errors=errors)
+        self.health = self.scanner.health
+        self.histories = {identifier: History(size) for identifier, size in pvdb_manager.histories.items()}
         self.start()
 
     def start(self):
@@ -124,20 +570,64 @@ class TrbNetIocDriver(Driver):
             self.tid.setDaemon(True)
             self.tid.start()
 
+    def _set(self, reason, value):
+        try:
+            self.pvDB[reason].mask = 0
+            self.setParamStatus(reason, Alarm.NO_ALARM, Severity.NO_ALARM)
+            self.setParam(reason, value)
+            manager.pvs[self.port][reason].updateValue(self.pvDB[reason])
+        except Exception as e:
+            logger.error(str(e))
+
+    def _publish(self, reason, value):
+        self._set(reason, value)
+        history = self.histories.get(reason)
+        if history is None:
+            return
+        try:
+            history.append(value, time.time())
+        except (TypeError, ValueError) as e:
+            logger.error(str(e))
+            return
+        for suffix, aggregate in zip(HISTORY_SUFFIXES, (history.min, history.max, history.mean, history.slope)):
+            if aggregate is not None:
+                self._set(reason + suffix, aggregate)
+        self._set(reason + HISTORY_WAVEFORM_SUFFIX, history.values())
+
+    def _invalidate(self, reasons):
+        for reason in reasons:
+            try:
+                self.setParamStatus(reason, Alarm.COMM_ALARM, Severity.INVALID_ALARM)
+                manager.pvs[self.port][reason].updateValue(self.pvDB[reason])
+            except Exception as e:
+                logger.error(str(e))
+
+    def _reconfigure(self, changed):
+        for reason, definition in changed.items():
+            try:
+                info = {key: value for key, value in definition.items() if key not in ('type', 'count')}
+                if 'enums' in info:
+                    info['states'] = [Severity.NO_ALARM] * len(info['enums'])
+                self.setParamInfo(reason, info)
+            except Exception as e:
+                logger.error(str(e))
+        self.updatePVs()
+
+    def write(self, reason, value):
+        profiler = self.scanner.profiler
+        if reason == PROFILE_CAPTURE_PV and profiler is not None:
+            # capture cProfile statistics of the next value cycles
+            profiler.capture(value)
+        return super().write(reason, value)
+
     def scan_all(self):
         last_time = time.time()
         while True:
-            for subscription in self.subscriptions:
-                trb_address, entity, element = subscription
-                for data in xmlget(trb_address, entity, element, logger=logger):
-                    reason = data['context']['identifier']
-                    try:
-                        self.pvDB[reason].mask = 0
-                        self.setParamStatus(reason, Alarm.NO_ALARM, Severity.NO_ALARM)
-                        self.setParam(reason, data['value'][TYPE_MAPPING[data['format']][1]])
-                        manager.pvs[self.port][reason].updateValue(self.pvDB[reason])
-                    except Exception as e:
-                        logger.error(str(e))
+            self.scanner.scan_all()
+            profiler = self.scanner.profiler
+            if profiler is not None and time.time() - last_time > self.scan_period:
+                logger.warning('Scan cycle overran the scan period of %.3f s: %s',
+                               self.scan_period, profiler.describe(profiler.cycles[-1]))
 
             # if the process was suspended, reset last_time:
             if time.time() - last_time > self.scan_period:
@@ -146,6 +636,88 @@ class TrbNetIocDriver(Driver):
             time.sleep(max(0.0, self.scan_period - (time.time() - last_time)))
             last_time += self.scan_period
 
+RATE_SUFFIX = ':rate'
+HISTORY_SUFFIXES = (':min', ':max', ':mean', ':slope')
+HISTORY_WAVEFORM_SUFFIX = ':history'
+COMPILED_VERSION = 1
+PROFILE_CAPTURE_PV = 'profile:capture'
+
+def connect_trbnet(trbnet_factory=TrbNet, daqopserver=None):
+    '''
+    Make the scans use a TrbNet instance created by trbnet_factory.
+    '''
+    trbnet_connection.connect(trbnet_factory(daqopserver=daqopserver) if daqopserver else trbnet_factory())
+
+def cache_static_registers(subscriptions, ttl, pvdb_manager=None):
+    '''
+    Cache the values of the registers of the subscribed entities which don't
+    change at runtime (see XmlDb.static_register_addresses()) for ttl seconds,
+    so that they are read only once per ttl instead of in every scan.
+    The TTLs only apply to the trb address of each subscription and its
+    responders known to pvdb_manager (other entities may use the same
+    register addresses for registers that do change).
+    '''
+    cache = trbnet_connection.cache or trbnet_connection.enable_cache()
+    addresses = {}
+    for subscription in subscriptions:
+        trb_address, entity, name = subscription
+        if entity not in addresses:
+            addresses[entity] = db.static_register_addresses(entity)
+        trb_addresses = [trb_address]
+        if pvdb_manager is not None:
+            trb_addresses += pvdb_manager.responders(subscription)
+        cache.set_ttl(addresses[entity], ttl, trb_addresses=trb_addresses)
+    return cache
+
+def compile_xmldb(subscriptions, workers=None):
+    '''
+    Compile the XmlDb entities of the subscriptions into lightweight records
+    (in parallel with workers processes, see XmlDb.preload()) and discard
+    their XML trees, which are not needed for scanning.
+    '''
+    entities = sorted(set(subscription[1] for subscription in subscriptions))
+    for entity, result in db.preload(entities, workers=workers).items():
+        if result['error']:
+            logger.error('Compiling XmlDb entity %s failed: %s', entity, result['error'])
+        else:
+            logger.info('Compiled XmlDb entity %s in %.3f s', entity, result['seconds'])
+
+def _field_name(entity, identifier, field_names):
+    '''
+    Returns the field (one of field_names) of a PV identifier built by
+    XmlDb._get_field_identifier() or None.
+    '''
+    prefix = entity + '-0x'
+    if not identifier.startswith(prefix) or '-' not in identifier[len(prefix):]:
+        return None
+    field_name = identifier[len(prefix):].split('-', 1)[1]
+    if field_name not in field_names and '.' in field_name:
+        field_name, slice = field_name.rsplit('.', 1)
+        if not slice.isdigit():
+            return None
+    return field_name if field_name in field_names else None
+
+def health_identifier(trb_address):
+    return "health-0x{:04x}".format(trb_address)
+
+def error_identifiers(shard=None):
+    '''
+    Returns:
+    dict -- {kind: PV identifier} of the error counters (one of ERROR_KINDS or
+            'keys', the number of distinct (kind, address, entity, field) keys)
+            of the IOC or of one worker process (shard) of a sharded IOC
+    '''
+    prefix = 'errors:' if shard is None else 'errors:shard%d:' % shard
+    return {kind: prefix + kind for kind in ERROR_KINDS + ('keys',)}
+
+def error_pvdb(shard=None):
+    '''
+    Returns:
+    dict -- the PV definitions of the error counters, see error_identifiers()
+    '''
+    return {identifier: {'type': 'float', 'prec': 0, 'value': 0}
+            for identifier in error_identifiers(shard).values()}
+
 TYPE_MAPPING = {
     # pcaspy types: 'enum', 'string', 'char', 'float' or 'int'
     'unsigned': ('int', 'python'),
@@ -0,0 +1,273 @@
+'''
+Sharded scanning for the TrbNet IOC.
+
+The subscriptions are split across several worker processes, each with its
+own TrbNet connection (optionally to a different trbnetd daemon) and its own
+interpreter for decoding. The workers write the decoded PV values into a
+SharedTable in shared memory; the IOC process only runs the pcaspy server
+and publishes the values that changed in the table.
+'''
+
+import os, time, multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from trbnet.core import TrbNet
+from trbnet.util.profiling import ScanProfiler
+from trbnet.util.errors import ErrorAggregator
+
+from .pcaspy_ioc import SubscriptionScanner, TrbNetIocDriver, connect_trbnet, cache_static_registers, compile_xmldb
+from .pcaspy_ioc import error_identifiers, error_pvdb, logger
+
+class SharedTable(object):
+    '''
+    PV values in shared memory, written by the scan workers and read by
+    the IOC process. Every PV has count float64 value slots, a status byte
+    and a sequence number used as a seqlock: it is odd while the single
+    writer of the PV updates it, and incremented again when it's done.
+    Readers skip PVs that are being written or changed while being read.
+
+    Arguments:
+    layout -- list of (identifier, count) tuples, one per PV
+    name -- name of an existing shared memory block to attach to (default: create one)
+    '''
+
+    VALID = 1
+    INVALID = 2
+
+    def __init__(self, layout, name=None):
+        self.layout = [(identifier, count) for identifier, count in layout]
+        self.identifiers = [identifier for identifier, count in self.layout]
+        self.index = {identifier: i for i, identifier in enumerate(self.identifiers)}
+        counts = np.array([count for identifier, count in self.layout], dtype=np.int64)
+        self.counts = counts
+        self.offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        n, total = len(counts), int(counts.sum())
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=max(1, 16 * n + 8 * total))
+        buf = self._shm.buf
+        self.sequence = np.ndarray(n, dtype=np.uint64, buffer=buf, offset=0)
+        self.values = np.ndarray(total, dtype=np.float64, buffer=buf, offset=8 * n)
+        self.status = np.ndarray(n, dtype=np.uint8, buffer=buf, offset=8 * n + 8 * total)
+        if self._owner:
+            self.sequence[:] = 0
+            self.status[:] = 0
+
+    @classmethod
+    def from_pvdb(cls, pvdb):
+        return cls(sorted((identifier, definition.get('count', 1)) for identifier, definition in pvdb.items()))
+
+    @property
+    def spec(self):
+        ''' Arguments to attach to this table from another process: SharedTable(*table.spec) '''
+        return self.layout, self._shm.name
+
+    def write(self, identifier, value):
+        i = self.index[identifier]
+        offset, count = self.offsets[i], self.counts[i]
+        self.sequence[i] += 1
+        if count == 1:
+            self.values[offset] = value
+        else:
+            value = np.asarray(value, dtype=np.float64).ravel()[:count]
+            self.values[offset:offset+len(value)] = value
+        self.status[i] = self.VALID
+        self.sequence[i] += 1
+
+    def invalidate(self, identifiers):
+        for identifier in identifiers:
+            i = self.index[identifier]
+            self.sequence[i] += 1
+            self.status[i] = self.INVALID
+            self.sequence[i] += 1
+
+    def read_changes(self, last_sequence):
+        '''
+        Returns the PVs updated since the sequence numbers in last_sequence
+        (a copy of .sequence, updated in place for the PVs returned).
+
+        Returns:
+        list -- of (identifier, status, value) tuples, value being a float or a numpy array
+        '''
+        changes = []
+        for i in np.flatnonzero(self.sequence != last_sequence).tolist():
+            before = self.sequence[i]
+            if before % 2:
+                continue
+            offset, count = self.offsets[i], self.counts[i]
+            value = float(self.values[offset]) if count == 1 else self.values[offset:offset+count].copy()
+            status = int(self.status[i])
+            if self.sequence[i] != before:
+                continue
+            last_sequence[i] = before
+            changes.append((self.identifiers[i], status, value))
+        return changes
+
+    def close(self):
+        del self.sequence, self.values, self.status
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+def shard_subscriptions(subscriptions, pvdb_manager, shards):
+    '''
+    Distribute the subscriptions over a number of shards, balancing the
+    number of PVs. All subscriptions of a trb_address end up in the same
+    shard, so that a single process tracks the health of each address.
+
+    Returns:
+    list -- of lists of subscriptions
+    '''
+    groups = {}
+    for subscription in subscriptions:
+        groups.setdefault(subscription[0], []).append(subscription)
+    weight = lambda group: sum(1 + len(pvdb_manager.subscription_pvs.get(subscription, ())) for subscription in group)
+    result = [[] for shard in range(shards)]
+    loads = [0] * shards
+    for group in sorted(groups.values(), key=weight, reverse=True):
+        shard = loads.index(min(loads))
+        result[shard] += group
+        loads[shard] += weight(group)
+    return result
+
+def _scan_shard(shard, subscriptions, pvdb_manager, table_spec, statistics, stop, trbnet_factory, daqopserver, scan_period,
+                static_ttl, reload_period, profile=None, profile_capture=0, error_summary_period=60.0):
+    profiler = None
+    if profile:
+        base, ext = os.path.splitext(profile)
+        profiler = ScanProfiler('%s-shard%d%s' % (base, shard, ext))
+        profiler.capture(profile_capture)
+    connect_trbnet(trbnet_factory, daqopserver)
+    if static_ttl > 0:
+        cache_static_registers(subscriptions, static_ttl, pvdb_manager)
+    compile_xmldb(subscriptions, workers=1)
+    table = SharedTable(*table_spec)
+    # the scan plans are reloaded here, the PV definitions by the SharedTableDriver
+    errors = ErrorAggregator(logger=logger, summary_period=error_summary_period)
+    scanner = SubscriptionScanner(subscriptions, pvdb_manager, table.write, table.invalidate, reload_period=reload_period,
+                                  profiler=profiler, errors=errors, error_pvs=error_identifiers(shard))
+    start = time.monotonic()
+    try:
+        while not stop.is_set():
+            scan_start = time.monotonic()
+            scanner.scan_all()
+            statistics[2 * shard] += 1
+            statistics[2 * shard + 1] += time.monotonic() - scan_start
+            if scan_period > 0:
+                slot = int((time.monotonic() - start) / scan_period) + 1
+                stop.wait(max(0.0, start + slot * scan_period - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        table.close()
+        if profiler is not None:
+            profiler.save()
+
+class ShardedScanner(object):
+    '''
+    Runs the scanning of the subscriptions in worker processes writing
+    into a SharedTable.
+
+    Arguments:
+    subscriptions -- list of (trb_address, entity, name) subscriptions
+    pvdb_manager -- initialized PvdbManager
+    pvdb -- the PV database (to lay out the shared table)
+    workers -- number of worker processes
+    daqopservers -- list of trbnetd daemons the workers connect to (round robin, default: DAQOPSERVER)
+    scan_period -- scan period of the workers in seconds (0: scan continuously)
+    trbnet_factory -- callable creating the TrbNet instance of a worker (default: TrbNet),
+                      it must be picklable (e.g. functools.partial(FakeTrbNet, latency=1e-3))
+    static_ttl -- cache the static registers of the subscribed entities for static_ttl seconds (default: 0, off)
+    reload_period -- check the XmlDb for changes every reload_period seconds (default: 0, off)
+    profile -- record the phase timings of the scans of every worker into the file
+               <profile without extension>-shard<N><extension> (default: None, off)
+    profile_capture -- with profile: capture cProfile statistics of the first profile_capture cycles of every worker
+    error_summary_period -- summarize the errors of every worker every error_summary_period seconds
+
+    The error counters of every worker are published as separate PVs
+    (see error_identifiers(shard)), which are added to pvdb.
+    '''
+
+    def __init__(self, subscriptions, pvdb_manager, pvdb, workers=2, daqopservers=None, scan_period=1.0, trbnet_factory=TrbNet,
+                 static_ttl=0.0, reload_period=0.0, profile=None, profile_capture=0, error_summary_period=60.0):
+        self.shards = [shard for shard in shard_subscriptions(subscriptions, pvdb_manager, workers) if shard]
+        self.pvdb_manager = pvdb_manager
+        for shard in range(len(self.shards)):
+            pvdb.update(error_pvdb(shard))
+        self.pvdb = pvdb
+        self.table = SharedTable.from_pvdb(pvdb)
+        self.daqopservers = daqopservers or []
+        self.scan_period = scan_period
+        self.trbnet_factory = trbnet_factory
+        self.static_ttl = static_ttl
+        self.reload_period = reload_period
+        self.profile = profile
+        self.profile_capture = profile_capture
+        self.error_summary_period = error_summary_period
+        self._ctx = multiprocessing.get_context('spawn')
+        self._statistics = self._ctx.Array('d', 2 * len(self.shards))
+        self._stop = self._ctx.Event()
+        self._processes = []
+
+    def start(self):
+        for shard, subscriptions in enumerate(self.shards):
+            daqopserver = self.daqopservers[shard % len(self.daqopservers)] if self.daqopservers else None
+            process = self._ctx.Process(target=_scan_shard, name='trbnet-shard-%d' % shard,
+                                        args=(shard, subscriptions, self.pvdb_manager, self.table.spec,
+                                              self._statistics, self._stop, self.trbnet_factory,
+                                              daqopserver, self.scan_period, self.static_ttl,
+                                              self.reload_period, self.profile, self.profile_capture,
+                                              self.error_summary_period))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self.table.close()
+
+    def statistics(self):
+        '''
+        Returns:
+        list -- of dicts (one per shard) with the keys subscriptions, scans and mean_scan_time
+        '''
+        result = []
+        for shard, subscriptions in enumerate(self.shards):
+            scans, busy = self._statistics[2 * shard], self._statistics[2 * shard + 1]
+            result.append({'subscriptions': len(subscriptions), 'scans': int(scans),
+                           'mean_scan_time': busy / scans if scans else None})
+        return result
+
+class SharedTableDriver(TrbNetIocDriver):
+    '''
+    pcaspy driver publishing the values the workers of a ShardedScanner
+    write into its SharedTable, polling the table every poll_period seconds.
+    '''
+
+    def __init__(self, sharded_scanner, pvdb_manager, poll_period=0.05, reload_period=0.0):
+        self.sharded_scanner = sharded_scanner
+        self.table = sharded_scanner.table
+        self.poll_period = poll_period
+        self._integer = {identifier for identifier, definition in sharded_scanner.pvdb.items()
+                         if definition['type'] in ('int', 'enum')}
+        super().__init__([], pvdb_manager, scan_period=poll_period, reload_period=reload_period)
+
+    def scan_all(self):
+        last_sequence = self.table.sequence.copy()
+        last_sequence[:] = 0
+        while True:
+            self.scanner.check_xmldb()
+            for identifier, status, value in self.table.read_changes(last_sequence):
+                if status == SharedTable.INVALID:
+                    self._invalidate([identifier])
+                    continue
+                if identifier in self._integer:
+                    value = value.astype(np.int64) if isinstance(value, np.ndarray) else int(value)
+                self._publish(identifier, value)
+            time.sleep(self.poll_period)
@@ -0,0 +1,163 @@
+'''
+Snapshots of the full register space of TrbNet boards.
+
+The read plan is derived from the XmlDb: all continuous register blocks of
+an entity are merged into as few register_read_mem transactions as possible.
+These transactions are executed by several worker processes, each with its
+own TrbNet connection (optionally to different trbnetd daemons).
+
+The result is written to a single file:
+
+* 8 bytes magic: b'TRBDUMP1'
+* 4 bytes little endian uint32: length of the JSON index in bytes
+* the JSON index
+* the register words as little endian uint32 values
+
+The index contains an entry [trb_address, responder, start, count, offset]
+for every block of data, offset being the position of the first word of
+the block in the data section (counted in words).
+'''
+
+import json, multiprocessing, struct, time
+
+import numpy as np
+
+from trbnet import TrbNet, TrbException
+
+MAGIC = b'TRBDUMP1'
+
+def _merge_blocks(register_blocks, max_size=0xffff):
+    '''
+    Merges overlapping and adjacent (start, size) register blocks
+    and splits the result into blocks of at most max_size registers.
+    '''
+    merged = []
+    for start, size in sorted(register_blocks):
+        if merged and start <= merged[-1][0] + merged[-1][1]:
+            last_start, last_size = merged[-1]
+            merged[-1] = (last_start, max(last_size, start + size - last_start))
+        else:
+            merged.append((start, size))
+    result = []
+    for start, size in merged:
+        for offset in range(0, size, max_size):
+            result.append((start + offset, min(max_size, size - offset)))
+    return result
+
+def read_plan(db, targets, max_size=0xffff):
+    '''
+    Build the read plan for a list of (trb_address, entity) targets.
+
+    Returns:
+    list -- of (trb_address, start, size) read_mem transactions
+    '''
+    blocks = {}
+    for trb_address, entity in targets:
+        element = db._get_entity_element(entity)
+        blocks.setdefault(trb_address, []).extend(db._determine_continuous_register_blocks(entity, element))
+    plan = []
+    for trb_address, register_blocks in blocks.items():
+        plan += [(trb_address, start, size) for start, size in _merge_blocks(register_blocks, max_size=max_size)]
+    return plan
+
+_worker_trbnet = None
+
+def _init_worker(daqopservers, counter):
+    global _worker_trbnet
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    daqopserver = daqopservers[index % len(daqopservers)] if daqopservers else None
+    _worker_trbnet = TrbNet(daqopserver=daqopserver)
+
+def _read_block(task, trbnet=None):
+    '''
+    Executes a single read_mem transaction of the read plan.
+
+    Returns:
+    tuple -- (task, list of (responder, words as bytes), error or None)
+    '''
+    trbnet = trbnet or _worker_trbnet
+    trb_address, start, size = task
+    try:
+        data_array, status = trbnet._trb_register_read_mem(trb_address, start, 0, size)
+    except TrbException as e:
+        return task, [], (int(e.errno), e.errorstr)
+    lin_data = np.frombuffer(data_array, dtype=np.uint32, count=status)
+    responses = []
+    offset = 0
+    while len(lin_data) > offset:
+        header = int(lin_data[offset])
+        length, responder = (header >> 16), (header & 0xffff)
+        responses.append((responder, lin_data[offset+1:offset+1+length].astype('<u4').tobytes()))
+        offset += 1 + length
+    return task, responses, None
+
+def execute_plan(plan, workers=1, daqopservers=None, trbnet=None):
+    '''
+    Executes the read plan, either in this process with the TrbNet instance
+    trbnet (workers <= 1) or in several worker processes.
+
+    Returns:
+    list -- of results as returned by _read_block()
+    '''
+    if workers <= 1:
+        return [_read_block(task, trbnet=trbnet or TrbNet()) for task in plan]
+    ctx = multiprocessing.get_context('spawn')
+    counter = ctx.Value('i', 0)
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(daqopservers or [], counter)) as pool:
+        return pool.map(_read_block, plan, chunksize=max(1, len(plan) // (4 * workers)))
+
+def write_dump(path, targets, results, duration=None):
+    index, errors, chunks = [], [], []
+    offset = 0
+    for (trb_address, start, size), responses, error in results:
+        if error:
+            errors.append([trb_address, start, size, error[0], error[1]])
+        for responder, data in responses:
+            count = len(data) // 4
+            index.append([trb_address, responder, start, count, offset])
+            chunks.append(data)
+            offset += count
+    header = {
+      'created': time.time(),
+      'duration': duration,
+      'targets': [[trb_address, entity] for trb_address, entity in targets],
+      'blocks': index,
+      'errors': errors,
+    }
+    header = json.dumps(header).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for data in chunks:
+            f.write(data)
+    return header
+
+def read_dump(path):
+    '''
+    Reads a dump file.
+
+    Returns:
+    tuple -- (index as dict, numpy array with all register words)
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a TrbNet register dump' % path)
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length).decode('utf-8'))
+        data = np.fromfile(f, dtype='<u4')
+    return header, data
+
+def dump_registers(path):
+    '''
+    Returns:
+    dict -- key: responding trb_address, value: dict {reg_address: word}
+    '''
+    header, data = read_dump(path)
+    registers = {}
+    for trb_address, responder, start, count, offset in header['blocks']:
+        words = data[offset:offset+count].tolist()
+        registers.setdefault(responder, {}).update(zip(range(start, start + count), words))
+    return registers
@@ -0,0 +1,136 @@
+'''
+Aggregated error reporting for scan loops (IOC scans, trbcmd.py xmlget
+polls): instead of logging every missing register or failed transaction
+in every cycle, the occurrences are counted per (kind, trb_address, entity,
+field) and logged once when first seen, plus a periodic summary.
+'''
+
+import threading, time
+
+MISSING = 'missing'                 # register missing in a response
+TRB_ERROR = 'trb_error'             # TrbException while reading
+STATUS_WARNING = 'status_warning'   # status bits set in a response
+OTHER_ERROR = 'other_error'         # any other exception while reading
+KINDS = (MISSING, TRB_ERROR, STATUS_WARNING, OTHER_ERROR)
+
+DESCRIPTIONS = {
+    MISSING: 'register missing in response',
+    TRB_ERROR: 'TRB error',
+    STATUS_WARNING: 'status bit(s) set',
+    OTHER_ERROR: 'other error',
+}
+
+class ErrorAggregator(object):
+    '''
+    Counts errors per key (kind, trb_address, entity, field) in O(1).
+    The first occurrence of every key is logged (with its detail), later
+    occurrences are only counted and reported by the periodic summary of
+    .maybe_summarize(), which scan loops call once per cycle.
+
+    Memory is bounded: once max_keys keys are counted, errors of new keys
+    only increase the overflow counter of their kind.
+
+    Arguments:
+    logger -- logging.Logger for the first occurrences and the summaries (None: don't log)
+    summary_period -- minimum time between two summaries in seconds (0: never summarize)
+    max_keys -- maximum number of keys to count individually (default: 10000)
+    top -- number of most frequent keys listed in a summary (default: 5)
+    '''
+
+    def __init__(self, logger=None, summary_period=60.0, max_keys=10000, top=5, clock=time.monotonic):
+        self.logger = logger
+        self.summary_period = summary_period
+        self.max_keys = max_keys
+        self.top = top
+        self.clock = clock
+        self.overflow = dict.fromkeys(KINDS, 0)
+        self._counts = {}                           # key: count
+        self._totals = dict.fromkeys(KINDS, 0)
+        self._summarized = {}                       # key: count at the last summary
+        self._summarized_totals = dict.fromkeys(KINDS, 0)
+        self._last_summary = clock()
+        self._lock = threading.Lock()
+
+    def record(self, kind, trb_address, entity=None, field=None, detail=None, count=1):
+        '''
+        Count count occurrences of an error of kind (one of KINDS).
+
+        Arguments:
+        detail -- str (or callable returning it, to avoid the formatting costs
+                  of errors that are only counted) logged with the first occurrence
+        '''
+        key = (kind, trb_address, entity, field)
+        with self._lock:
+            self._totals[kind] += count
+            if key in self._counts:
+                self._counts[key] += count
+                return
+            if len(self._counts) >= self.max_keys:
+                self.overflow[kind] += count
+                return
+            self._counts[key] = count
+        if self.logger:
+            if callable(detail):
+                detail = detail()
+            self.logger.warning('%s: 0x%04x %s %s%s (further occurrences are summarized)', DESCRIPTIONS[kind],
+                                trb_address, entity or '-', field or '-', ' -- %s' % detail if detail else '')
+
+    def totals(self):
+        '''
+        Returns:
+        dict -- {kind: number of errors} of all KINDS
+        '''
+        with self._lock:
+            return dict(self._totals)
+
+    def counters(self, kind=None):
+        '''
+        Returns:
+        dict -- {(kind, trb_address, entity, field): number of errors} (of the given kind only, if not None)
+        '''
+        with self._lock:
+            return {key: count for key, count in self._counts.items() if kind is None or key[0] == kind}
+
+    def __len__(self):
+        return len(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._summarized.clear()
+            self._totals = dict.fromkeys(KINDS, 0)
+            self._summarized_totals = dict.fromkeys(KINDS, 0)
+            self.overflow = dict.fromkeys(KINDS, 0)
+
+    def summary(self):
+        '''
+        Describe the errors since the last summary (and start a new summary interval).
+
+        Returns:
+        str -- the summary or None if there were no errors
+        '''
+        with self._lock:
+            new = {kind: self._totals[kind] - self._summarized_totals[kind] for kind in KINDS}
+            deltas = [(count - self._summarized.get(key, 0), key) for key, count in self._counts.items()
+                      if count != self._summarized.get(key, 0)]
+            self._summarized = dict(self._counts)
+            self._summarized_totals = dict(self._totals)
+        if not any(new.values()):
+            return None
+        text = ', '.join('%d x %s' % (new[kind], DESCRIPTIONS[kind]) for kind in KINDS if new[kind])
+        deltas.sort(key=lambda delta: delta[0], reverse=True)
+        frequent = ', '.join('0x%04x %s %s: %d x %s' % (trb_address, entity or '-', field or '-', count, DESCRIPTIONS[kind])
+                             for count, (kind, trb_address, entity, field) in deltas[:self.top])
+        return '%s (%d keys%s)' % (text, len(deltas), ', most frequent: ' + frequent if frequent else '')
+
+    def maybe_summarize(self):
+        '''
+        Log the summary of the errors since the last one if summary_period has passed.
+        '''
+        if self.summary_period <= 0 or self.clock() - self._last_summary < self.summary_period:
+            return
+        seconds = self.clock() - self._last_summary
+        self._last_summary = self.clock()
+        summary = self.summary()
+        if summary and self.logger:
+            self.logger.warning('Errors in the last %.0f s: %s', seconds, summary)
@@ -0,0 +1,114 @@
+import csv, enum, json, struct, sys
+from datetime import datetime as dt
+
+class _Writer(object):
+    '''
+    Base class of the writers used to output converted field values
+    (as returned by _xmlget()) incrementally to a stream.
+    '''
+
+    binary = False
+
+    def __init__(self, stream=None):
+        if stream is None:
+            stream = sys.stdout.buffer if self.binary else sys.stdout
+        self.stream = stream
+
+    def write(self, data, timestamp):
+        raise NotImplementedError()
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+    @staticmethod
+    def _record(data, timestamp):
+        value = data['value']
+        context = data['context']
+        python = value['python']
+        if isinstance(python, dt):
+            python = python.isoformat()
+        elif isinstance(python, enum.Enum):
+            python = python.name
+        return {
+          'timestamp': timestamp,
+          'identifier': context['identifier'],
+          'trb_address': context['trb_address'],
+          'address': context['address'],
+          'entity': context['entity'],
+          'field_name': context['field_name'],
+          'slice': context['slice'],
+          'raw': value['raw'],
+          'value': python,
+          'string': value['unicode'],
+          'unit': data['unit'],
+        }
+
+class TextWriter(_Writer):
+
+    def write(self, data, timestamp):
+        self.stream.write("{context[identifier]} {value[unicode]} {unit}\n".format(**data))
+
+class NdjsonWriter(_Writer):
+
+    def write(self, data, timestamp):
+        self.stream.write(json.dumps(self._record(data, timestamp)) + '\n')
+
+class JsonWriter(_Writer):
+    '''
+    Writes a single JSON array, element by element.
+    '''
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._first = True
+        self.stream.write('[')
+
+    def write(self, data, timestamp):
+        self.stream.write(('\n' if self._first else ',\n') + json.dumps(self._record(data, timestamp)))
+        self._first = False
+
+    def close(self):
+        self.stream.write('\n]\n')
+        self.flush()
+
+class CsvWriter(_Writer):
+
+    FIELDS = ('timestamp', 'identifier', 'trb_address', 'address', 'entity',
+              'field_name', 'slice', 'raw', 'value', 'string', 'unit')
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._writer = csv.DictWriter(self.stream, fieldnames=self.FIELDS)
+        self._writer.writeheader()
+
+    def write(self, data, timestamp):
+        self._writer.writerow(self._record(data, timestamp))
+
+class BinaryWriter(_Writer):
+    '''
+    Writes fixed size little endian records:
+    timestamp (double), trb_address (uint16), register address (uint16),
+    slice (uint16, 0xffff if not repeated), start bit (uint8),
+    bits (uint8), raw field value (uint32)
+    '''
+
+    binary = True
+    RECORD = struct.Struct('<dHHHBBI')
+
+    def write(self, data, timestamp):
+        context = data['context']
+        slice = context['slice']
+        self.stream.write(self.RECORD.pack(timestamp, context['trb_address'], context['address'],
+                                           0xffff if slice is None else slice,
+                                           context['start'], context['bits'], data['value']['raw']))
+
+WRITERS = {
+    'text': TextWriter,
+    'json': JsonWriter,
+    'ndjson': NdjsonWriter,
+    'csv': CsvWriter,
+    'binary': BinaryWriter,
+}
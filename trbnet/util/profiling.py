@@ -0,0 +1,184 @@
+'''
+Opt-in profiling of scan cycles (IOC scans, trbcmd.py xmlget polls):
+phase timings per subscription and cycle and cProfile captures of
+selected cycles, written in formats for offline analysis:
+
+* phase timings: speedscope JSON (https://www.speedscope.app), one
+  evented profile with the nested frames cycle > subscription > phase
+* cProfile captures: pstats files (python -m pstats, snakeviz, gprof2dot, ...)
+'''
+
+import cProfile, json, os, threading, time
+from collections import deque
+
+PHASES = ('plan', 'read', 'decode', 'publish')
+
+class ScanProfiler(object):
+    '''
+    Records the phase timings (plan, read, decode, publish) of every
+    subscription of the last `cycles` scan cycles and captures cProfile
+    statistics of the next N cycles on request (.capture()).
+
+    Usage by a scan loop:
+
+    >>> profiler.begin_cycle()
+    >>> ... profiler.record(key, start, planned, read, decoded, published) for every subscription ...
+    >>> profiler.end_cycle()
+
+    Arguments:
+    path -- file for .save() (speedscope JSON), the pstats files of the captures
+            are written next to it (<path without extension>-<n>.pstats)
+    cycles -- number of cycles whose timings are kept (default: 1000)
+    '''
+
+    def __init__(self, path=None, cycles=1000):
+        self.path = path
+        self.cycles = deque(maxlen=cycles)  # (start, end, [(key, start, planned, read, decoded, published), ...])
+        self.captures = []                  # paths of the written pstats files
+        self._current = None
+        self._requested = 0
+        self._capture = None                # [cProfile.Profile, remaining cycles]
+        self._lock = threading.Lock()
+
+    def capture(self, cycles):
+        '''
+        Capture cProfile statistics of the next `cycles` cycles
+        (can be called from any thread).
+        '''
+        with self._lock:
+            self._requested = max(self._requested, int(cycles))
+
+    def begin_cycle(self):
+        if self._capture is None:
+            with self._lock:
+                requested, self._requested = self._requested, 0
+            if requested:
+                self._capture = [cProfile.Profile(), requested]
+        if self._capture is not None:
+            # only the cycles are profiled, not the time in between
+            self._capture[0].enable()
+        self._current = (time.perf_counter(), [])
+
+    def record(self, key, start, planned, read, decoded, published):
+        '''
+        Record the time.perf_counter() values taken at the start and after
+        each phase of the scan of a subscription (key: str).
+        '''
+        if self._current is not None:
+            self._current[1].append((key, start, planned, read, decoded, published))
+
+    def end_cycle(self):
+        '''
+        Returns:
+        tuple -- the recorded cycle (start, end, records)
+        '''
+        start, records = self._current
+        cycle = (start, time.perf_counter(), records)
+        self.cycles.append(cycle)
+        self._current = None
+        if self._capture is not None:
+            profile = self._capture[0]
+            profile.disable()
+            self._capture[1] -= 1
+            if self._capture[1] <= 0:
+                self._capture = None
+                self._write_capture(profile)
+        return cycle
+
+    def _write_capture(self, profile):
+        base = os.path.splitext(self.path)[0] if self.path else 'trbnet-profile'
+        path = '%s-%d.pstats' % (base, len(self.captures) + 1)
+        profile.dump_stats(path)
+        self.captures.append(path)
+
+    @staticmethod
+    def phase_times(record):
+        '''
+        Returns:
+        dict -- {phase: seconds} of a record
+        '''
+        marks = record[1:]
+        return {phase: marks[i + 1] - marks[i] for i, phase in enumerate(PHASES)}
+
+    def describe(self, cycle):
+        '''
+        Returns:
+        str -- duration and phase totals of a cycle and its slowest subscription
+        '''
+        start, end, records = cycle
+        totals = dict.fromkeys(PHASES, 0.0)
+        for record in records:
+            for phase, seconds in self.phase_times(record).items():
+                totals[phase] += seconds
+        text = '%.3f s (%s)' % (end - start, ', '.join('%s %.3f s' % (phase, totals[phase]) for phase in PHASES))
+        if records:
+            slowest = max(records, key=lambda record: record[5] - record[1])
+            text += ', slowest: %s %.3f s' % (slowest[0], slowest[5] - slowest[1])
+        return text
+
+    def summary(self):
+        '''
+        Returns:
+        dict -- {key: {phase: {'mean': seconds, 'max': seconds}}} over the kept cycles
+                (key 'cycle': the durations of the cycles)
+        '''
+        phases = {}
+        for start, end, records in self.cycles:
+            for record in records:
+                for phase, seconds in self.phase_times(record).items():
+                    phases.setdefault(record[0], {}).setdefault(phase, []).append(seconds)
+        summary = {key: {phase: {'mean': sum(values) / len(values), 'max': max(values)}
+                         for phase, values in times.items()}
+                   for key, times in phases.items()}
+        durations = [end - start for start, end, records in self.cycles]
+        if durations:
+            summary['cycle'] = {'total': {'mean': sum(durations) / len(durations), 'max': max(durations)}}
+        return summary
+
+    def speedscope(self, name='trbnet scan cycles'):
+        '''
+        Returns:
+        dict -- the kept cycles as speedscope file (evented profile, unit: seconds)
+        '''
+        frames, index = [], {}
+        def frame(name):
+            if name not in index:
+                index[name] = len(frames)
+                frames.append({'name': name})
+            return index[name]
+        events = []
+        origin = self.cycles[0][0] if self.cycles else 0.0
+        def event(kind, name, at):
+            events.append({'type': kind, 'frame': frame(name), 'at': max(at - origin, events[-1]['at'] if events else 0.0)})
+        for start, end, records in self.cycles:
+            event('O', 'cycle', start)
+            for record in records:
+                key, marks = record[0], record[1:]
+                event('O', key, marks[0])
+                for i, phase in enumerate(PHASES):
+                    event('O', phase, marks[i])
+                    event('C', phase, marks[i + 1])
+                event('C', key, marks[-1])
+            event('C', 'cycle', end)
+        return {
+          '$schema': 'https://www.speedscope.app/file-format-schema.json',
+          'name': name,
+          'exporter': 'trbnet',
+          'shared': {'frames': frames},
+          'profiles': [{
+            'type': 'evented',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0.0,
+            'endValue': events[-1]['at'] if events else 0.0,
+            'events': events,
+          }],
+        }
+
+    def save(self, path=None):
+        '''
+        Write the phase timings of the kept cycles as speedscope JSON
+        to path (default: the path given to the constructor).
+        '''
+        with open(path or self.path, 'w') as f:
+            json.dump(self.speedscope(), f)
@@ -1,10 +1,36 @@
 #!/usr/bin/env python
 
-import click, time, logging
-from trbnet import TrbNet, TrbException, TrbError
-from trbnet.xmldb import XmlDb
+import click, time, logging, shlex, sys
+import numpy as np
+from trbnet import TrbNet, TrbException, TrbError, EndpointHealth, SnapshotTrbNet, SnapshotPoller
+from trbnet import ProxyTrbNet, TrbNetProxyServer, FastTrbNet
+from trbnet.xmldb import XmlDb, sample_statistics
+from trbnet.util.output import WRITERS
+from trbnet.util import dump as _dump_module
+from trbnet.util.profiling import ScanProfiler
+from trbnet.util.errors import ErrorAggregator, MISSING, TRB_ERROR, STATUS_WARNING, OTHER_ERROR
 
-t = TrbNet()
+class _LazyTrbNet(object):
+    '''
+    Creates the TrbNet instance on first use, so that this module
+    (and the Python API defined in it) can be imported without
+    loading libtrbnet and connecting to TrbNet.
+    '''
+    def __init__(self):
+        self._trbnet = None
+    def connect(self, trbnet=None, **kwargs):
+        '''
+        Use the TrbNet instance trbnet (e.g. a FakeTrbNet) or
+        a new TrbNet(**kwargs) instead of the default connection.
+        '''
+        self._trbnet = trbnet if trbnet is not None else TrbNet(**kwargs)
+    def __getattr__(self, name):
+        if self._trbnet is None:
+            self._trbnet = TrbNet()
+        return getattr(self._trbnet, name)
+
+t = _LazyTrbNet()
+db = XmlDb()
 logger = logging.getLogger('trbnet.util.trbcmd')
 
 ### Helpers
@@ -15,43 +41,117 @@ def _status_warning():
     else:
         return None
 
-### Definition of a Python API to the functions later exposed by the CLI
+def _based_int(value):
+    if value[:2].lower() == '0x':
+        return int(value[2:], 16)
+    elif value[:1] == '0':
+        return int(value, 8)
+    return int(value, 10)
 
-def _r(trb_address, register):
-    response = t.register_read(trb_address, register)
+def _expand_based_ints(value):
+    '''
+    Expands a list of integers and integer ranges such as
+    '0x8000,0x8010-0x8012' to [0x8000, 0x8010, 0x8011, 0x8012].
+    '''
+    values = []
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-', 1)
+            values += range(_based_int(first), _based_int(last) + 1)
+        else:
+            values.append(_based_int(part))
+    return values
+
+def _print_response(response):
     for endpoint in response:
         str_data = '{:08X}'.format(response[endpoint])
         print("endpoint 0x{:08X} responded with: {}".format(endpoint, str_data))
 
-def _rm(trb_address, register, size, mode):
+### Definition of a Python API to the functions later exposed by the CLI
+
+def _r(trb_address, register):
+    response = t.register_read(trb_address, register)
+    _print_response(response)
+    status_warning = _status_warning()
+    if status_warning: logger.warning(status_warning)
+
+def _rm(trb_address, register, size, mode, decode=None):
+    '''
+    Reads size registers starting at register and prints the words,
+    or the fields of the entity decode located in them (mode 0 only).
+    '''
     response = t.register_read_mem(trb_address, register, mode, size)
-    for endpoint in response:
-        str_data = ' '.join('{:08X}'.format(word) for word in response[endpoint])
-        print("endpoint 0x{:08X} responded with: {}".format(endpoint, str_data))
+    if decode:
+        for endpoint, fields in db.decode_read_mem(decode, register, response).items():
+            print("endpoint 0x{:08X} responded with:".format(endpoint))
+            for data in fields:
+                print("  0x{:04x} {} {}".format(data.address, data.identifier, data.unicode))
+    else:
+        for endpoint in response:
+            str_data = ' '.join('{:08X}'.format(word) for word in response[endpoint])
+            print("endpoint 0x{:08X} responded with: {}".format(endpoint, str_data))
     status_warning = _status_warning()
     if status_warning: logger.warning(status_warning)
 
+def _w(trb_address, register, value):
+    t.register_write(trb_address, register, value)
+
 def _xmlentry(entity, name):
-    db = XmlDb()
     reg_addresses = db._get_all_element_addresses(entity, name)
     for field_name in db._contained_fields(entity, name):
         reg_addresses = db._get_all_element_addresses(entity, field_name)
         yield {'entity': entity, 'field_name': field_name, 'reg_addresses': reg_addresses}
 
-def _xmlget(trb_address, entity, name, logger=logger):
-    db = XmlDb()
+def _xmlplan(entity, name):
+    '''
+    Determines what _xmlget() has to read and decode for an xml register entry.
+
+    Returns:
+    tuple -- (list of (start, size) register blocks, list of (field_name, reg_addresses))
+    '''
     register_blocks = db._determine_continuous_register_blocks(entity, name)
+    fields = [(field_name, db._get_all_element_addresses(entity, field_name))
+              for field_name in db._contained_fields(entity, name)]
+    return register_blocks, fields
+
+def _xmlread(trb_address, register_blocks, logger=logger, health=None, errors=None, entity=None, name=None):
+    '''
+    Reads the register blocks of an xml register entry.
+
+    Arguments:
+    errors -- ErrorAggregator counting the failed reads and status warnings
+              (per trb_address, entity and name) instead of logging each of them
+
+    Returns:
+    tuple -- (dictionary {reg_address: {trb_address: int, ...}, ...},
+              True if the reading was aborted because trb_address is dead)
+    '''
     all_data = {} # dictionary with {'reg_address': {'trb_address': int, ...}, ...}
+    dead = False
     for start, size in register_blocks:
-        if size > 1:
-            try:
+        try:
+            if size > 1:
                 response = t.register_read_mem(trb_address, start, 0, size)
-            except TrbException as e:
-                if logger: logger.error("TRB Error happened: %s -- Continuing anyways.", repr(e))
-                continue
-            except Exception as e:
-                if logger: logger.error("Other error happened: %s -- Continuing anyways.", repr(e))
-                continue
+            else:
+                response = t.register_read(trb_address, start)
+        except TrbException as e:
+            if errors is not None:
+                errors.record(TRB_ERROR, trb_address, entity, name, detail=e.__repr__)
+            if health is not None and health.record_failure(trb_address, e):
+                dead = True
+                if logger: logger.error("TRB Error happened: %s -- Skipping trb_address 0x%04x.", repr(e), trb_address)
+                break
+            if logger and errors is None: logger.error("TRB Error happened: %s -- Continuing anyways.", repr(e))
+            continue
+        except Exception as e:
+            if errors is not None:
+                errors.record(OTHER_ERROR, trb_address, entity, name, detail=e.__repr__)
+            elif logger:
+                logger.error("Other error happened: %s -- Continuing anyways.", repr(e))
+            continue
+        if errors is not None and t.trb_errno() == TrbError.TRB_STATUS_WARNING:
+            errors.record(STATUS_WARNING, trb_address, entity, name, detail=lambda: t.trb_termstr(t.trb_term()))
+        if size > 1:
             for response_trb_address, data in response.items():
                 if not data:
                     continue
@@ -60,50 +160,375 @@ def _xmlget(trb_address, entity, name, logger=logger):
                          all_data[reg_address] = {}
                     all_data[reg_address][response_trb_address] = word
         else:
-            reg_address = start
-            try:
-                response = t.register_read(trb_address, reg_address)
-            except TrbException as e:
-                if logger: logger.error("TRB Error happened: %s -- Continuing anyways.", repr(e))
-                continue
-            except Exception as e:
-                if logger: logger.error("Other error happened: %s -- Continuing anyways.", repr(e))
-                continue
             for response_trb_address, word in response.items():
-                if reg_address not in all_data:
-                    all_data[reg_address] = {}
-                all_data[reg_address][response_trb_address] = word
-    for field_name in db._contained_fields(entity, name):
-        reg_addresses = db._get_all_element_addresses(entity, field_name)
+                if start not in all_data:
+                    all_data[start] = {}
+                all_data[start][response_trb_address] = word
+    if health is not None and not dead:
+        health.record_success(trb_address)
+    return all_data, dead
+
+def _xmlget(trb_address, entity, name, logger=logger, health=None, plan=None, profiler=None, errors=None):
+    '''
+    Reads and decodes an xml register entry.
+
+    Arguments:
+    profiler -- ScanProfiler to record the phase timings with (the time the
+                caller spends between the yielded values counts as 'publish')
+    errors -- ErrorAggregator to count errors with instead of logging every occurrence
+
+    Yields:
+    FieldValue -- of every field (and slice) of every responding trb address
+    '''
+    if health is not None and not health.check(t, trb_address):
+        return
+    clock = time.perf_counter
+    start = clock()
+    register_blocks, fields = plan or _xmlplan(entity, name)
+    planned = clock()
+    all_data, dead = _xmlread(trb_address, register_blocks, logger=logger, health=health, errors=errors,
+                              entity=entity, name=name)
+    read = clock()
+    results = _xmldecode(entity, fields, all_data, dead, logger=logger, errors=errors, trb_address=trb_address)
+    if profiler is None:
+        yield from results
+        return
+    results = list(results)
+    decoded = clock()
+    yield from results
+    profiler.record('0x%04x %s %s' % (trb_address, entity, name), start, planned, read, decoded, clock())
+
+def _xmldecode(entity, fields, all_data, dead=False, logger=logger, errors=None, trb_address=None):
+    '''
+    Decodes the register words read by _xmlread() into the fields of an xml register entry.
+    Missing registers are counted by errors (ErrorAggregator, if not None) or logged.
+
+    Yields:
+    FieldValue -- of every field (and slice) of every responding trb address
+    '''
+    for field_name, reg_addresses in fields:
         slices = len(reg_addresses)
         for slice, reg_address in enumerate(reg_addresses):
             if reg_address not in all_data:
-                fmt = "register missing in response: %s (addr 0x%04x)"
-                if logger: logger.warning(fmt, field_name, reg_address)
+                if dead:
+                    continue
+                if errors is not None:
+                    errors.record(MISSING, trb_address, entity, field_name, detail=lambda: 'addr 0x%04x' % reg_address)
+                elif logger:
+                    logger.warning("register missing in response: %s (addr 0x%04x)", field_name, reg_address)
                 continue
             for response_trb_address, value in all_data[reg_address].items():
                 data = db.convert_field(entity, field_name, value, trb_address=response_trb_address, slice=slice if slices > 1 else None)
                 yield data
 
+def _xmlget_arrays(trb_address, entity, name, responders=None, logger=logger, health=None, plan=None, errors=None):
+    '''
+    Like _xmlget() but yields the raw register words of every field as a
+    matrix with one row per responding trb address and one column per slice.
+    Missing register words are set to 0 (and logged or counted by errors).
+
+    Arguments:
+    responders -- list of trb addresses to return rows for (default: all responding)
+
+    Yields:
+    tuple -- (field_name, list of responding trb addresses, numpy matrix of register words)
+    '''
+    if health is not None and not health.check(t, trb_address):
+        return
+    register_blocks, fields = plan or _xmlplan(entity, name)
+    all_data, dead = _xmlread(trb_address, register_blocks, logger=logger, health=health, errors=errors,
+                              entity=entity, name=name)
+    if dead:
+        return
+    yield from _xmlarrays(fields, all_data, responders=responders, logger=logger, errors=errors,
+                          trb_address=trb_address, entity=entity)
+
+def _xmlarrays(fields, all_data, responders=None, logger=logger, errors=None, trb_address=None, entity=None):
+    '''
+    Arranges the register words read by _xmlread() as matrices, see _xmlget_arrays().
+    '''
+    for field_name, reg_addresses in fields:
+        columns = [all_data.get(reg_address, {}) for reg_address in reg_addresses]
+        field_responders = responders
+        if field_responders is None:
+            field_responders = sorted(set().union(*columns))
+        words = np.array([[column.get(responder, 0) for column in columns] for responder in field_responders],
+                         dtype=np.uint32).reshape(len(field_responders), len(columns))
+        missing = sum(len(field_responders) - sum(1 for responder in field_responders if responder in column) for column in columns)
+        if missing and errors is not None:
+            errors.record(MISSING, trb_address, entity, field_name, count=missing)
+        elif missing and logger:
+            logger.warning("register missing in response: %s (%d values)", field_name, missing)
+        yield field_name, field_responders, words
+
+def _xmlwatch(trb_address, entity, name, interval=1.0, count=0, changes_only=False, logger=logger, profiler=None,
+              errors=None, on_poll_end=None):
+    '''
+    Repeatedly polls an xml register entry over the same connection.
+    The polls are scheduled on a fixed grid (start + k * interval), so the
+    timing doesn't drift. If a poll overruns, the missed slots are skipped.
+    With a ScanProfiler, every poll is recorded as a cycle. With an
+    ErrorAggregator, errors are counted and summarized periodically.
+    on_poll_end is called without arguments after the last value of every
+    poll (e.g. to flush the output before waiting for the next one).
+
+    Yields:
+    tuple -- (timestamp of the poll, converted field value)
+    '''
+    last_raw = {}
+    health = EndpointHealth()
+    start = time.monotonic()
+    polls = 0
+    while True:
+        timestamp = time.time()
+        if profiler is not None:
+            profiler.begin_cycle()
+        for data in _xmlget(trb_address, entity, name, logger=logger, health=health, profiler=profiler, errors=errors):
+            if changes_only:
+                identifier, raw = data.identifier, data.raw
+                if last_raw.get(identifier) == raw:
+                    continue
+                last_raw[identifier] = raw
+            yield timestamp, data
+        if on_poll_end is not None:
+            on_poll_end()
+        if profiler is not None:
+            profiler.end_cycle()
+        if errors is not None:
+            errors.maybe_summarize()
+        polls += 1
+        if count and polls >= count:
+            break
+        slot = int((time.monotonic() - start) / interval) + 1
+        time.sleep(max(0.0, start + slot * interval - time.monotonic()))
+
+def _dump(path, targets, workers=1, daqopservers=None, max_size=0xffff):
+    '''
+    Snapshot the full register space of the (trb_address, entity) targets
+    into the file at path.
+
+    Returns:
+    tuple -- (number of read_mem transactions, number of failed transactions)
+    '''
+    start = time.time()
+    plan = _dump_module.read_plan(db, targets, max_size=max_size)
+    results = _dump_module.execute_plan(plan, workers=workers, daqopservers=daqopservers, trbnet=t)
+    _dump_module.write_dump(path, targets, results, duration=time.time() - start)
+    return len(plan), sum(1 for result in results if result[2])
+
+def _snapshot(path, targets, interval=1.0, count=0, max_size=0xffff):
+    '''
+    Poll the full register space of the (trb_address, entity) targets
+    into the snapshot file at path (see trbnet.core.snapshot).
+    '''
+    blocks = _dump_module.read_plan(db, targets, max_size=max_size)
+    poller = SnapshotPoller(path, blocks, trbnet=t, interval=interval)
+    try:
+        poller.run(count=count)
+    finally:
+        poller.close()
+
+def _sample(trb_address, entity, name, n, slice=0, chunk_size=0xffff):
+    '''
+    Sample the register of an xml register entry (of the given slice of a
+    repeated entry) n times and compute the statistics of its fields.
+    Entries spanning several registers are rejected with a ValueError.
+    '''
+    reg_address = db._get_all_element_addresses(entity, name)[slice]
+    elsewhere = [field_name for field_name in db._contained_fields(entity, name)
+                 if reg_address not in db._get_all_element_addresses(entity, field_name)]
+    if elsewhere:
+        raise ValueError('%s %s spans several registers (%s not in register 0x%04x), '
+                         'sample one of its registers or fields instead' % (entity, name, ', '.join(elsewhere), reg_address))
+    statistics = {}
+    for samples in t.iter_register_samples(trb_address, reg_address, n, chunk_size=chunk_size):
+        sample_statistics(db, entity, name, samples, statistics=statistics, reg_address=reg_address)
+    return statistics
+
+def _read_text_words(f):
+    '''
+    Returns the words of a text file with one or more (0x.. hex, 0.. octal or
+    decimal) integers per line as numpy array ('#' starts a comment).
+    '''
+    words = (_based_int(word) for line in f for word in line.split('#', 1)[0].split())
+    return np.fromiter(words, dtype=np.uint32)
+
+def _upload(trb_address, register, data, option=0, chunk_size=0xffff, verify=False, verifier=None,
+            byteorder='<', progress=None):
+    '''
+    Write data (see TrbNet.upload_memory()) to the registers starting at register.
+
+    Returns:
+    dict -- the statistics of the upload
+    '''
+    statistics = t.upload_memory(trb_address, register, data, option=option, chunk_size=chunk_size,
+                                 verify=verify, verifier=verifier, byteorder=byteorder, progress=progress)
+    for responder, reg_address, written, read in statistics['first_mismatches'][:10]:
+        logger.error('Verification failed: endpoint 0x%04x register 0x%04x is 0x%08x instead of 0x%08x',
+                     responder, reg_address, read, written)
+    return statistics
+
+BATCH_COMMANDS = ('r', 'rm', 'w', 'xmlget')
+
+def _parse_batch_line(line):
+    '''
+    Parses a line of a batch script into a list of commands, expanding
+    address lists and ranges (e.g. 'r 0x8000,0x8001 0x0-0x3').
+
+    Returns:
+    list -- of tuples (command, arg1, arg2, ...), empty for blank lines / comments
+    '''
+    tokens = shlex.split(line, comments=True)
+    if not tokens:
+        return []
+    cmd, args = tokens[0], tokens[1:]
+    if cmd not in BATCH_COMMANDS:
+        return [(None, tokens)]
+    nargs = {'r': 2, 'rm': 4, 'w': 3, 'xmlget': 3}[cmd]
+    if len(args) != nargs:
+        raise ValueError("%s expects %d arguments, got %d" % (cmd, nargs, len(args)))
+    trb_addresses = _expand_based_ints(args[0])
+    if cmd == 'xmlget':
+        return [(cmd, trb_address, args[1], args[2]) for trb_address in trb_addresses]
+    registers = _expand_based_ints(args[1])
+    rest = tuple(_based_int(arg) for arg in args[2:])
+    return [(cmd, trb_address, register) + rest for trb_address in trb_addresses for register in registers]
+
+def _coalesce_reads(commands):
+    '''
+    Merges runs of 'r' commands reading adjacent registers of the same
+    trb_address into ('r*', trb_address, first_register, count) commands
+    that are executed as a single register_read_mem transaction.
+    '''
+    run = None
+    for command in commands:
+        if run and command[0] == 'r' and command[1] == run[1] and command[2] == run[2] + run[3] and run[3] < 0xffff:
+            run = ('r*', run[1], run[2], run[3] + 1)
+            continue
+        if run:
+            yield run
+            run = None
+        if command[0] == 'r':
+            run = ('r*', command[1], command[2], 1)
+        else:
+            yield command
+    if run:
+        yield run
+
+def _run_batch_command(command):
+    cmd, args = command[0], command[1:]
+    if cmd == 'r*':
+        trb_address, register, count = args
+        if count == 1:
+            _r(trb_address, register)
+            return
+        response = t.register_read_mem(trb_address, register, 0, count)
+        for offset in range(count):
+            _print_response({endpoint: data[offset] for endpoint, data in response.items() if len(data) > offset})
+        status_warning = _status_warning()
+        if status_warning: logger.warning(status_warning)
+    elif cmd == 'rm':
+        _rm(*args)
+    elif cmd == 'w':
+        _w(*args)
+    elif cmd == 'xmlget':
+        for data in _xmlget(*args):
+            print("{context[identifier]} {value[unicode]} {unit}".format(**data))
+    else:
+        # any other command of the CLI
+        if args[0][0] in ('batch', 'shell'):
+            raise ValueError("'%s' cannot be nested" % args[0][0])
+        cli.main(args=args[0], prog_name='trbcmd.py', standalone_mode=False)
+
+def _batch(lines, logger=logger, window=64):
+    '''
+    Executes the trbcmd commands in lines over a single TrbNet connection,
+    line by line as they are read. Reads of adjacent registers are coalesced
+    into register_read_mem transactions within a lookahead window of up to
+    window lines of 'r' commands (1: execute every line immediately). If
+    such a transaction fails, its registers are read one by one, so that
+    only the reads which fail on their own are reported as failed.
+
+    Returns:
+    tuple -- (number of commands, number of failed commands including lines that could not be parsed)
+    '''
+    executed, failed = 0, 0
+    def run(command):
+        nonlocal executed, failed
+        executed += 1
+        try:
+            _run_batch_command(command)
+        except (TrbException, click.ClickException, ValueError) as e:
+            failed += 1
+            name = command[-1][0] if command[0] is None else command[0].rstrip('*')
+            if logger: logger.error("%s failed: %s", name, repr(e))
+    def execute(commands):
+        nonlocal executed
+        for command in _coalesce_reads(commands):
+            if command[0] != 'r*' or command[3] == 1:
+                run(command)
+                continue
+            cmd, trb_address, register, count = command
+            try:
+                _run_batch_command(command)
+            except TrbException as e:
+                if logger: logger.debug("reading 0x%04x registers 0x%04x-0x%04x at once failed (%s), reading them one by one",
+                                        trb_address, register, register + count - 1, repr(e))
+                for offset in range(count):
+                    run(('r*', trb_address, register + offset, 1))
+                continue
+            executed += count
+        sys.stdout.flush()
+    pending, pending_lines = [], 0
+    for lineno, line in enumerate(lines, start=1):
+        try:
+            commands = _parse_batch_line(line)
+        except ValueError as e:
+            executed += 1
+            failed += 1
+            if logger: logger.error("line %d: %s", lineno, e)
+            continue
+        if not commands:
+            continue
+        pending += commands
+        pending_lines += 1
+        # only runs of reads can be coalesced, anything else is executed right away
+        if pending_lines >= window or any(command[0] != 'r' for command in commands):
+            execute(pending)
+            pending, pending_lines = [], 0
+    execute(pending)
+    return executed, failed
+
 ### Definition of the CLI with the help of the click package:
 
 class BasedIntParamType(click.ParamType):
     name = 'integer'
     def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
         try:
-            if value[:2].lower() == '0x':
-                return int(value[2:], 16)
-            elif value[:1] == '0':
-                return int(value, 8)
-            return int(value, 10)
+            return _based_int(value)
         except ValueError:
             self.fail('%s is not a valid integer' % value, param, ctx)
 
 BASED_INT = BasedIntParamType()
 
 @click.group()
-def cli():
-    pass
+@click.option('--snapshot', type=click.Path(exists=True, dir_okay=False),
+              help='read from this register snapshot file instead of TrbNet (see the snapshot command)')
+@click.option('--max-age', type=float, default=None, help='with --snapshot: maximum age of the data in seconds')
+@click.option('--proxy', metavar='ADDRESS', help='send all requests to the TrbNet proxy at ADDRESS (see the proxy command)')
+@click.option('--fast', 'binding', type=click.Choice(['ctypes', 'cffi']), default=None,
+              help='call libtrbnet through the low overhead FastTrbNet with this binding')
+def cli(snapshot, max_age, proxy, binding):
+    if sum(bool(option) for option in (snapshot, proxy, binding)) > 1:
+        raise click.UsageError('--snapshot, --proxy and --fast cannot be combined.')
+    if snapshot:
+        t.connect(SnapshotTrbNet(snapshot, max_age=max_age))
+    elif proxy:
+        t.connect(ProxyTrbNet(proxy))
+    elif binding:
+        t.connect(FastTrbNet(binding=binding))
 
 @cli.command()
 @click.argument('trb_address', type=BASED_INT)
@@ -117,9 +542,63 @@ def r(trb_address, register):
 @click.argument('register', type=BASED_INT)
 @click.argument('size', type=BASED_INT)
 @click.argument('mode', type=BASED_INT)
-def rm(trb_address, register, size, mode):
+@click.option('--decode', 'decode', metavar='ENTITY', help='decode the registers into the fields of ENTITY (mode 0)')
+def rm(trb_address, register, size, mode, decode):
     click.echo('Reading register memory')
-    _rm(trb_address, register, size, mode)
+    if decode and mode != 0:
+        raise click.BadParameter('--decode requires mode 0 (adjacent registers)', param_hint='mode')
+    _rm(trb_address, register, size, mode, decode=decode)
+
+@cli.command()
+@click.argument('trb_address', type=BASED_INT)
+@click.argument('register', type=BASED_INT)
+@click.argument('value', type=BASED_INT)
+def w(trb_address, register, value):
+    click.echo('Writing register')
+    _w(trb_address, register, value)
+
+@cli.command()
+@click.argument('trb_address', type=BASED_INT)
+@click.argument('register', type=BASED_INT)
+@click.argument('file', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--mode', type=click.Choice(['0', '1']), default='0',
+              help='0: write adjacent registers (default), 1: write the same register repeatedly')
+@click.option('--text', is_flag=True, help='FILE contains integers as text instead of raw 32-bit words')
+@click.option('--big-endian', is_flag=True, help='the raw 32-bit words of FILE are big endian')
+@click.option('--chunk-size', type=BASED_INT, default=0xffff, help='maximum number of words per transaction')
+@click.option('--verify', is_flag=True, help='read back and compare every chunk (mode 0)')
+@click.option('--verify-proxy', metavar='ADDRESS', default=None,
+              help='verify in parallel over a connection to the TrbNet proxy at ADDRESS')
+def upload(trb_address, register, file, mode, text, big_endian, chunk_size, verify, verify_proxy):
+    """
+    Write the words of FILE ('-' for stdin) to TrbNet in as few
+    transactions as possible, e.g. lookup tables or flash pages.
+    """
+    option = int(mode)
+    if (verify or verify_proxy) and option != 0:
+        raise click.BadParameter('--verify requires mode 0 (adjacent registers)', param_hint='mode')
+    if text:
+        with click.open_file(file, 'r') as f:
+            data = _read_text_words(f)
+    elif file == '-':
+        data = sys.stdin.buffer.read()
+    else:
+        data = file
+    verifier = ProxyTrbNet(verify_proxy) if verify_proxy else None
+    with click.progressbar(length=1, label='Uploading', file=sys.stderr) as bar:
+        def progress(written, total, seconds):
+            bar.length = total
+            bar.update(written - bar.pos)
+        statistics = _upload(trb_address, register, data, option=option, chunk_size=chunk_size,
+                             verify=verify or bool(verify_proxy), verifier=verifier,
+                             byteorder='>' if big_endian else '<', progress=progress)
+    click.echo('%d words in %d transactions in %.3f s (%.1f kB/s)' % (statistics['words'], statistics['chunks'],
+               statistics['seconds'], statistics['bytes_per_second'] / 1000), err=True)
+    if verify or verify_proxy:
+        click.echo('verified %d words: %d mismatches, %d chunks without response' % (statistics['verified'],
+                   statistics['mismatches'], statistics['unanswered']), err=True)
+        if statistics['mismatches'] or statistics['unanswered']:
+            sys.exit(1)
 
 @cli.command()
 @click.argument('entity')
@@ -132,14 +611,209 @@ def xmlentry(entity, name):
         info['slices'] = ' (%d slices)' % slices if slices > 1 else ''
         print("ENTITY: {entity:10s} FIELD: {field_name:20s} REGISTER(s): {reg_addresses} {slices}".format(**info))
 
+@cli.command()
+@click.argument('query', nargs=-1, required=True)
+@click.option('--entity', 'entities', multiple=True, help='only search these entities (default: all)')
+@click.option('--limit', type=int, default=None, help='maximum number of results')
+def xmlsearch(query, entities, limit):
+    """
+    Search the fields of the xml-db by name, path, unit, format and
+    description, e.g. 'name:*Temp*' 'unit:°C' (all terms have to match).
+    """
+    click.echo('Searching xml-db fields')
+    for result in db.search(' '.join(query), entities=entities or None, limit=limit):
+        info = result._asdict()
+        info['path'] = '/'.join(result.path)
+        info['reg_addresses'] = ', '.join('0x{:04x}'.format(addr) for addr in result.addresses)
+        print("ENTITY: {entity:10s} FIELD: {field_name:20s} REGISTER(s): {reg_addresses} "
+              "PATH: {path} FORMAT: {format} UNIT: {unit} -- {description}".format(**info))
+
+@cli.command()
+@click.argument('entities', nargs=-1)
+@click.option('--workers', '-j', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+def xmlpreload(entities, workers):
+    """
+    Parse and compile ENTITIES (default: all) of the xml-db in parallel.
+    """
+    click.echo('Preloading xml-db entities')
+    start = time.time()
+    report = db.preload(entities or None, workers=workers)
+    for entity, result in sorted(report.items(), key=lambda item: -item[1]['seconds']):
+        status = result['error'] or '%d records' % result['records']
+        print("ENTITY: {:20s} {:8.3f} s  {}".format(entity, result['seconds'], status))
+    click.echo('%d entities in %.3f s' % (len(report), time.time() - start), err=True)
+
+@cli.command()
+@click.argument('trb_address', type=BASED_INT)
+@click.argument('entity')
+@click.argument('name')
+@click.option('--interval', type=float, default=0.0, help='watch mode: poll every INTERVAL seconds')
+@click.option('--count', type=int, default=0, help='watch mode: stop after COUNT polls (default: never)')
+@click.option('--format', 'format', type=click.Choice(sorted(WRITERS)), default='text', help='output format')
+@click.option('--changes-only', is_flag=True, help='watch mode: only output values that changed')
+@click.option('--profile', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='write the phase timings (plan, read, decode, publish) of every poll to PROFILE (speedscope JSON)')
+@click.option('--profile-capture', type=int, default=0, metavar='N',
+              help='with --profile: capture cProfile statistics of the first N polls (PROFILE-1.pstats)')
+@click.option('--error-summary', type=float, default=60.0, metavar='SECONDS',
+              help='watch mode: log errors once when first seen and summarize them every SECONDS')
+def xmlget(trb_address, entity, name, interval, count, format, changes_only, profile, profile_capture, error_summary):
+    if interval <= 0 and (count or changes_only):
+        raise click.UsageError('--count and --changes-only require --interval (watch mode)')
+    if format == 'text':
+        click.echo('Querying xml register entry from TrbNet')
+    writer = WRITERS[format]()
+    profiler = ScanProfiler(profile) if profile else None
+    if profiler is not None and profile_capture:
+        profiler.capture(profile_capture)
+    errors = None
+    if interval > 0:
+        errors = ErrorAggregator(logger=logger, summary_period=error_summary)
+        results = _xmlwatch(trb_address, entity, name, interval=interval, count=count, changes_only=changes_only,
+                            profiler=profiler, errors=errors, on_poll_end=writer.flush)
+    elif profiler is not None:
+        # a single poll, recorded as a cycle
+        results = _xmlwatch(trb_address, entity, name, count=1, profiler=profiler)
+    else:
+        timestamp = time.time()
+        results = ((timestamp, data) for data in _xmlget(trb_address, entity, name))
+    try:
+        for timestamp, data in results:
+            writer.write(data, timestamp)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+        if profiler is not None:
+            _write_profile(profiler)
+        summary = errors.summary() if errors is not None else None
+        if summary:
+            logger.warning('Errors since the last summary: %s', summary)
+
+def _write_profile(profiler):
+    '''
+    Save the phase timings of a ScanProfiler and print their summary to stderr.
+    '''
+    profiler.save()
+    for key, phases in sorted(profiler.summary().items()):
+        click.echo('%-40s %s' % (key, '  '.join('%s %.6f/%.6f s' % (phase, times['mean'], times['max'])
+                                                for phase, times in phases.items())), err=True)
+    click.echo('(mean/max per phase) profile written to: %s' % ', '.join([profiler.path] + profiler.captures), err=True)
+
+@cli.command()
+@click.argument('script', type=click.File('r'), default='-')
+@click.option('--timing', is_flag=True, help='print the wall time needed to stderr')
+@click.option('--window', type=click.IntRange(min=1), default=64,
+              help='coalesce reads of adjacent registers within up to WINDOW lines (1: execute every line immediately)')
+def batch(script, timing, window):
+    """
+    Execute trbcmd commands (r, rm, w, xmlget, ...) from SCRIPT
+    (default: stdin), one per line, over a single connection.
+    Addresses can be lists and ranges, e.g.: r 0x8000,0x8001 0x0-0x3
+    Exits with status 1 if any command failed.
+    """
+    start = time.time()
+    executed, failed = _batch(script, window=window)
+    if timing:
+        click.echo('%d commands (%d failed) in %.3f s' % (executed, failed, time.time() - start), err=True)
+    if failed:
+        sys.exit(1)
+
+@cli.command()
+def shell():
+    """
+    Interactive shell keeping the TrbNet connection and XmlDb caches warm.
+    """
+    try:
+        import readline
+    except ImportError:
+        pass
+    while True:
+        try:
+            line = input('trbcmd> ')
+        except EOFError:
+            click.echo()
+            break
+        except KeyboardInterrupt:
+            click.echo()
+            continue
+        if line.strip() in ('exit', 'quit'):
+            break
+        start = time.time()
+        _batch([line])
+        click.echo('(%.3f s)' % (time.time() - start), err=True)
+
+@cli.command()
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--target', '-t', 'targets', type=(BASED_INT, str), multiple=True, required=True,
+              help='TRB_ADDRESS ENTITY to dump (can be given multiple times)')
+@click.option('--workers', '-j', type=int, default=1, help='number of worker processes')
+@click.option('--daqopserver', 'daqopservers', multiple=True,
+              help='trbnetd daemon(s) for the workers (default: DAQOPSERVER)')
+@click.option('--max-size', type=BASED_INT, default=0xffff, help='maximum number of registers per transaction')
+def dump(output, targets, workers, daqopservers, max_size):
+    """
+    Dump all registers of the given entities into the binary file OUTPUT.
+    """
+    click.echo('Dumping register space')
+    start = time.time()
+    transactions, failed = _dump(output, targets, workers=workers, daqopservers=daqopservers, max_size=max_size)
+    click.echo('%d transactions (%d failed) in %.3f s' % (transactions, failed, time.time() - start), err=True)
+
+@cli.command()
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--target', '-t', 'targets', type=(BASED_INT, str), multiple=True, required=True,
+              help='TRB_ADDRESS ENTITY to poll (can be given multiple times)')
+@click.option('--interval', type=float, default=1.0, help='poll every INTERVAL seconds')
+@click.option('--count', type=int, default=0, help='stop after COUNT polls (default: never)')
+@click.option('--max-size', type=BASED_INT, default=0xffff, help='maximum number of registers per transaction')
+def snapshot(output, targets, interval, count, max_size):
+    """
+    Poll the registers of the targets into the snapshot file OUTPUT
+    which other processes can read from with --snapshot OUTPUT.
+    """
+    try:
+        _snapshot(output, targets, interval=interval, count=count, max_size=max_size)
+    except KeyboardInterrupt:
+        pass
+
+@cli.command()
+@click.option('--listen', metavar='ADDRESS', default=None,
+              help='unix:/path/to/socket or host:port (default: $TRBNET_PROXY or unix:/tmp/trbnet-proxy.sock)')
+def proxy(listen):
+    """
+    Serve the requests of local clients (trbcmd.py --proxy ADDRESS,
+    trbnet.ProxyTrbNet) over a single TrbNet connection.
+    """
+    server = TrbNetProxyServer(trbnet=t, address=listen)
+    click.echo('TrbNet proxy listening on %s' % server.address, err=True)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+
 @cli.command()
 @click.argument('trb_address', type=BASED_INT)
 @click.argument('entity')
 @click.argument('name')
-def xmlget(trb_address, entity, name):
-    click.echo('Querying xml register entry from TrbNet')
-    for data in _xmlget(trb_address, entity, name):
-        print("{context[identifier]} {value[unicode]} {unit}".format(**data))
+@click.argument('n', type=BASED_INT)
+@click.option('--slice', 'slice', type=int, default=0, help='slice of a repeated element to sample')
+@click.option('--histogram', is_flag=True, help='print the histogram of each field')
+def sample(trb_address, entity, name, n, slice, histogram):
+    click.echo('Sampling xml register entry from TrbNet')
+    start = time.time()
+    try:
+        statistics = _sample(trb_address, entity, name, n, slice=slice)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    duration = time.time() - start
+    for (response_trb_address, field_name), stats in sorted(statistics.items()):
+        identifier = db._get_field_identifier(entity, field_name, response_trb_address)
+        print("{} count: {count} mean: {mean:.6g} std: {std:.6g} min: {min:.6g} max: {max:.6g}".format(identifier, **stats.as_dict()))
+        if histogram:
+            for count, edge in zip(*stats.histogram()):
+                print("  {:>14.6g} {:>10d}".format(edge, count))
+    click.echo('%d samples per endpoint in %.3f s' % (n, duration), err=True)
 
 if __name__ == '__main__':
     cli()
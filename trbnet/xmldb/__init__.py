@@ -1 +1,7 @@
 from .db import XmlDb
+from .index import AddressIndex, IndexEntry
+from .search import FieldSearchIndex, SearchResult
+from .rates import RateEngine
+from .statistics import StreamingStatistics, sample_statistics
+from .values import FieldValue, FieldSpec
+from .watch import XmlDbWatcher
@@ -1,7 +1,31 @@
 import os
 import enum
-from datetime import datetime as dt
+import glob
+import time
+import fnmatch
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree
+import numpy as np
+
+from .values import FieldSpec, FieldValue
+from .lru import LRUCache, MISSING
+from .index import AddressIndex, IndexEntry
+from .search import FieldSearchIndex, SearchResult
+
+# purpose attribute values and name patterns of registers which don't change at runtime
+STATIC_PURPOSES = ('info',)
+STATIC_NAMES = ('CompileTime', 'HardwareInfo*', '*Version*', 'UniqueId*')
+
+# maximum number of entries of the caches of XmlDb (None: unbounded)
+DEFAULT_CACHE_SIZES = {
+    'xml_docs': 16,
+    'elements': 4096,
+    'records': 16384,
+    'field_hierarchy': 8192,
+    'field_info': 8192,
+    'field_spec': 8192,
+}
 
 class XmlDb(object):
     '''
@@ -14,27 +38,406 @@ class XmlDb(object):
     instantiating the class:
 
     >>> db = XmlDb(folder='./path/to/daqtools/xml-db/database/')
+
+    Parsed XML files and everything derived from them are kept in LRU caches
+    bounded by cache_sizes (see DEFAULT_CACHE_SIZES). With .compile(entity),
+    all lookups of an entity are precomputed into lightweight records and
+    its lxml tree is discarded. .cache_statistics() reports hits, misses and
+    sizes of the caches.
+
+    Changes of the XML files can be picked up at runtime by calling
+    .check_for_changes() periodically (or with an XmlDbWatcher): the cache
+    entries of changed entities are invalidated and the callbacks registered
+    with .subscribe() are called with the name of the changed entity.
+
+    .address_index() maps register addresses back to the fields located in
+    them, .decode_read_mem() decodes a whole register_read_mem() response.
+    .search() finds fields of all entities by name, path, unit, format and
+    description.
     '''
 
     TOP_ENTITY = 'TrbNetEntity'
     ENTITY_TAGS = ('field', 'register', 'group', 'TrbNetEntity')
 
-    def __init__(self, folder=None):
+    def __init__(self, folder=None, cache_sizes=None):
         if folder is None:
             folder = os.environ.get('XMLDB', '.')
             folder = os.path.expanduser(folder)
         self.folder = folder
-        self._cache_xml_docs = {}
-        self._cache_elements = {}
-        self._cache_field_hierarchy = {}
-        self._cache_field_info = {}
+        sizes = dict(DEFAULT_CACHE_SIZES, **(cache_sizes or {}))
+        # the cache entries are grouped by entity for a fast invalidation
+        by_entity = lambda key: key[0]
+        self._cache_xml_docs = LRUCache(sizes['xml_docs'], sizeof=self._xml_doc_size)
+        self._cache_elements = LRUCache(sizes['elements'], group=by_entity)
+        self._cache_records = LRUCache(sizes['records'], group=lambda key: key[1])
+        self._cache_field_hierarchy = LRUCache(sizes['field_hierarchy'], group=by_entity)
+        self._cache_field_info = LRUCache(sizes['field_info'], group=by_entity)
+        self._cache_field_spec = LRUCache(sizes['field_spec'], group=by_entity)
+        self._file_stamps = {}
+        self._subscribers = []
+        self._entity_indexes = {}   # {entity: AddressIndex}
+        self._address_index = None  # (entities, AddressIndex) built last
+        self._search_documents = {} # {entity: [SearchResult, ...]}
+        self._search_index = None   # (entities, FieldSearchIndex) built last
+
+    @staticmethod
+    def _xml_doc_size(xml_doc):
+        # the size of a parsed tree is approximated by the size of its file
+        try:
+            return os.path.getsize(xml_doc.docinfo.URL)
+        except (OSError, TypeError):
+            return 0
+
+    def _caches(self):
+        return {
+          'xml_docs': self._cache_xml_docs,
+          'elements': self._cache_elements,
+          'records': self._cache_records,
+          'field_hierarchy': self._cache_field_hierarchy,
+          'field_info': self._cache_field_info,
+          'field_spec': self._cache_field_spec,
+        }
+
+    def cache_statistics(self):
+        '''
+        Returns:
+        dict -- {cache name: {'entries', 'maxsize', 'bytes', 'hits', 'misses', 'evictions'}}
+                ('bytes' is approximate, for xml_docs it is the size of the parsed files)
+        '''
+        return {name: cache.statistics() for name, cache in self._caches().items()}
+
+    def clear_caches(self):
+        for cache in self._caches().values():
+            cache.clear()
+        self._entity_indexes.clear()
+        self._address_index = None
+        self._search_documents.clear()
+        self._search_index = None
+
+    def _xml_path(self, entity):
+        return os.path.join(self.folder, entity + '.xml')
+
+    def _file_stamp(self, entity):
+        try:
+            stat = os.stat(self._xml_path(entity))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def subscribe(self, callback):
+        '''
+        Register callback(entity) to be called by .check_for_changes()
+        for every entity whose XML file changed.
+        '''
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def invalidate_entity(self, entity):
+        '''
+        Remove everything cached for an entity (it will be parsed again when needed).
+        '''
+        self._cache_xml_docs.pop(entity)
+        for cache in (self._cache_records, self._cache_elements, self._cache_field_hierarchy,
+                      self._cache_field_info, self._cache_field_spec):
+            cache.discard_group(entity)
+        self._entity_indexes.pop(entity, None)
+        self._address_index = None
+        self._search_documents.pop(entity, None)
+        self._search_index = None
+
+    def check_for_changes(self):
+        '''
+        Check the XML files of all entities parsed so far for modifications
+        (by modification time and size), invalidate the cache entries of the
+        changed entities and notify the subscribers.
+
+        Returns:
+        list -- names of the changed entities
+        '''
+        changed = []
+        for entity, stamp in list(self._file_stamps.items()):
+            current = self._file_stamp(entity)
+            if current == stamp:
+                continue
+            self._file_stamps[entity] = current
+            self.invalidate_entity(entity)
+            changed.append(entity)
+        for entity in changed:
+            for callback in list(self._subscribers):
+                callback(entity)
+        return changed
+
+    def discard_xml(self, entity):
+        '''
+        Remove the lxml tree of an entity and all cache entries referencing
+        its elements (it will be parsed again when needed).
+        '''
+        self._cache_xml_docs.pop(entity)
+        self._cache_elements.discard_group(entity)
+        for cache in (self._cache_field_hierarchy, self._cache_field_info, self._cache_field_spec):
+            cache.discard_group(entity, lambda key: type(key[1]) != str)
+
+    def compile(self, entity, discard_xml=True):
+        '''
+        Precompute the addresses, contained fields and register blocks of all
+        named elements of an entity as well as the definitions of its fields,
+        so that lookups by name don't need the XML tree anymore.
+
+        Arguments:
+        discard_xml -- discard the lxml tree of the entity afterwards
+
+        Returns:
+        int -- number of compiled element names
+        '''
+        # index the elements by name in a single pass, so that the lookups
+        # by name below don't search the whole tree for every name
+        root = self._get_entity_element(entity)
+        by_name = {}
+        for element in root.iterdescendants():
+            name = element.get('name')
+            if name is not None:
+                by_name.setdefault((name, '*'), []).append(element)
+                fields = by_name.setdefault((name, 'field'), [])
+                if element.tag == 'field':
+                    fields.append(element)
+        for (name, tag), elements in by_name.items():
+            self._cache_elements[(entity, name, tag)] = elements
+        names = {element.get('name') for element in root.iter(*self.ENTITY_TAGS)}
+        compiled = 0
+        for name in sorted(name for name in names if name):
+            try:
+                self._get_all_element_addresses(entity, name)
+                self._determine_continuous_register_blocks(entity, name)
+                for field_name in self._contained_fields(entity, name):
+                    self._get_field_spec(entity, field_name)
+            except ValueError:
+                # non-unique names can't be looked up by name anyway
+                continue
+            compiled += 1
+        if discard_xml:
+            self.discard_xml(entity)
+        return compiled
+
+    def export_compiled(self, entity):
+        '''
+        Compile an entity (see .compile()) and return its compiled records
+        and field definitions in a picklable form for .import_compiled().
+        '''
+        self.compile(entity, discard_xml=False)
+        by_name = lambda cache: [(key, cache.get(key)) for key in cache.group_keys(entity) if type(key[1]) == str]
+        infos = []
+        for key, info in by_name(self._cache_field_info):
+            # dynamically created enums can't be pickled, they are recreated by the FieldSpec
+            meta = {name: value for name, value in info['meta'].items() if name != 'enum'}
+            infos.append((key, dict(info, meta=meta)))
+        compiled = {
+          'entity': entity,
+          'stamp': self._file_stamps.get(entity),
+          'records': [(key, self._cache_records.get(key)) for key in self._cache_records.group_keys(entity)],
+          'field_hierarchy': by_name(self._cache_field_hierarchy),
+          'field_info': infos,
+          'field_spec': by_name(self._cache_field_spec),
+        }
+        self.discard_xml(entity)
+        return compiled
+
+    def import_compiled(self, compiled):
+        '''
+        Fill the caches with the records returned by .export_compiled()
+        (e.g. in another process).
+        '''
+        entity = compiled['entity']
+        self.invalidate_entity(entity)
+        self._file_stamps[entity] = compiled['stamp']
+        for key, record in compiled['records']:
+            self._cache_records[key] = record
+        for key, hierarchy in compiled['field_hierarchy']:
+            self._cache_field_hierarchy[key] = hierarchy
+        specs = dict(compiled['field_spec'])
+        for key, spec in specs.items():
+            self._cache_field_spec[key] = spec
+        for key, info in compiled['field_info']:
+            if info['format'] == 'enum' and key in specs:
+                info['meta']['enum'] = specs[key].enum
+            self._cache_field_info[key] = info
+
+    def entities(self):
+        '''
+        Returns:
+        list -- names of all entities (.xml files) in the database folder
+        '''
+        return sorted(os.path.splitext(os.path.basename(path))[0]
+                      for path in glob.glob(os.path.join(self.folder, '*.xml')))
+
+    def _entity_index(self, entity):
+        index = self._entity_indexes.get(entity)
+        if index is not None:
+            return index
+        fields = list(self._get_entity_element(entity).iter('field'))
+        counts = {}
+        for element in fields:
+            name = element.get('name')
+            counts[name] = counts.get(name, 0) + 1
+        entries = []
+        for element in fields:
+            name = element.get('name')
+            # fields with non-unique names can't be converted by name
+            if not name or counts[name] != 1:
+                continue
+            base_address, slices, stepsize, size = self._get_element_addressing(entity, element)
+            for slice in range(slices or 1):
+                start = base_address + slice * stepsize
+                entries.append(IndexEntry(start, start + size, entity, name, slice if slices else None))
+        index = self._entity_indexes[entity] = AddressIndex(entries)
+        return index
+
+    def address_index(self, entities=None):
+        '''
+        Build (or return the cached) reverse index from register addresses
+        to the fields of the given entities (default: all entities).
+
+        >>> db.address_index().fields_at(0x40)
+        [IndexEntry(start=64, stop=65, entity='TrbNet', field_name='CompileTime', slice=None)]
+
+        Returns:
+        AddressIndex -- answering .fields_at(address) and .fields_in(start, stop)
+        '''
+        entities = tuple(sorted(entities if entities is not None else self.entities()))
+        if len(entities) == 1:
+            return self._entity_index(entities[0])
+        if self._address_index is None or self._address_index[0] != entities:
+            entries = [entry for entity in entities for entry in self._entity_index(entity).entries]
+            self._address_index = (entities, AddressIndex(entries))
+        return self._address_index[1]
+
+    def decode_registers(self, entity, reg_address, words, trb_address=0xffff):
+        '''
+        Decode the words of adjacent registers starting at reg_address (as read
+        by register_read_mem() with option 0) into the fields of an entity
+        located in them, in a single pass over the address index.
+
+        Returns:
+        list -- FieldValue of every field (and slice) in the registers, sorted by address
+        '''
+        stop = reg_address + len(words)
+        values = []
+        for entry in self._entity_index(entity).fields_in(reg_address, stop):
+            if entry.start < reg_address or entry.stop > stop:
+                continue
+            word = words[entry.start - reg_address]
+            values.append(self.convert_field(entity, entry.field_name, word, trb_address=trb_address, slice=entry.slice))
+        return values
+
+    def decode_read_mem(self, entity, reg_address, response):
+        '''
+        Decode a response {trb_address: [words]} of register_read_mem()
+        (option 0) starting at reg_address, see .decode_registers().
+
+        Returns:
+        dict -- {trb_address: [FieldValue, ...]}
+        '''
+        return {trb_address: self.decode_registers(entity, reg_address, words, trb_address=trb_address)
+                for trb_address, words in response.items()}
+
+    def _entity_search_documents(self, entity):
+        documents = self._search_documents.get(entity)
+        if documents is not None:
+            return documents
+        fields = list(self._get_entity_element(entity).iter('field'))
+        counts = {}
+        for element in fields:
+            name = element.get('name')
+            counts[name] = counts.get(name, 0) + 1
+        documents = []
+        for element in fields:
+            name = element.get('name')
+            # fields with non-unique names can't be subscribed to by name
+            if not name or counts[name] != 1:
+                continue
+            path = []
+            node = element
+            while node.tag in self.ENTITY_TAGS:
+                path.append(node.get('name'))
+                if node.tag == self.TOP_ENTITY: break
+                node = node.getparent()
+            documents.append(SearchResult(
+              entity, name, tuple(reversed(path)),
+              tuple(self._compute_all_element_addresses(entity, element)),
+              element.get('unit', ''), element.get('format', 'unsigned'),
+              ' '.join((element.findtext('description') or '').split())))
+        self._search_documents[entity] = documents
+        return documents
+
+    def search_index(self, entities=None):
+        '''
+        Build (or return the cached) search index over the fields of the
+        given entities (default: all entities).
+
+        Returns:
+        FieldSearchIndex
+        '''
+        entities = tuple(sorted(entities if entities is not None else self.entities()))
+        if self._search_index is None or self._search_index[0] != entities:
+            documents = [doc for entity in entities for doc in self._entity_search_documents(entity)]
+            self._search_index = (entities, FieldSearchIndex(documents))
+        return self._search_index[1]
+
+    def search(self, query, entities=None, limit=None):
+        '''
+        Search the fields of the given entities (default: all entities) by
+        name, hierarchy path, unit, format and description, e.g.
+        'name:*Temp* unit:°C' (see FieldSearchIndex for the query syntax).
+
+        Returns:
+        list -- SearchResult (entity, field_name, path, addresses, unit, format, description)
+        '''
+        return self.search_index(entities).search(query, limit=limit)
+
+    def preload(self, entities=None, workers=None):
+        '''
+        Parse and compile entities (default: all in the folder) concurrently
+        in a pool of worker processes and fill the caches with the compiled
+        records transferred back (no lxml trees), instead of parsing each
+        entity serially on first access.
+
+        Arguments:
+        entities -- list of entity names (default: .entities())
+        workers -- number of worker processes (default: number of CPUs,
+                   1: compile in this process)
+
+        Returns:
+        dict -- {entity: {'seconds': compile time, 'records': number of records, 'error': None or message}}
+        '''
+        entities = self.entities() if entities is None else list(entities)
+        workers = min(workers or os.cpu_count() or 1, len(entities))
+        report = {}
+        def collect(entity, result):
+            seconds, compiled, error = result
+            if compiled is not None:
+                self.import_compiled(compiled)
+            report[entity] = {'seconds': seconds, 'records': len(compiled['records']) if compiled else 0, 'error': error}
+        if workers <= 1:
+            for entity in entities:
+                collect(entity, _export_compiled(self, entity))
+            return report
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [(entity, pool.submit(_export_compiled, self.folder, entity)) for entity in entities]
+            for entity, future in futures:
+                collect(entity, future.result())
+        return report
 
     def _get_xml_doc(self, entity):
         # Try to fetch xmldoc from cache and return it:
-        if entity in self._cache_xml_docs:
-            return self._cache_xml_docs[entity]
+        xml_doc = self._cache_xml_docs.get(entity, MISSING)
+        if xml_doc is not MISSING:
+            return xml_doc
         # Otherwise parse the .xml file and add it to the cache:
-        xml_path = os.path.join(self.folder, entity + '.xml')
+        xml_path = self._xml_path(entity)
+        # the stamp is taken before parsing, so that changes during parsing are detected
+        self._file_stamps[entity] = self._file_stamp(entity)
         xml_doc = etree.parse(xml_path)
         ## check schema?
         #xmlschema_doc = etree.parse(xsd_path)
@@ -43,6 +446,12 @@ class XmlDb(object):
         self._cache_xml_docs[entity] = xml_doc
         return xml_doc
 
+    def _get_entity_element(self, entity):
+        '''
+        Returns the top level element (<TrbNetEntity>) of an entity.
+        '''
+        return self._get_xml_doc(entity).getroot()
+
     def _get_elements_by_name_attr(self, entity, name_attr, tag='*', amount=None):
         '''
         Finds and returns elements from the entity XML tree with the attribute
@@ -54,10 +463,9 @@ class XmlDb(object):
         '''
         # Try to fetch the elements from the cache
         key = (entity, name_attr, tag)
-        if key in self._cache_elements:
-            results = self._cache_elements[key]
+        results = self._cache_elements.get(key, MISSING)
         # Otherwise, fetch them from the XML file:
-        else:
+        if results is MISSING:
             xml_doc = self._get_xml_doc(entity)
             results = xml_doc.findall("//"+tag+"[@name='"+name_attr+"']")
             self._cache_elements[key] = results
@@ -93,6 +501,20 @@ class XmlDb(object):
             pass
         return self._get_unique_element_by_name_attr(entity, name_attr, tag='*')
 
+    def _cached_record(self, kind, entity, element, compute):
+        '''
+        Returns compute(entity, element), cached as record (kind, entity, name)
+        if the element is given by name (a copy of the cached list is returned).
+        '''
+        if type(element) != str:
+            return compute(entity, element)
+        key = (kind, entity, element)
+        record = self._cache_records.get(key, MISSING)
+        if record is MISSING:
+            record = tuple(compute(entity, element))
+            self._cache_records[key] = record
+        return list(record)
+
     def find_field(self, entity, field):
         return self._get_single_element_by_name_attr_prefer_field(entity, field)
 
@@ -133,6 +555,9 @@ class XmlDb(object):
         Returns:
         list -- containing all addresses of an element
         '''
+        return self._cached_record('addresses', entity, element, self._compute_all_element_addresses)
+
+    def _compute_all_element_addresses(self, entity, element):
         base_address, slices, stepsize, size = self._get_element_addressing(entity, element)
         return [base_address + i * stepsize for i in range(slices or 1)]
 
@@ -143,6 +568,9 @@ class XmlDb(object):
         tag in the .xml file corresponding to entity.
         Returns a list of all fields contained in the element.
         '''
+        return self._cached_record('fields', entity, element, self._compute_contained_fields)
+
+    def _compute_contained_fields(self, entity, element):
         if type(element) == str:
             element = self._get_single_element_by_name_attr_prefer_field(entity, element)
         if element.tag == 'field' and element.get('name'):
@@ -151,6 +579,9 @@ class XmlDb(object):
         return [field.get('name') for field in fields]
 
     def _determine_continuous_register_blocks(self, entity, element):
+        return self._cached_record('blocks', entity, element, self._compute_continuous_register_blocks)
+
+    def _compute_continuous_register_blocks(self, entity, element):
         register_blocks = []
         if type(element) == str:
             element = self._get_single_element_by_name_attr_prefer_field(entity, element)
@@ -166,6 +597,34 @@ class XmlDb(object):
                 register_blocks += self._determine_continuous_register_blocks(entity, child)
         return register_blocks
 
+    def static_register_addresses(self, entity, purposes=STATIC_PURPOSES, names=STATIC_NAMES):
+        '''
+        Find the registers of an entity that don't change at runtime:
+        registers with a purpose attribute (or a parent with one) in
+        purposes, or with a name (or the name of a parent) matching one
+        of the fnmatch patterns in names.
+
+        Returns:
+        list -- sorted register addresses
+        '''
+        addresses = set()
+        for register in self._get_entity_element(entity).iter('register'):
+            static = False
+            node = register
+            while node is not None and node.tag in self.ENTITY_TAGS:
+                purpose = node.get('purpose')
+                if (purpose is not None and purpose in purposes) or \
+                   any(fnmatch.fnmatchcase(node.get('name', ''), pattern) for pattern in names):
+                    static = True
+                    break
+                if purpose is not None:
+                    # the closest purpose attribute decides
+                    break
+                node = node.getparent()
+            if static:
+                addresses.update(self._get_all_element_addresses(entity, register))
+        return sorted(addresses)
+
     def _get_field_identifier(self, entity, field_name, trb_address, slice=None):
         identifier = "{}-0x{:04x}-{}".format(entity, trb_address, field_name)
         if slice is not None:
@@ -175,8 +634,9 @@ class XmlDb(object):
     def _get_field_hierarchy(self, entity, field):
         # Try to fetch the field hierarchy from the cache and return it:
         key = (entity, field)
-        if key in self._cache_field_hierarchy:
-            return self._cache_field_hierarchy[key]
+        hierarchy = self._cache_field_hierarchy.get(key, MISSING)
+        if hierarchy is not MISSING:
+            return hierarchy
         # Otherwise, construct the hierarchy by walking up the tree from the
         # to the top level XML entity and add it to the cache:
         if type(field) == str:
@@ -194,8 +654,9 @@ class XmlDb(object):
     def _get_field_info(self, entity, field):
         # Try to fetch the field info from the cache and return it:
         key = (entity, field)
-        if key in self._cache_field_info:
-            return self._cache_field_info[key]
+        info = self._cache_field_info.get(key, MISSING)
+        if info is not MISSING:
+            return info
         # Otherwise, construct the field info by reading in its XML information
         if type(field) == str:
             field = self.find_field(entity, field)
@@ -223,90 +684,64 @@ class XmlDb(object):
         self._cache_field_info[key] = info
         return info
 
-    def convert_field(self, entity, field_name, register_word, trb_address=0xffff, slice=None):
+    def convert_field_array(self, entity, field_name, register_words):
+        '''
+        Vectorized conversion of an array of register words to the numeric
+        values of a field: scaled values for the formats unsigned, integer,
+        signed and float, the raw field values for all other formats.
+
+        Returns:
+        numpy.ndarray -- of the same shape as register_words (dtype int64 or float64)
+        '''
         info = self._get_field_info(entity, field_name)
-        address = info['addresses'][slice if slice is not None else 0]
-        start = info['start']
-        bits = info['bits']
+        words = np.asarray(register_words, dtype=np.uint64)
+        raw = (words >> info['start']) & ((1 << info['bits']) - 1)
         format = info['format']
-        unit = info['unit']
-        scale = info['scale']
-        scaleoffset = info['scaleoffset']
-        meta = info['meta']
-        #errorFlag = 
-        #invertFlag = 
-        raw = (register_word >> start) & ((1 << bits) -1)
-        value = {
-            'raw': raw,
-            'string': raw,
-            'python': None,
-            'unicode': None,
-          }
-        if format == 'unsigned':
-            val = round(scale * raw + scaleoffset)
-            val = val if val >= 0 else 0
-            value['python'] = val
-            value['string'] = str(val)
+        if format in ('unsigned', 'integer', 'signed'):
+            values = np.round(info['scale'] * raw + info['scaleoffset']).astype(np.int64)
+            if format == 'unsigned':
+                values = np.clip(values, 0, None)
+            return values
         elif format == 'float':
-            val = float(raw)
-            val *= scale
-            val += scaleoffset
-            value['python'] = val
-            value['string'] = '%.2f' % val
-        elif format == 'time':
-            val = dt.utcfromtimestamp(raw)
-            value['python'] = val
-            value['string'] = val.strftime('%Y-%m-%d %H:%M')
-        elif format == 'hex':
-            fmt = '0x{:0%dx}' % ((bits+3)/4)
-            value['python'] = raw
-            value['string'] = fmt.format(raw)
-        elif format in ('integer', 'signed'):
-            val = round(scale * raw + scaleoffset)
-            value['python'] = val
-            value['string'] = str(val)
-        elif format == 'boolean':
-            val = bool(raw)
-            value['python'] = val
-            value['string'] = str(val).lower()
-        elif format == 'enum':
-            DynamicEnum = meta['enum']
-            if raw in meta['choices']:
-                value['python'] = DynamicEnum(raw)
-                value['string'] = meta['choices'][raw]
-            else:
-                value['python'] = raw
-                value['string'] = str(raw)
-        elif format == 'bitmask':
-            fmt = '{:0%db}' % (bits)
-            val = fmt.format(raw)
-            value['python'] = raw
-            value['string'] = val
-            value['unicode'] = val.replace('0', '□').replace('1', '■')
-        elif format == 'binary':
-            fmt = '0b{:0%db}' % (bits)
-            value['python'] = raw
-            value['string'] = fmt.format(raw)
-        else:
-            raise NotImplementedError('format: ' + format)
-        if value['unicode'] is None:
-            value['unicode'] = value['string']
-        if unit:
-            value['string'] += ' ' + unit
-            value['unicode'] += ' ' + unit
-        identifier = self._get_field_identifier(entity, field_name, trb_address, slice=slice)
-        hierarchy = self._get_field_hierarchy(entity, field_name)
-        context = {
-          'address': address,
-          'identifier': identifier,
-          'hierarchy': hierarchy,
-          'trb_address': trb_address,
-          'field_name': field_name,
-        }
-        return {
-            'value': value,
-            'unit': unit,
-            'meta': meta,
-            'format': format,
-            'context': context
-          }
+            return info['scale'] * raw + info['scaleoffset']
+        return raw.astype(np.int64)
+
+    def _get_field_spec(self, entity, field):
+        # Try to fetch the precompiled field spec from the cache and return it:
+        key = (entity, field)
+        spec = self._cache_field_spec.get(key, MISSING)
+        if spec is not MISSING:
+            return spec
+        field_name = field if type(field) == str else field.get('name')
+        spec = FieldSpec(entity, field_name, self._get_field_info(entity, field),
+                         self._get_field_hierarchy(entity, field))
+        self._cache_field_spec[key] = spec
+        return spec
+
+    def convert_field(self, entity, field_name, register_word, trb_address=0xffff, slice=None):
+        '''
+        Extract a field from a register word.
+
+        Returns:
+        FieldValue -- computing the representations of the value on access
+                      (mapping compatible: data['value']['string'], data['context'], ...)
+        '''
+        spec = self._get_field_spec(entity, field_name)
+        return FieldValue(spec, (register_word >> spec.start) & spec.mask, trb_address, slice)
+
+def _export_compiled(db, entity):
+    '''
+    XmlDb.export_compiled() of an XmlDb instance or an XmlDb(folder)
+    created in a worker process of XmlDb.preload().
+
+    Returns:
+    tuple -- (seconds, compiled records or None, error message or None)
+    '''
+    start = time.perf_counter()
+    if not isinstance(db, XmlDb):
+        db = XmlDb(db)
+    try:
+        compiled = db.export_compiled(entity)
+    except (OSError, ValueError, etree.LxmlError) as e:
+        return time.perf_counter() - start, None, str(e)
+    return time.perf_counter() - start, compiled, None
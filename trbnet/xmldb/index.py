@@ -0,0 +1,45 @@
+import bisect
+from collections import namedtuple
+
+IndexEntry = namedtuple('IndexEntry', ['start', 'stop', 'entity', 'field_name', 'slice'])
+IndexEntry.__doc__ = '''
+A field of an entity located in the registers start ... stop - 1
+(slice: index of the repetition or None if the field is not repeated).
+'''
+
+class AddressIndex(object):
+    '''
+    Reverse index from register addresses to XmlDb fields, answering
+    "which fields live at address X / in the range [A, B)" with a binary
+    search over the sorted start addresses (O(log n + number of matches)).
+
+    Built by XmlDb.address_index() from the addressing of all fields
+    (every slice of repeated fields is a separate entry).
+    '''
+
+    def __init__(self, entries):
+        self.entries = sorted(entries)
+        self.starts = [entry.start for entry in self.entries]
+        # entries starting up to max_size - 1 registers before an address can cover it
+        self.max_size = max((entry.stop - entry.start for entry in self.entries), default=1)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def fields_in(self, start, stop, entity=None):
+        '''
+        Returns:
+        list -- IndexEntry of all fields overlapping the registers start ... stop - 1
+                (of the given entity only, if not None), sorted by address
+        '''
+        first = bisect.bisect_left(self.starts, start - self.max_size + 1)
+        last = bisect.bisect_left(self.starts, stop)
+        return [entry for entry in self.entries[first:last]
+                if entry.stop > start and (entity is None or entry.entity == entity)]
+
+    def fields_at(self, address, entity=None):
+        '''
+        Returns:
+        list -- IndexEntry of all fields located in the register at address
+        '''
+        return self.fields_in(address, address + 1, entity=entity)
@@ -0,0 +1,144 @@
+import sys
+from collections import OrderedDict
+
+MISSING = object()
+
+def approximate_size(obj, _depth=0):
+    '''
+    Approximate memory footprint of obj in bytes: sys.getsizeof() of obj and
+    (up to a limited depth) of the items of containers and the attributes of
+    objects with __slots__. Shared objects are counted for every reference.
+    '''
+    size = sys.getsizeof(obj)
+    if _depth > 4:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approximate_size(k, _depth + 1) + approximate_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, _depth + 1) for item in obj)
+    elif hasattr(type(obj), '__slots__'):
+        for name in type(obj).__slots__:
+            value = getattr(obj, name, None)
+            if value is not None and not isinstance(value, type):
+                size += approximate_size(value, _depth + 1)
+    return size
+
+class LRUCache(object):
+    '''
+    Dictionary-like cache holding at most maxsize entries (None: unbounded),
+    evicting the least recently used entry first. Hits, misses and evictions
+    are counted, the (approximate) size of the cached values in bytes is
+    computed by .statistics().
+
+    Arguments:
+    maxsize -- maximum number of entries (None: unbounded)
+    sizeof -- callable returning the size of a value in bytes (default: approximate_size)
+    group -- callable returning the group of a key, to remove all entries
+             of a group with .discard_group() (default: no groups)
+    '''
+
+    def __init__(self, maxsize=None, sizeof=approximate_size, group=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.group = group
+        self._data = OrderedDict()
+        self._groups = {}  # {group: set of keys}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _ungroup(self, key):
+        if self.group is not None:
+            keys = self._groups.get(self.group(key))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._groups[self.group(key)]
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self._data.move_to_end(key)
+        elif self.group is not None:
+            self._groups.setdefault(self.group(key), set()).add(key)
+        self._data[key] = value
+        while self.maxsize is not None and len(self._data) > self.maxsize:
+            evicted_key, _ = self._data.popitem(last=False)
+            self._ungroup(evicted_key)
+            self.evictions += 1
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data.pop(key)
+        self._ungroup(key)
+        return value
+
+    def group_keys(self, group):
+        '''
+        Returns:
+        list -- keys of the entries of a group
+        '''
+        return list(self._groups.get(group, ()))
+
+    def discard_group(self, group, predicate=None):
+        '''
+        Remove all entries of a group (whose key satisfies predicate(key), if given).
+
+        Returns:
+        int -- number of removed entries
+        '''
+        keys = [key for key in self.group_keys(group) if predicate is None or predicate(key)]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def discard_if(self, predicate):
+        '''
+        Remove all entries whose key satisfies predicate(key).
+
+        Returns:
+        int -- number of removed entries
+        '''
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+        self._groups.clear()
+
+    def statistics(self):
+        return {
+          'entries': len(self._data),
+          'maxsize': self.maxsize,
+          'bytes': sum(self.sizeof(value) for value in self._data.values()),
+          'hits': self.hits,
+          'misses': self.misses,
+          'evictions': self.evictions,
+        }
@@ -0,0 +1,142 @@
+import time
+
+import numpy as np
+
+class RateEngine(object):
+    '''
+    RateEngine computes rates of free-running counter fields (hit counters,
+    trigger counters, ...) from successive readings of their raw values.
+
+    The last raw value and timestamp of every tracked counter is kept in
+    compact NumPy arrays, one row per (trb_address, reg_address, entity, field).
+    Rates are computed for all counters of an update at once and take the
+    wraparound of the counter into account (modulo 2^bits, the bit width
+    being taken from the XmlDb field definition). This is only correct as
+    long as a counter does not wrap around more than once between two
+    readings.
+
+    >>> engine = RateEngine(XmlDb())
+    >>> engine.update(_xmlget(0xffff, 'TrbNet', 'HitCounter'))
+    {}
+    >>> engine.update(_xmlget(0xffff, 'TrbNet', 'HitCounter'))
+    {'TrbNet-0x8000-HitCounter.0': 1211.3, ...}
+    '''
+
+    def __init__(self, db, capacity=64):
+        self.db = db
+        self._rows = {}
+        self._identifiers = []
+        self._size = 0
+        self._last_raw = np.zeros(capacity, dtype=np.uint64)
+        self._last_time = np.zeros(capacity, dtype=np.float64)
+        self._modulus = np.zeros(capacity, dtype=np.uint64)
+        self._scale = np.zeros(capacity, dtype=np.float64)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._rate = np.full(capacity, np.nan, dtype=np.float64)
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, capacity):
+        for name in ('_last_raw', '_last_time', '_modulus', '_scale', '_valid', '_rate'):
+            old = getattr(self, name)
+            new = np.full(capacity, np.nan) if name == '_rate' else np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _row(self, trb_address, reg_address, entity, field_name, identifier):
+        '''
+        Returns the row index of a counter, allocating a new row
+        (and looking up its bit width and scale) if it is new.
+        '''
+        key = (trb_address, reg_address, entity, field_name)
+        row = self._rows.get(key)
+        if row is not None:
+            return row
+        row = self._size
+        if row >= len(self._valid):
+            self._grow(2 * len(self._valid))
+        info = self.db._get_field_info(entity, field_name)
+        self._modulus[row] = 1 << info['bits']
+        self._scale[row] = info['scale']
+        self._rows[key] = row
+        self._identifiers.append(identifier)
+        self._size += 1
+        return row
+
+    def update(self, results, timestamp=None):
+        '''
+        Feed the engine with converted field values as returned by
+        XmlDb.convert_field() / _xmlget() and compute the new rates.
+
+        Arguments:
+        results -- iterable of FieldValue objects
+        timestamp -- time of the reading in seconds (default: time.time())
+
+        Returns:
+        dict -- key: field identifier, value: rate in (scaled) counts per second.
+                Counters seen for the first time are not contained.
+        '''
+        rows, raws = [], []
+        for data in results:
+            rows.append(self._row(data.trb_address, data.address,
+                                  data.spec.entity, data.spec.field_name,
+                                  data.identifier))
+            raws.append(data.raw)
+        if not rows:
+            return {}
+        rows = np.array(rows, dtype=np.intp)
+        rates = self.update_raw(rows, np.array(raws, dtype=np.uint64), timestamp=timestamp)
+        valid = ~np.isnan(rates)
+        identifiers = self._identifiers
+        return {identifiers[row]: rate for row, rate in zip(rows[valid].tolist(), rates[valid].tolist())}
+
+    def update_raw(self, rows, raws, timestamp=None):
+        '''
+        Vectorized update for already known counter rows.
+
+        Arguments:
+        rows -- array of row indices
+        raws -- array of raw counter values (same length as rows)
+        timestamp -- time of the reading in seconds (default: time.time())
+
+        Returns:
+        numpy.ndarray -- the rates for the given rows (NaN if not yet available)
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        modulus = self._modulus[rows]
+        raws = np.asarray(raws, dtype=np.uint64) % modulus
+        delta = (raws + modulus - self._last_raw[rows]) % modulus
+        dt = timestamp - self._last_time[rows]
+        valid = self._valid[rows] & (dt > 0)
+        rates = np.full(len(rows), np.nan)
+        rates[valid] = delta[valid] * self._scale[rows][valid] / dt[valid]
+        self._rate[rows] = rates
+        self._last_raw[rows] = raws
+        self._last_time[rows] = timestamp
+        self._valid[rows] = True
+        return rates
+
+    def rate(self, trb_address, reg_address, entity, field_name):
+        '''
+        Returns the last computed rate of a counter or None if not available.
+        '''
+        row = self._rows.get((trb_address, reg_address, entity, field_name))
+        if row is None or np.isnan(self._rate[row]):
+            return None
+        return float(self._rate[row])
+
+    def rates(self):
+        '''
+        Returns all currently available rates as dict (key: field identifier).
+        '''
+        rates = self._rate[:self._size]
+        return {identifier: rate for identifier, rate in zip(self._identifiers, rates.tolist()) if not np.isnan(rate)}
+
+    def reset(self):
+        '''
+        Forget all previous readings (the next update will not yield rates).
+        '''
+        self._valid[:] = False
+        self._rate[:] = np.nan
@@ -0,0 +1,146 @@
+import re
+import bisect
+import shlex
+import fnmatch
+from collections import namedtuple
+
+SearchResult = namedtuple('SearchResult', ['entity', 'field_name', 'path', 'addresses', 'unit', 'format', 'description'])
+SearchResult.__doc__ = '''
+A field found by FieldSearchIndex.search() (path: names from the entity down to the field).
+'''
+
+KEYS = ('entity', 'name', 'path', 'unit', 'format', 'description')
+_WILDCARDS = re.compile(r'[*?\[]')
+_LITERAL_SEPARATORS = re.compile(r'[*?]|\[[^\]]*\]')
+
+def _document_terms(key, document):
+    '''
+    Returns the (lower case) terms of a document indexed for key.
+    '''
+    if key == 'name':
+        return {document.field_name.lower()}
+    elif key == 'path':
+        return {part.lower() for part in document.path} | {'/'.join(document.path).lower()}
+    elif key == 'description':
+        return set(re.findall(r'\w+', document.description.lower()))
+    value = getattr(document, key)
+    return {value.lower()} if value else set()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class _TermIndex(object):
+    '''
+    The sorted vocabulary of a key with the postings (document ids) of every
+    term and a trigram index over the terms for wildcard queries.
+    '''
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.terms = sorted(postings)
+        # reversed terms for suffix queries ('*suffix')
+        self.suffixes = sorted((term[::-1], term) for term in self.terms)
+        self.trigrams = {}
+        for i, term in enumerate(self.terms):
+            for trigram in _trigrams(term):
+                self.trigrams.setdefault(trigram, set()).add(i)
+
+    def exact(self, term):
+        return self.postings.get(term, set())
+
+    def wildcard(self, pattern):
+        if pattern.startswith('*') and not _WILDCARDS.search(pattern[1:]):
+            suffix = pattern[:0:-1]
+            first = bisect.bisect_left(self.suffixes, (suffix,))
+            last = bisect.bisect_left(self.suffixes, (suffix + '\U0010ffff',))
+            return self._union(term for _, term in self.suffixes[first:last])
+        # candidates: the terms starting with the literal prefix of the pattern
+        # and containing all trigrams of its literal parts
+        prefix = _WILDCARDS.split(pattern, 1)[0]
+        first = bisect.bisect_left(self.terms, prefix)
+        last = bisect.bisect_left(self.terms, prefix + '\U0010ffff')
+        trigrams = set()
+        for literal in _LITERAL_SEPARATORS.split(pattern):
+            trigrams |= _trigrams(literal)
+        if trigrams:
+            candidates = set.intersection(*(self.trigrams.get(trigram, set()) for trigram in trigrams))
+            candidates = sorted(i for i in candidates if first <= i < last)
+        else:
+            candidates = range(first, last)
+        regex = re.compile(fnmatch.translate(pattern))
+        return self._union(self.terms[i] for i in candidates if regex.match(self.terms[i]))
+
+    def regex(self, regex):
+        return self._union(term for term in self.terms if regex.search(term))
+
+    def _union(self, terms):
+        ids = set()
+        for term in terms:
+            ids |= self.postings[term]
+        return ids
+
+class FieldSearchIndex(object):
+    '''
+    In-memory inverted index over the names, hierarchy paths, units, formats
+    and descriptions of XmlDb fields, built by XmlDb.search_index().
+
+    A query consists of whitespace separated terms, all of which have to
+    match (case-insensitive). A term can be restricted to one of KEYS
+    with a prefix (e.g. 'unit:mV') and is either
+
+    * a plain word: an exact match of a name, path element, unit, format or word of the description
+    * a wildcard pattern (fnmatch style, e.g. 'Temp*' or '*Counter*')
+    * a regular expression between slashes (e.g. '/^hit.*[0-9]$/')
+
+    Plain words, prefixes and suffixes are dictionary/binary search lookups,
+    other wildcards use a trigram index; regular expressions scan the vocabulary.
+
+    >>> db.search_index().search('name:*Temp* unit:°C')
+    [SearchResult(entity='TrbNet', field_name='Temperature', ...)]
+    '''
+
+    def __init__(self, documents):
+        # document ids in the order of the results
+        self.documents = sorted(documents, key=lambda doc: (doc.entity, doc.path))
+        postings = {key: {} for key in KEYS}
+        for doc_id, document in enumerate(self.documents):
+            for key in KEYS:
+                for term in _document_terms(key, document):
+                    postings[key].setdefault(term, set()).add(doc_id)
+        self.indexes = {key: _TermIndex(postings[key]) for key in KEYS}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _match(self, term):
+        key, sep, value = term.partition(':')
+        if sep and key.lower() in KEYS:
+            keys = (key.lower(),)
+        else:
+            keys, value = KEYS, term
+        ids = set()
+        if len(value) > 1 and value.startswith('/') and value.endswith('/'):
+            regex = re.compile(value[1:-1], re.IGNORECASE)
+            for key in keys:
+                ids |= self.indexes[key].regex(regex)
+        elif _WILDCARDS.search(value):
+            for key in keys:
+                ids |= self.indexes[key].wildcard(value.lower())
+        else:
+            for key in keys:
+                ids |= self.indexes[key].exact(value.lower())
+        return ids
+
+    def search(self, query, limit=None):
+        '''
+        Returns:
+        list -- SearchResult of the fields matching all terms of query,
+                sorted by entity and path (at most limit results)
+        '''
+        ids = None
+        for term in shlex.split(query):
+            matches = self._match(term)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
+        return [self.documents[doc_id] for doc_id in sorted(ids or ())[:limit]]
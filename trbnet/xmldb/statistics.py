@@ -0,0 +1,120 @@
+import numpy as np
+
+class StreamingStatistics(object):
+    '''
+    Streaming statistics (count, mean, std, min, max and histogram) of the
+    values of a single XmlDb field. The statistics are updated with chunks
+    of raw register words, so an arbitrary number of samples can be processed
+    with bounded memory. Means and variances of the chunks are combined with
+    the parallel algorithm by Chan et al.
+
+    The histogram covers the full range of the field: fields with up to
+    hist_bits bits get one bin per raw value, wider fields are binned into
+    2^hist_bits bins of equal width.
+    '''
+
+    def __init__(self, start=0, bits=32, scale=1.0, scaleoffset=0.0, hist_bits=12):
+        self.start = start
+        self.bits = bits
+        self.scale = scale
+        self.scaleoffset = scaleoffset
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = None
+        self._max = None
+        self._shift = max(0, bits - hist_bits)
+        self._hist = np.zeros(1 << (bits - self._shift), dtype=np.int64)
+
+    @classmethod
+    def from_field_info(cls, info, **kwargs):
+        return cls(start=info['start'], bits=info['bits'],
+                   scale=info['scale'], scaleoffset=info['scaleoffset'], **kwargs)
+
+    def update(self, words):
+        '''
+        Add the field values contained in an array of raw register words.
+        '''
+        words = np.asarray(words, dtype=np.uint64)
+        if not words.size:
+            return
+        raw = (words >> self.start) & ((1 << self.bits) - 1)
+        self._hist += np.bincount((raw >> self._shift).astype(np.intp), minlength=len(self._hist))
+        raw_min, raw_max = int(raw.min()), int(raw.max())
+        self._min = raw_min if self._min is None else min(self._min, raw_min)
+        self._max = raw_max if self._max is None else max(self._max, raw_max)
+        n = raw.size
+        mean = raw.mean()
+        m2 = np.square(raw - mean).sum()
+        total = self.count + n
+        delta = mean - self._mean
+        self._mean += delta * n / total
+        self._m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    def _scaled(self, value):
+        return self.scale * value + self.scaleoffset
+
+    @property
+    def mean(self):
+        return self._scaled(self._mean) if self.count else None
+
+    @property
+    def std(self):
+        return abs(self.scale) * (self._m2 / self.count) ** 0.5 if self.count else None
+
+    @property
+    def min(self):
+        return None if self._min is None else self._scaled(self._min if self.scale >= 0 else self._max)
+
+    @property
+    def max(self):
+        return None if self._max is None else self._scaled(self._max if self.scale >= 0 else self._min)
+
+    def histogram(self):
+        '''
+        Returns:
+        tuple -- (counts, lower bin edges in scaled units) of the non-empty bins
+        '''
+        bins = np.flatnonzero(self._hist)
+        return self._hist[bins], self._scaled((bins << self._shift).astype(np.float64))
+
+    def as_dict(self):
+        return {
+          'count': self.count,
+          'mean': self.mean,
+          'std': self.std,
+          'min': self.min,
+          'max': self.max,
+        }
+
+
+def sample_statistics(db, entity, name, samples, statistics=None, reg_address=None):
+    '''
+    Update per field statistics with samples of the register containing
+    the XmlDb element name (a register or a field).
+
+    Arguments:
+    db -- XmlDb instance
+    samples -- tuple (trb_addresses, matrix) as returned by TrbNet.sample_register()
+    statistics -- dict to update as returned by a previous call (default: new dict)
+    reg_address -- the sampled register: only the fields located in it are
+                   updated (default: all fields of name, which then has to be
+                   a single register)
+
+    Returns:
+    dict -- key: (trb_address, field_name), value: StreamingStatistics
+    '''
+    if statistics is None:
+        statistics = {}
+    trb_addresses, matrix = samples
+    for field_name in db._contained_fields(entity, name):
+        if reg_address is not None and reg_address not in db._get_all_element_addresses(entity, field_name):
+            continue
+        info = db._get_field_info(entity, field_name)
+        for row, trb_address in enumerate(trb_addresses):
+            key = (trb_address, field_name)
+            if key not in statistics:
+                statistics[key] = StreamingStatistics.from_field_info(info)
+            statistics[key].update(matrix[row])
+    return statistics
@@ -0,0 +1,223 @@
+import enum
+from collections.abc import Mapping
+from datetime import datetime as dt
+
+class FieldSpec(object):
+    '''
+    Precompiled definition of a field (shared by all values of the field)
+    with the conversions of its raw value to the different representations.
+    Created by XmlDb._get_field_spec().
+
+    The enum class of enum fields is created on first use (and recreated
+    after unpickling, as dynamically created enums can't be pickled).
+    '''
+
+    __slots__ = ('entity', 'field_name', 'addresses', 'hierarchy', 'start', 'bits', 'mask',
+                 'format', 'unit', 'scale', 'scaleoffset', 'choices', '_enum')
+
+    def __init__(self, entity, field_name, info, hierarchy):
+        self.entity = entity
+        self.field_name = field_name
+        self.addresses = info['addresses']
+        self.hierarchy = hierarchy
+        self.start = info['start']
+        self.bits = info['bits']
+        self.mask = (1 << self.bits) - 1
+        self.format = info['format']
+        self.unit = info['unit']
+        self.scale = info['scale']
+        self.scaleoffset = info['scaleoffset']
+        self.choices = info['meta'].get('choices')
+        self._enum = info['meta'].get('enum')
+        if self.format not in _CONVERSIONS:
+            raise NotImplementedError('format: ' + self.format)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != '_enum'}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._enum = None
+
+    @property
+    def enum(self):
+        if self._enum is None and self.choices is not None:
+            self._enum = enum.Enum(self.field_name, {v: k for k, v in self.choices.items()})
+        return self._enum
+
+    @property
+    def meta(self):
+        if self.format == 'enum':
+            return {'choices': self.choices, 'enum': self.enum}
+        return {}
+
+    def python(self, raw):
+        return _CONVERSIONS[self.format][0](self, raw)
+
+    def string(self, raw):
+        string = _CONVERSIONS[self.format][1](self, raw)
+        return string + ' ' + self.unit if self.unit else string
+
+    def unicode(self, raw):
+        if self.format != 'bitmask':
+            return self.string(raw)
+        string = _bitmask_string(self, raw).replace('0', '□').replace('1', '■')
+        return string + ' ' + self.unit if self.unit else string
+
+def _unsigned(spec, raw):
+    val = round(spec.scale * raw + spec.scaleoffset)
+    return val if val >= 0 else 0
+
+def _float(spec, raw):
+    return float(raw) * spec.scale + spec.scaleoffset
+
+def _integer(spec, raw):
+    return round(spec.scale * raw + spec.scaleoffset)
+
+def _enum(spec, raw):
+    return spec.enum(raw) if raw in spec.choices else raw
+
+def _enum_string(spec, raw):
+    return spec.choices[raw] if raw in spec.choices else str(raw)
+
+def _bitmask_string(spec, raw):
+    return '{:0{}b}'.format(raw, spec.bits)
+
+_identity = lambda spec, raw: raw
+
+# format: (python conversion, string conversion (without unit))
+_CONVERSIONS = {
+    'unsigned': (_unsigned, lambda spec, raw: str(_unsigned(spec, raw))),
+    'float': (_float, lambda spec, raw: '%.2f' % _float(spec, raw)),
+    'time': (lambda spec, raw: dt.utcfromtimestamp(raw),
+             lambda spec, raw: dt.utcfromtimestamp(raw).strftime('%Y-%m-%d %H:%M')),
+    'hex': (_identity, lambda spec, raw: '0x{:0{}x}'.format(raw, (spec.bits + 3) // 4)),
+    'integer': (_integer, lambda spec, raw: str(_integer(spec, raw))),
+    'signed': (_integer, lambda spec, raw: str(_integer(spec, raw))),
+    'boolean': (lambda spec, raw: bool(raw), lambda spec, raw: str(bool(raw)).lower()),
+    'enum': (_enum, _enum_string),
+    'bitmask': (_identity, _bitmask_string),
+    'binary': (_identity, lambda spec, raw: '0b{:0{}b}'.format(raw, spec.bits)),
+}
+
+class FieldRepresentations(Mapping):
+    '''
+    The representations 'raw', 'python', 'string' and 'unicode' of
+    a field value, computed on access (FieldValue['value']).
+    '''
+
+    __slots__ = ('_field_value',)
+    KEYS = ('raw', 'string', 'python', 'unicode')
+
+    def __init__(self, field_value):
+        self._field_value = field_value
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self._field_value, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+class FieldValue(Mapping):
+    '''
+    The value of a field as returned by XmlDb.convert_field(): the raw field
+    value, the responding trb address and the slice, plus a reference to the
+    shared FieldSpec of the field. All representations are computed on
+    access, either as attributes (.python, .string, .identifier, ...) or,
+    for backwards compatibility, like the nested dict returned previously:
+
+    >>> data = db.convert_field('TrbNet', 'CompileTime', 0x5a000000, trb_address=0x8000)
+    >>> data['value']['string'], data['context']['identifier']
+    ('2017-11-06 06:24', 'TrbNet-0x8000-CompileTime')
+    >>> "{context[identifier]} {value[unicode]} {unit}".format(**data)
+    'TrbNet-0x8000-CompileTime 2017-11-06 06:24 '
+    '''
+
+    __slots__ = ('spec', 'raw', 'trb_address', 'slice')
+    KEYS = ('value', 'unit', 'meta', 'format', 'context')
+
+    def __init__(self, spec, raw, trb_address=0xffff, slice=None):
+        self.spec = spec
+        self.raw = raw
+        self.trb_address = trb_address
+        self.slice = slice
+
+    @property
+    def python(self):
+        return self.spec.python(self.raw)
+
+    @property
+    def string(self):
+        return self.spec.string(self.raw)
+
+    @property
+    def unicode(self):
+        return self.spec.unicode(self.raw)
+
+    @property
+    def identifier(self):
+        identifier = "{}-0x{:04x}-{}".format(self.spec.entity, self.trb_address, self.spec.field_name)
+        if self.slice is not None:
+            identifier += "." + str(self.slice)
+        return identifier
+
+    @property
+    def address(self):
+        return self.spec.addresses[self.slice if self.slice is not None else 0]
+
+    @property
+    def context(self):
+        spec = self.spec
+        return {
+          'address': self.address,
+          'identifier': self.identifier,
+          'hierarchy': spec.hierarchy,
+          'trb_address': self.trb_address,
+          'entity': spec.entity,
+          'field_name': spec.field_name,
+          'slice': self.slice,
+          'start': spec.start,
+          'bits': spec.bits,
+        }
+
+    def __getitem__(self, key):
+        if key == 'value':
+            return FieldRepresentations(self)
+        elif key == 'context':
+            return self.context
+        elif key == 'unit':
+            return self.spec.unit
+        elif key == 'format':
+            return self.spec.format
+        elif key == 'meta':
+            return self.spec.meta
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return '<FieldValue {} {}>'.format(self.identifier, self.unicode)
+
+    def to_dict(self):
+        '''
+        Returns:
+        dict -- the nested dict with all representations (as returned by
+                XmlDb.convert_field() before FieldValue was introduced)
+        '''
+        return {
+          'value': dict(self['value']),
+          'unit': self.spec.unit,
+          'meta': self.spec.meta,
+          'format': self.spec.format,
+          'context': self.context,
+        }
@@ -0,0 +1,42 @@
+import threading, logging
+
+logger = logging.getLogger('trbnet.xmldb.watch')
+
+class XmlDbWatcher(object):
+    '''
+    Background thread calling XmlDb.check_for_changes() every interval
+    seconds, so that the subscribers of the XmlDb are notified about
+    changed XML files.
+
+    The subscribers are called from the watcher thread. Applications
+    which are not thread-safe (such as the IOC) should rather call
+    XmlDb.check_for_changes() from their own loop.
+
+    >>> db.subscribe(lambda entity: print(entity, 'changed'))
+    >>> watcher = XmlDbWatcher(db, interval=2.0).start()
+    '''
+
+    def __init__(self, db, interval=2.0):
+        self.db = db
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='xmldb-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.db.check_for_changes()
+            except Exception as e:
+                logger.error('Checking the XmlDb for changes failed: %s', e)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None